@@ -1,11 +1,15 @@
 from abc import ABCMeta
 from abc import abstractmethod
+from datetime import datetime
 from typing import Sequence
 
+import attr
+
 from .exceptions import InvalidArchive
 from .meta import BeadName
 from .meta import InputSpec
 from .tech.timestamp import time_from_timestamp
+from .tech.timestamp import unix_microseconds
 
 
 class Bead:
@@ -20,6 +24,9 @@ class Bead:
     or how to find the referenced input beads.
     '''
 
+    # no instance state here, so that subclasses can be slotted
+    __slots__ = ()
+
     # high level view of computation
     kind: str
     # kind is deprecated. Humans naturally agree on domain specific names instead.
@@ -43,6 +50,56 @@ class Bead:
                 return input
 
 
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class BeadRecord(Bead):
+    '''
+    Immutable metadata of a stored bead, as returned by box queries.
+
+    Slotted to keep large query results small.
+    Inputs are materialized on first access, freeze_time is parsed at most once.
+    '''
+    name: str
+    content_id: str
+    kind: str
+    freeze_time_str: str
+    # UTC unix time in microseconds - for cheap ordering
+    freeze_time_unix: int
+    box_name: str
+    # InputSpec-s or (name, kind, content_id, freeze_time_str) tuples of trusted values
+    _input_rows: Sequence = attr.ib(default=(), eq=False, repr=False)
+    _inputs: tuple | None = attr.ib(default=None, init=False, eq=False, repr=False)
+    _freeze_time: datetime | None = attr.ib(default=None, init=False, eq=False, repr=False)
+
+    @property
+    def inputs(self):
+        if self._inputs is None:
+            inputs = tuple(
+                row if isinstance(row, InputSpec) else InputSpec.from_trusted(*row)
+                for row in self._input_rows)
+            object.__setattr__(self, '_inputs', inputs)
+        return self._inputs
+
+    @property
+    def freeze_time(self):
+        if self._freeze_time is None:
+            object.__setattr__(self, '_freeze_time', time_from_timestamp(self.freeze_time_str))
+        return self._freeze_time
+
+    @classmethod
+    def from_row(cls, row, box_name: str, input_rows: Sequence = ()) -> 'BeadRecord':
+        '''
+        Create from a (name, content_id, kind, freeze_time_str, freeze_time_unix) row of trusted values.
+        '''
+        name, content_id, kind, freeze_time_str, freeze_time_unix = row
+        return cls(name, content_id, kind, freeze_time_str, freeze_time_unix, box_name, input_rows)
+
+    @classmethod
+    def from_archive(cls, archive: 'Archive') -> 'BeadRecord':
+        return cls(
+            archive.name, archive.content_id, archive.kind, archive.freeze_time_str,
+            unix_microseconds(archive.freeze_time), archive.box_name, tuple(archive.inputs))
+
+
 class Archive(Bead, metaclass=ABCMeta):
     '''
     Provide high-level access to content of a bead.
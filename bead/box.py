@@ -12,30 +12,124 @@ Boxes can be used to:
 
 from abc import ABC
 from abc import abstractmethod
+import concurrent.futures
+import heapq
+import itertools
+import os
+import threading
+import time
 from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Iterable
+from typing import Iterator
 from typing import Protocol
+import warnings
 
 from . import tech
 from .bead import Archive
 from .bead import Bead
-from .box_index import index_path_exists, can_read_index, BoxIndex
+from .box_autoindex import AutoIndexPolicy
+from .box_autoindex import build_index
+from .box_catalog import BoxCatalog
+from .box_explain import QueryTrace
+from .box_explain import describe_conditions
+from .box_explain import describe_lookups
+from .box_index import index_path_exists, can_read_index, is_index_up_to_date, shadow_index_path, BoxIndex
+from .box_index import DEFAULT_INDEX_JOBS
+from .box_index import LOOKUP_BATCH_SIZE
+from .box_index import lookup_sql
+from .box_index import query_sql
+from .box_query import BeadLookup
 from .box_query import QueryCondition
+from .box_query import QueryOrder
+from .box_querycache import QueryCache
+from .box_rawcache import ArchiveCache
+from .box_rawcache import raw_cache_path
 from .box_rawfs import RawFilesystemResolver
 from .exceptions import BoxError
+from .exceptions import BoxIndexError
 from .exceptions import InvalidArchive
+from .tech.parallel import DaemonStream
+from .tech.parallel import call_on_daemon_thread
 from .tech.timestamp import time_from_timestamp
 from .ziparchive import ZipArchive
 
 Path = tech.fs.Path
 
+# Environment variable setting the search timeout (in seconds), 'off' disables it
+SEARCH_TIMEOUT_ENV = 'BEAD_BOX_SEARCH_TIMEOUT_SECONDS'
+
+# Seconds a box has to answer a search across multiple boxes, before it is skipped.
+# None: no limit - skipped boxes turn slow answers into wrong ones, so the timeout is opt-in.
+DEFAULT_SEARCH_TIMEOUT_SECONDS = None
+
+
+def search_timeout_from_environment(environ=os.environ) -> float | None:
+    value = environ.get(SEARCH_TIMEOUT_ENV)
+    if value is None:
+        return DEFAULT_SEARCH_TIMEOUT_SECONDS
+    if value.strip().lower() in ('', 'off', 'no', 'never'):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        warnings.warn(f'Ignoring {SEARCH_TIMEOUT_ENV}={value!r}: not a number of seconds')
+        return DEFAULT_SEARCH_TIMEOUT_SECONDS
+
+
+def search_timeout(box, boxes) -> float | None:
+    """
+    Seconds box has to answer a search of boxes.
+
+    A search of a single box has no timeout: skipping its only box could only turn a slow answer into "not found".
+    """
+    return box.search_timeout if len(boxes) > 1 else None
+
+
+def is_writable_directory(directory: Path) -> bool:
+    return os.access(directory, os.W_OK)
+
 
 class BoxResolver(Protocol):
     """
     Interface for bead storage and retrieval implementations.
     """
+
+    # changes with every change of the beads known to the resolver, None if unknown, see QueryCache
+    generation: Hashable | None
     
-    def get_beads(self, conditions: list[tuple[QueryCondition, Any]], box_name: str) -> list[Bead]:
-        """Retrieve beads matching conditions."""
+    def get_beads(
+            self,
+            conditions: list[tuple[QueryCondition, Any]],
+            box_name: str,
+            order: QueryOrder | None = None,
+            limit: int | None = None) -> list[Bead]:
+        """
+        Retrieve beads matching conditions.
+
+        With an order the beads are returned sorted by freeze time, otherwise in any order.
+        With a limit at most that many beads are returned (the first ones in order).
+        """
+        ...
+
+    def iter_beads(
+            self,
+            conditions: list[tuple[QueryCondition, Any]],
+            box_name: str,
+            order: QueryOrder | None = None,
+            limit: int | None = None) -> Iterator[Bead]:
+        """
+        Stream beads matching conditions, see get_beads for order and limit.
+        """
+        ...
+
+    def lookup_beads(self, lookups: list[BeadLookup], box_name: str) -> list[Bead | None]:
+        """
+        Answer many lookups at once, with a single pass over the box.
+
+        Returns the answering Bead (or None if there is none) for each lookup.
+        """
         ...
     
     def get_file_path(self, name: str, content_id: str) -> Path:
@@ -51,10 +145,30 @@ class NullResolver:
     """
     No-op resolver that returns empty results for all operations.
     """
+
+    generation = 0
     
-    def get_beads(self, conditions: list[tuple[QueryCondition, Any]], box_name: str) -> list[Bead]:
+    def get_beads(
+            self,
+            conditions: list[tuple[QueryCondition, Any]],
+            box_name: str,
+            order: QueryOrder | None = None,
+            limit: int | None = None) -> list[Bead]:
         """Return empty list - no beads found."""
         return []
+
+    def iter_beads(
+            self,
+            conditions: list[tuple[QueryCondition, Any]],
+            box_name: str,
+            order: QueryOrder | None = None,
+            limit: int | None = None) -> Iterator[Bead]:
+        """Return empty iterator - no beads found."""
+        return iter(())
+
+    def lookup_beads(self, lookups: list[BeadLookup], box_name: str) -> list[Bead | None]:
+        """Return no answers - no beads found."""
+        return [None] * len(lookups)
     
     def get_file_path(self, name: str, content_id: str) -> Path:
         """Always raise LookupError - no beads exist."""
@@ -138,11 +252,41 @@ class BeadSearch(ABC):
         """Timestamp <= given value."""
         return self
 
+    @abstractmethod
+    def verified(self):
+        """Keep only beads with verified content."""
+        return self
+
+    @abstractmethod
+    def undamaged(self):
+        """Drop beads known to be damaged (keeps not yet verified beads)."""
+        return self
+
+    @abstractmethod
+    def consumers_of(self, content_id: str):
+        """Beads having the bead with content_id as a direct input."""
+        return self
+
+    @abstractmethod
+    def upstream_of(self, content_id: str):
+        """Beads the bead with content_id depends on, directly or transitively (within the box)."""
+        return self
+
+    @abstractmethod
+    def downstream_of(self, content_id: str):
+        """Beads depending on the bead with content_id, directly or transitively (within the box)."""
+        return self
+
     @abstractmethod
     def unique(self):
         """Keep one instance by content_id."""
         return self
 
+    @abstractmethod
+    def limit(self, n: int):
+        """Return at most n beads from all() and iter()."""
+        return self
+
     @abstractmethod
     def first(self) -> Bead:
         """Return first bead found or raise LookupError if none found."""
@@ -169,11 +313,25 @@ class BeadSearch(ABC):
         pass
 
     @abstractmethod
-    def all(self) -> list[Bead]:
-        """Return list of all matching beads."""
+    def all(self, order: QueryOrder | None = None) -> list[Bead]:
+        """Return list of all matching beads, sorted by order (if given)."""
+        pass
+
+    @abstractmethod
+    def iter(self, order: QueryOrder | None = None) -> Iterator[Bead]:
+        """Stream matching beads, sorted by freeze time if order is given, without collecting them first."""
         pass
 
 
+def unique_by_content_id(beads: Iterable[Bead]) -> Iterator[Bead]:
+    """Keep the first bead for each content_id."""
+    seen_content_ids = set()
+    for bead in beads:
+        if bead.content_id not in seen_content_ids:
+            seen_content_ids.add(bead.content_id)
+            yield bead
+
+
 class BaseSearch(BeadSearch):
     """
     Base implementation of BeadSearch with common functionality.
@@ -182,6 +340,7 @@ class BaseSearch(BeadSearch):
     def __init__(self):
         self.conditions = []
         self._unique_filter = False
+        self._limit = None
 
     def by_name(self, name: str):
         if not name:
@@ -231,63 +390,119 @@ class BaseSearch(BeadSearch):
         self.conditions.append((QueryCondition.AT_OR_OLDER, timestamp))
         return self
 
+    def verified(self):
+        self.conditions.append((QueryCondition.VERIFIED, True))
+        return self
+
+    def undamaged(self):
+        self.conditions.append((QueryCondition.UNDAMAGED, True))
+        return self
+
+    def consumers_of(self, content_id: str):
+        if not content_id:
+            raise ValueError("Content ID cannot be empty")
+        self.conditions.append((QueryCondition.CONSUMES, content_id))
+        return self
+
+    def upstream_of(self, content_id: str):
+        if not content_id:
+            raise ValueError("Content ID cannot be empty")
+        self.conditions.append((QueryCondition.UPSTREAM_OF, content_id))
+        return self
+
+    def downstream_of(self, content_id: str):
+        if not content_id:
+            raise ValueError("Content ID cannot be empty")
+        self.conditions.append((QueryCondition.DOWNSTREAM_OF, content_id))
+        return self
+
     def unique(self):
         self._unique_filter = True
         return self
 
+    def limit(self, n: int):
+        if n < 0:
+            raise ValueError("Limit cannot be negative")
+        self._limit = n
+        return self
+
     def _apply_unique_filter(self, beads: list[Bead]) -> list[Bead]:
         if not self._unique_filter:
             return beads
-        seen_content_ids = set()
-        unique_beads = []
-        for bead in beads:
-            if bead.content_id not in seen_content_ids:
-                seen_content_ids.add(bead.content_id)
-                unique_beads.append(bead)
-        return unique_beads
+        return list(unique_by_content_id(beads))
+
+    def _select(self, order: QueryOrder | None = None, limit: int | None = None) -> list[Bead]:
+        """
+        Return matching beads in order, at most limit of them.
+
+        Ordering and limiting is pushed down to the resolvers.
+        """
+        # unique filtering drops beads, so the number of candidates can not be limited
+        candidate_limit = None if self._unique_filter else limit
+        beads = self._apply_unique_filter(self._get_beads(order, candidate_limit))
+        if limit is not None:
+            return beads[:limit]
+        return beads
 
     def first(self) -> Bead:
-        beads = self._get_beads()
+        beads = self._select(limit=1)
         if not beads:
             raise LookupError("No beads found")
         return beads[0]
 
     def oldest(self) -> Bead:
-        beads = self._get_beads()
+        beads = self._select(QueryOrder.OLDEST_FIRST, limit=1)
         if not beads:
             raise LookupError("No beads found")
-        return min(beads, key=lambda b: b.freeze_time)
+        return beads[0]
 
     def newest(self) -> Bead:
-        beads = self._get_beads()
+        beads = self._select(QueryOrder.NEWEST_FIRST, limit=1)
         if not beads:
             raise LookupError("No beads found")
-        return max(beads, key=lambda b: b.freeze_time)
+        return beads[0]
 
     def newer(self, n: int = 1) -> Bead:
-        beads = self._get_beads()
-        if not beads:
-            raise LookupError("No beads found")
-        sorted_beads = sorted(beads, key=lambda b: b.freeze_time)
-        if n >= len(sorted_beads):
-            raise LookupError(f"Not enough beads found (requested index {n}, found {len(sorted_beads)})")
-        return sorted_beads[n]
+        return self._nth(QueryOrder.OLDEST_FIRST, n)
 
     def older(self, n: int = 1) -> Bead:
-        beads = self._get_beads()
-        if not beads:
+        return self._nth(QueryOrder.NEWEST_FIRST, n)
+
+    def _nth(self, order: QueryOrder, n: int) -> Bead:
+        sorted_beads = self._select(order, limit=n + 1)
+        if not sorted_beads:
             raise LookupError("No beads found")
-        sorted_beads = sorted(beads, key=lambda b: b.freeze_time, reverse=True)
         if n >= len(sorted_beads):
             raise LookupError(f"Not enough beads found (requested index {n}, found {len(sorted_beads)})")
         return sorted_beads[n]
 
-    def all(self) -> list[Bead]:
-        return self._get_beads()
+    def all(self, order: QueryOrder | None = None) -> list[Bead]:
+        return self._select(order, limit=self._limit)
+
+    def iter(self, order: QueryOrder | None = None) -> Iterator[Bead]:
+        # unique filtering drops beads, so the number of candidates can not be limited
+        candidate_limit = None if self._unique_filter else self._limit
+        beads = self._iter_beads(order, candidate_limit)
+        if self._unique_filter:
+            beads = unique_by_content_id(beads)
+        return itertools.islice(beads, self._limit)
 
     @abstractmethod
-    def _get_beads(self) -> list[Bead]:
-        """Subclasses must implement this method to retrieve beads."""
+    def _iter_beads(self, order: QueryOrder | None = None, limit: int | None = None) -> Iterator[Bead]:
+        """
+        Subclasses must implement this method to stream beads.
+
+        Beads must be sorted by order (if given), and limited to the first limit (if given) of them.
+        """
+        pass
+
+    @abstractmethod
+    def _get_beads(self, order: QueryOrder | None = None, limit: int | None = None) -> list[Bead]:
+        """
+        Subclasses must implement this method to retrieve beads.
+
+        Beads must be sorted by order (if given), and limited to the first limit (if given) of them.
+        """
         pass
 
 
@@ -300,44 +515,228 @@ class BoxSearch(BaseSearch):
         super().__init__()
         self.box = box
 
-    def _get_beads(self) -> list[Bead]:
-        beads = self.box.get_beads(self.conditions)
-        return self._apply_unique_filter(beads)
+    def _get_beads(self, order: QueryOrder | None = None, limit: int | None = None) -> list[Bead]:
+        return self.box.get_beads(self.conditions, order, limit)
+
+    def _iter_beads(self, order: QueryOrder | None = None, limit: int | None = None) -> Iterator[Bead]:
+        return self.box.iter_beads(self.conditions, order, limit)
+
+
+def answers_in_time(
+        boxes, function: Callable, on_slow_box: Callable | None = None, start: float | None = None
+) -> Iterator[tuple]:
+    """
+    Call function(box) for all boxes concurrently, yield (box, result)-s in box order.
+
+    Each box is called on its own daemon thread, and has search_timeout(box, boxes) seconds to answer,
+    counted from start (time.monotonic(), default: now).
+    Boxes not answering in time are skipped and reported to on_slow_box(box):
+    a hung box (e.g. an unreachable network mount) blocks neither the search nor the exit of the process.
+    Exceptions raised by function are raised when their box is reached.
+    """
+    if start is None:
+        start = time.monotonic()
+    futures = [call_on_daemon_thread(function, box, name=f'search {box.name}') for box in boxes]
+    for box, future in zip(boxes, futures):
+        timeout = search_timeout(box, boxes)
+        if timeout is None:
+            remaining = None
+        else:
+            remaining = max(0.0, start + timeout - time.monotonic())
+        try:
+            result = future.result(remaining)
+        except concurrent.futures.TimeoutError:
+            if on_slow_box is not None:
+                on_slow_box(box)
+            continue
+        yield box, result
 
 
 class MultiBoxSearch(BaseSearch):
     """
     Search across multiple boxes.
+
+    Boxes are searched concurrently, see answers_in_time for boxes not answering in time.
     """
 
-    def __init__(self, boxes):
+    def __init__(self, boxes, on_slow_box: Callable | None = None):
         super().__init__()
         self.boxes = boxes
+        self.on_slow_box = on_slow_box
+        # time.monotonic() the search timeouts of the boxes are counted from, None: from asking the boxes
+        self._started = None
 
-    def _get_beads(self) -> list[Bead]:
+    def _get_beads(self, order: QueryOrder | None = None, limit: int | None = None) -> list[Bead]:
         all_beads = []
-        for box in self.boxes:
-            beads = box.get_beads(self.conditions)
+        answers = answers_in_time(
+            self.boxes, lambda box: box.get_beads(self.conditions, order, limit), self.on_slow_box, self._started)
+        for _box, beads in answers:
             all_beads.extend(beads)
 
-        return self._apply_unique_filter(all_beads)
+        if order is not None:
+            # stable sort: beads with the same freeze time remain in box order
+            all_beads.sort(key=lambda b: b.freeze_time_unix, reverse=order == QueryOrder.NEWEST_FIRST)
+        if limit is not None:
+            return all_beads[:limit]
+        return all_beads
+
+    def _iter_beads(self, order: QueryOrder | None = None, limit: int | None = None) -> Iterator[Bead]:
+        """
+        Stream beads from all boxes, merging the sorted streams of the boxes by freeze time.
+
+        Boxes are streamed concurrently, each on its own daemon thread, a few beads ahead of the consumer.
+        A box, that does not produce its next bead in time is dropped and reported to on_slow_box.
+        """
+        box_streams = [
+            (box, DaemonStream(
+                box.iter_beads, self.conditions, order, limit,
+                timeout=search_timeout(box, self.boxes), name=f'search {box.name}'))
+            for box in self.boxes]
+        return self._merge_streams(box_streams, order)
+
+    def _merge_streams(self, box_streams, order: QueryOrder | None) -> Iterator[Bead]:
+        """
+        Merge the streams of the boxes, closing all of them when the consumer stops (even before reaching them).
+        """
+        streams = [self._stream_reporting_slow_box(box, beads) for box, beads in box_streams]
+        try:
+            if order is None:
+                yield from itertools.chain.from_iterable(streams)
+            else:
+                # beads with the same freeze time remain in box order
+                yield from heapq.merge(
+                    *streams, key=lambda bead: bead.freeze_time_unix, reverse=order == QueryOrder.NEWEST_FIRST)
+        finally:
+            for _box, beads in box_streams:
+                beads.close()
+
+    def _stream_reporting_slow_box(self, box, beads: DaemonStream) -> Iterator[Bead]:
+        try:
+            yield from beads
+        except concurrent.futures.TimeoutError:
+            if self.on_slow_box is not None:
+                self.on_slow_box(box)
+        finally:
+            beads.close()
+
+    def _catalog(self) -> BoxCatalog | None:
+        """
+        Catalog for searching all boxes with one SQL query, None if not all boxes are indexed.
+
+        Creates the resolvers of the boxes, see Box.resolver.
+        """
+        if len(self.boxes) > 1 and all(isinstance(box.resolver, BoxIndex) for box in self.boxes):
+            return BoxCatalog(self.boxes)
+        return None
+
+    def _catalog_timeout(self) -> float | None:
+        """
+        Seconds the catalog has to answer: half of the shortest search timeout of the boxes.
+
+        The other half remains for searching box by box, when the catalog does not answer in time,
+        so a hung box delays the search by its search timeout, not more.
+        """
+        timeouts = [box.search_timeout for box in self.boxes if box.search_timeout is not None]
+        return min(timeouts) / 2 if timeouts else None
+
+    def _catalog_beads(self, order: QueryOrder | None, limit: int | None) -> list[Bead] | None:
+        """
+        Search all boxes with the catalog, None if the catalog can not be used.
+
+        The catalog is not used, when the boxes have the answer in their query cache already.
+        Answers without limit are remembered in the query cache of the boxes.
+        """
+        catalog = self._catalog()
+        if catalog is None:
+            return None
+        candidate_limit = None if self._unique_filter else limit
+        if all(box.has_cached_beads(self.conditions, order, candidate_limit) for box in self.boxes):
+            return None
+        generations = [box.resolver.generation for box in self.boxes]
+        start = time.perf_counter()
+        beads = catalog.get_beads(self.conditions, order, limit, self._unique_filter)
+        self._explain_catalog_query(order, limit, beads, time.perf_counter() - start)
+        if limit is None and not self._unique_filter:
+            for box, generation in zip(self.boxes, generations):
+                box.remember_beads(
+                    self.conditions, order, [bead for bead in beads if bead.box_name == box.name], generation)
+        return beads
+
+    def _select(self, order: QueryOrder | None = None, limit: int | None = None) -> list[Bead]:
+        if len(self.boxes) <= 1:
+            return super()._select(order, limit)
+
+        # creating the resolvers of the boxes is part of the catalog search, so it is within the timeouts
+        self._started = time.monotonic()
+        try:
+            future = call_on_daemon_thread(self._catalog_beads, order, limit, name='search catalog')
+            try:
+                beads = future.result(self._catalog_timeout())
+            except (BoxIndexError, concurrent.futures.TimeoutError):
+                # searching box by box (in the remaining time) reports or skips the problematic box
+                beads = None
+            if beads is not None:
+                return beads
+            return super()._select(order, limit)
+        finally:
+            self._started = None
+
+    def _explain_catalog_query(self, order, limit, beads, seconds):
+        """Report a search answered by the catalog to the on_query callbacks of the boxes (once each)."""
+        callbacks = {box.on_query for box in self.boxes if box.on_query is not None}
+        if not callbacks:
+            return
+        trace = QueryTrace(
+            box_name=', '.join(box.name for box in self.boxes),
+            resolver=BoxCatalog.__name__,
+            query=describe_conditions(self.conditions, order, limit),
+            seconds=seconds,
+            rows=len(beads))
+        for on_query in callbacks:
+            on_query(trace)
 
     def first(self) -> Bead:
-        for box in self.boxes:
+        """
+        The first match in box order.
+
+        Boxes are asked box by box (concurrently), as the first box with a match answers the search.
+        """
+        def first_bead(box):
             try:
-                beads = box.get_beads(self.conditions)
-                if beads:
-                    return beads[0]
+                beads = box.get_beads(self.conditions, limit=1)
             except (InvalidArchive, IOError, OSError):
-                continue
+                return None
+            return beads[0] if beads else None
+
+        # the first box (in box order) with a match answers, without waiting for the boxes after it
+        for _box, bead in answers_in_time(self.boxes, first_bead, self.on_slow_box):
+            if bead is not None:
+                return bead
         raise LookupError("No beads found")
 
 
-def search(boxes) -> BeadSearch:
+def search(boxes, on_slow_box: Callable | None = None) -> BeadSearch:
     """
     Search across multiple boxes.
+
+    Boxes not answering in time are skipped and reported to on_slow_box(box), see answers_in_time.
+    """
+    return MultiBoxSearch(boxes, on_slow_box)
+
+
+def lookup(boxes, lookups: list[BeadLookup], on_slow_box: Callable | None = None) -> list[list[Bead]]:
+    """
+    Answer many lookups across multiple boxes, with a single pass over each box.
+
+    Returns the beads found for each lookup, at most one per box, in box order.
+    Boxes are asked concurrently, see answers_in_time.
     """
-    return MultiBoxSearch(boxes)
+    answers = [[] for _ in lookups]
+    for _box, box_answers in answers_in_time(boxes, lambda box: box.lookup_beads(lookups), on_slow_box):
+        for beads, bead in zip(answers, box_answers):
+            if bead is not None:
+                beads.append(bead)
+    return answers
 
 
 def resolve(boxes, bead: Bead) -> Archive:
@@ -364,15 +763,49 @@ def resolve(boxes, bead: Bead) -> Archive:
     raise LookupError(f"Could not find box '{bead.box_name}' to resolve bead '{bead.name}'")
 
 
+def beads_key(conditions, order: QueryOrder | None, limit: int | None) -> Hashable:
+    """Key of a get_beads result in the query cache of a box."""
+    return ('beads', frozenset(conditions), order, limit)
+
+
 class Box:
     """
     Store Beads.
     """
     
-    def __init__(self, name: str, location: Path):
+    def __init__(self, name: str, location: Path, auto_index_policy: AutoIndexPolicy | None = None):
         self.name = name
         self.location = location
-        self.resolver = self._create_resolver()
+        if auto_index_policy is None:
+            auto_index_policy = AutoIndexPolicy.from_environment()
+        self.auto_index_policy = auto_index_policy
+        # seconds to answer searches across multiple boxes, None: no limit (see search_timeout)
+        self.search_timeout = search_timeout_from_environment()
+        self._auto_index_thread = None
+        # results of get_beads and lookup_beads, until the resolver changes
+        self.query_cache = QueryCache()
+        # called with a QueryTrace after each search, for explaining how the box answered it
+        self.on_query: Callable[[QueryTrace], None] | None = None
+        self._resolver = None
+        self._resolver_lock = threading.Lock()
+
+    @property
+    def resolver(self) -> BoxResolver:
+        """
+        Resolver of the box, created on first use.
+
+        Creating it touches the box directory (and may sync a shadow index),
+        so it happens within the search timeout of the first search, instead of the constructor.
+        """
+        with self._resolver_lock:
+            if self._resolver is None:
+                self._resolver = self._create_resolver()
+            return self._resolver
+
+    @resolver.setter
+    def resolver(self, resolver: BoxResolver):
+        with self._resolver_lock:
+            self._resolver = resolver
 
     @property
     def directory(self):
@@ -388,18 +821,91 @@ class Box:
         Create appropriate resolver based on directory access and index availability.
         
         Strategy selection:
-        1. No SQLite index -> RawFilesystemResolver
+        1. No SQLite index, writable directory -> RawFilesystemResolver
+           (replaced with a BoxIndex built in the background, when auto_index_policy says so)
         2. SQLite index exists, no read access -> NullResolver
         3. SQLite index exists, read-only access -> BoxIndex
-        4. SQLite index exists, read-write access -> BoxIndex
+        4. SQLite index exists, read-write access -> BoxIndex (migrated to current schema)
+        5. No usable SQLite index, read-only directory -> BoxIndex in the user's cache (shadow index)
         """
         if index_path_exists(self.directory):
-            if can_read_index(self.directory):
-                return BoxIndex(self.directory)
-            else:
+            if not can_read_index(self.directory):
                 return NullResolver()
-        else:
-            return RawFilesystemResolver(self.directory)
+            box_index = BoxIndex(self.directory)
+            if is_index_up_to_date(box_index.index_path):
+                return box_index
+            # an outdated index, that can not be migrated (e.g. read only box)
+            return self._create_shadow_resolver()
+        if is_writable_directory(self.directory):
+            if self.directory.is_dir() and self.auto_index_policy.has_too_many_archives(self.directory):
+                self._start_auto_index()
+            return self._create_raw_resolver()
+        return self._create_shadow_resolver()
+
+    def _create_raw_resolver(self) -> RawFilesystemResolver:
+        """Search archives directly, remembering their metadata in the user's cache directory."""
+        return RawFilesystemResolver(self.directory, archive_cache=ArchiveCache(raw_cache_path(self.directory)))
+
+    def _start_auto_index(self):
+        """
+        Index the box on a background thread, and switch to the index when done.
+
+        Searches continue with the current resolver in the meantime.
+        The thread is a daemon, so it does not delay the exit of the process:
+        an index not finished by then is continued by the next automatic indexing (see build_index).
+        """
+        if self._auto_index_thread is not None:
+            return
+        self._auto_index_thread = threading.Thread(
+            target=self._auto_index, name=f'auto-index {self.name}', daemon=True)
+        self._auto_index_thread.start()
+
+    def _auto_index(self):
+        try:
+            box_index = build_index(self.directory)
+        except Exception:
+            # the box remains usable without index
+            return
+        if box_index is None:
+            # another process is building it
+            return
+        self.resolver = box_index
+        # archives stored while building were indexed only by the previous resolver
+        try:
+            box_index.sync(verify=False)
+        except BoxIndexError:
+            # they are found by the next sync
+            pass
+
+    def wait_for_auto_index(self):
+        """Wait for automatic indexing started for this box (if any) to finish."""
+        if self._auto_index_thread is not None:
+            self._auto_index_thread.join()
+
+    def _create_shadow_resolver(self) -> BoxResolver:
+        """
+        Index the box in the user's cache directory, as it can not hold an index itself.
+
+        The shadow index is synced with the box on creation (i.e. on the first search, see resolver),
+        reading only the metadata of new archives, on DEFAULT_INDEX_JOBS threads.
+        Falls back to RawFilesystemResolver if the shadow index can not be created.
+        """
+        if not self.directory.is_dir():
+            return self._create_raw_resolver()
+        index_path = shadow_index_path(self.directory)
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            return self._create_raw_resolver()
+        box_index = BoxIndex(self.directory, index_path)
+        if not is_index_up_to_date(index_path):
+            return self._create_raw_resolver()
+        try:
+            box_index.sync(jobs=DEFAULT_INDEX_JOBS, verify=False)
+        except BoxIndexError:
+            # searching the index as synced last time is still better than opening every archive
+            pass
+        return box_index
 
     def all_beads(self) -> list[Bead]:
         '''
@@ -409,11 +915,125 @@ class Box:
         '''
         return self.get_beads([])
 
-    def get_beads(self, conditions) -> list[Bead]:
+    def get_beads(self, conditions, order: QueryOrder | None = None, limit: int | None = None) -> list[Bead]:
         '''
         Retrieve matching beads.
+
+        See BoxResolver.get_beads for order and limit.
+        Results are cached in query_cache.
+        '''
+        resolver = self.resolver
+        key = beads_key(conditions, order, limit)
+
+        def answer(asked):
+            def compute():
+                asked(None)
+                return self._get_beads(resolver, conditions, order, limit)
+            return list(self.query_cache.get(resolver, key, compute))
+        return self._explained(
+            resolver, describe_conditions(conditions, order, limit), answer,
+            lambda _: query_sql(conditions, order, limit))
+
+    def has_cached_beads(self, conditions, order: QueryOrder | None = None, limit: int | None = None) -> bool:
+        '''Is the result of get_beads in query_cache.'''
+        return self.query_cache.contains(self.resolver, beads_key(conditions, order, limit))
+
+    def remember_beads(self, conditions, order: QueryOrder | None, beads: list[Bead], generation):
+        '''
+        Put the result of get_beads (without limit), found by other means (the catalog of boxes), into query_cache.
+
+        generation is the generation of the resolver before the beads were searched.
+        '''
+        self.query_cache.put(self.resolver, beads_key(conditions, order, None), list(beads), generation)
+
+    def _get_beads(self, resolver, conditions, order, limit) -> list[Bead]:
+        if not isinstance(resolver, RawFilesystemResolver) or self.auto_index_policy.max_scan_seconds is None:
+            return resolver.get_beads(conditions, self.name, order, limit)
+
+        start = time.monotonic()
+        beads = resolver.get_beads(conditions, self.name, order, limit)
+        if self.auto_index_policy.is_scan_too_slow(time.monotonic() - start) and is_writable_directory(self.directory):
+            self._start_auto_index()
+        return beads
+
+    def lookup_beads(self, lookups: list[BeadLookup]) -> list[Bead | None]:
+        '''
+        Answer many lookups at once.
+
+        See BoxResolver.lookup_beads.
+        Answers are cached in query_cache one by one, only lookups not answered yet are passed to the resolver.
+        '''
+        resolver = self.resolver
+
+        def answer(asked):
+            def compute_missing(missing):
+                asked(missing)
+                return resolver.lookup_beads(missing, self.name)
+            return self.query_cache.get_many(resolver, lookups, compute_missing)
+        # batches of lookups are answered with the same statement, explaining the first one is enough
+        return self._explained(
+            resolver, describe_lookups(lookups), answer,
+            lambda missing: lookup_sql(missing[:LOOKUP_BATCH_SIZE]))
+
+    def _explained(self, resolver, query: str, answer: Callable, sql_of: Callable) -> list:
+        '''
+        Results of answer(asked), reported to on_query as a QueryTrace.
+
+        answer calls asked(keys) when the resolver is asked (the results are not all cached),
+        sql_of(keys) is the SQL and its parameters an indexed box answers them with.
+        '''
+        if self.on_query is None:
+            return answer(lambda keys: None)
+
+        asked = []
+        archives_opened = getattr(resolver, 'archives_opened', 0)
+        start = time.perf_counter()
+        results = answer(asked.append)
+        trace = QueryTrace(
+            box_name=self.name,
+            resolver=type(resolver).__name__,
+            query=query,
+            seconds=time.perf_counter() - start,
+            rows=sum(1 for result in results if result is not None),
+            archives_opened=getattr(resolver, 'archives_opened', 0) - archives_opened,
+            cached=not asked)
+        if asked and isinstance(resolver, BoxIndex):
+            trace.sql, parameters = sql_of(asked[0])
+            trace.query_plan = resolver.query_plan(trace.sql, parameters)
+        self.on_query(trace)
+        return results
+
+    def iter_beads(self, conditions, order: QueryOrder | None = None, limit: int | None = None) -> Iterator[Bead]:
         '''
-        return self.resolver.get_beads(conditions, self.name)
+        Stream matching beads.
+
+        See BoxResolver.get_beads for order and limit.
+        '''
+        resolver = self.resolver
+        beads = resolver.iter_beads(conditions, self.name, order, limit)
+        if self.on_query is None:
+            return beads
+        return self._iter_explained(resolver, conditions, order, limit, beads)
+
+    def _iter_explained(self, resolver, conditions, order, limit, beads: Iterator[Bead]) -> Iterator[Bead]:
+        '''Stream beads, reporting a QueryTrace to on_query when the stream is finished (or closed).'''
+        trace = QueryTrace(
+            box_name=self.name,
+            resolver=type(resolver).__name__,
+            query='stream ' + describe_conditions(conditions, order, limit))
+        if isinstance(resolver, BoxIndex):
+            trace.sql, parameters = query_sql(conditions, order, limit)
+            trace.query_plan = resolver.query_plan(trace.sql, parameters)
+        archives_opened = getattr(resolver, 'archives_opened', 0)
+        start = time.perf_counter()
+        try:
+            for bead in beads:
+                trace.rows += 1
+                yield bead
+        finally:
+            trace.seconds = time.perf_counter() - start
+            trace.archives_opened = getattr(resolver, 'archives_opened', 0) - archives_opened
+            self.on_query(trace)
 
     def resolve(self, bead: Bead) -> Archive:
         '''
@@ -0,0 +1,140 @@
+'''
+Automatic indexing of writable boxes, that are searched without an index.
+
+The index is built next to the box index under a temporary name,
+and moved into place only when complete: an incomplete index is never used for searches.
+Processes indexing the same box take turns on a lock file, so only one of them builds the index.
+'''
+
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import warnings
+
+import attr
+
+from .box_index import DEFAULT_INDEX_JOBS
+from .box_index import REBUILD_IN_PROGRESS
+from .box_index import BoxIndex
+from .box_index import create_query_connection
+from .box_index import get_state
+from .exceptions import BoxIndexError
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Environment variables overriding the default policy, 'off' disables the trigger
+AUTO_INDEX_ARCHIVES_ENV = 'BEAD_AUTO_INDEX_ARCHIVES'
+AUTO_INDEX_SCAN_SECONDS_ENV = 'BEAD_AUTO_INDEX_SCAN_SECONDS'
+
+INDEX_NAME = '.index.sqlite'
+BUILDING_INDEX_NAME = '.index.sqlite.building'
+# held by the process building BUILDING_INDEX_NAME
+BUILD_LOCK_NAME = '.index.sqlite.building.lock'
+
+
+def _parse_limit(environ, name, convert, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    if value.strip().lower() in ('', 'off', 'no', 'never'):
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        warnings.warn(f'Ignoring {name}={value!r}: not a number')
+        return default
+
+
+@attr.s(frozen=True, auto_attribs=True)
+class AutoIndexPolicy:
+    '''
+    When to index a box automatically.
+
+    A box is indexed when it has more than `max_archives` archives,
+    or when a search without index took more than `max_scan_seconds`.
+    None disables the respective trigger.
+    '''
+    max_archives: int | None = 1000
+    max_scan_seconds: float | None = 10.0
+
+    @classmethod
+    def from_environment(cls, environ=os.environ) -> 'AutoIndexPolicy':
+        default = cls()
+        return cls(
+            max_archives=_parse_limit(environ, AUTO_INDEX_ARCHIVES_ENV, int, default.max_archives),
+            max_scan_seconds=_parse_limit(environ, AUTO_INDEX_SCAN_SECONDS_ENV, float, default.max_scan_seconds))
+
+    def has_too_many_archives(self, box_directory: Path) -> bool:
+        if self.max_archives is None:
+            return False
+        count = 0
+        with os.scandir(box_directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.zip') and not entry.name.startswith('.'):
+                    count += 1
+                    if count > self.max_archives:
+                        return True
+        return False
+
+    def is_scan_too_slow(self, seconds: float) -> bool:
+        return self.max_scan_seconds is not None and seconds > self.max_scan_seconds
+
+
+@contextmanager
+def exclusive_lock(lock_path: Path):
+    '''
+    Lock lock_path without waiting, yield whether the lock was acquired.
+
+    The lock is released when the block ends, or when the process exits.
+    '''
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            yield False
+        else:
+            yield True
+    finally:
+        os.close(fd)
+
+
+def build_index(box_directory: Path, jobs=DEFAULT_INDEX_JOBS) -> BoxIndex | None:
+    '''
+    Index box from metadata and move the index into place when complete.
+
+    An interrupted build is continued by the next one.
+    Only one process builds the index of a box at a time,
+    returns None if another process is building it.
+    '''
+    box_directory = Path(box_directory)
+    index_path = box_directory / INDEX_NAME
+    building_path = box_directory / BUILDING_INDEX_NAME
+    lock_path = box_directory / BUILD_LOCK_NAME
+    with exclusive_lock(lock_path) as locked:
+        if not locked:
+            return None
+        if not index_path.exists():
+            BoxIndex(box_directory, building_path).rebuild(jobs=jobs, verify=False)
+            with create_query_connection(building_path) as conn:
+                if get_state(conn, REBUILD_IN_PROGRESS) is not None:
+                    raise BoxIndexError(f'Building index of {box_directory} did not finish')
+            os.replace(building_path, index_path)
+            journal_path = building_path.with_name(building_path.name + '-journal')
+            if journal_path.exists():
+                journal_path.unlink()
+    # the index is in place, processes locking the file later do not build it again
+    try:
+        lock_path.unlink(missing_ok=True)
+    except OSError:
+        # still open by another process (on Windows)
+        pass
+    return BoxIndex(box_directory)
@@ -0,0 +1,231 @@
+'''
+Search the indexes of multiple boxes with SQL.
+
+The box indexes are ATTACHed read-only to an in-memory database,
+so that a search across all of them is a single statement.
+'''
+
+from contextlib import closing
+import sqlite3
+
+from .bead import Bead
+from .bead import BeadRecord
+from .box_index import STREAM_BATCH_SIZE
+from .box_index import bead_inputs_sql
+from .box_index import build_where_clause
+from .box_index import group_input_rows
+from .box_query import QueryOrder
+from .exceptions import BoxIndexError
+
+
+def order_by_sql(order):
+    '''
+    ORDER BY terms of catalog rows.
+
+    Without order the rows are in box order, as searching the boxes one by one would return them.
+    '''
+    if order == QueryOrder.NEWEST_FIRST:
+        return 'freeze_time_unix DESC, box_order'
+    if order == QueryOrder.OLDEST_FIRST:
+        return 'freeze_time_unix, box_order'
+    return 'box_order, freeze_time_unix'
+
+
+def sort_key(order):
+    '''
+    Python equivalent of order_by_sql.
+
+    Rows are (box_order, name, content_id, kind, freeze_time_str, freeze_time_unix).
+    '''
+    if order == QueryOrder.NEWEST_FIRST:
+        return lambda row: (-row[5], row[0])
+    if order == QueryOrder.OLDEST_FIRST:
+        return lambda row: (row[5], row[0])
+    return lambda row: (row[0], row[5])
+
+
+def beads_union_sql(schemas, conditions):
+    '''
+    UNION ALL of the beads of the attached boxes matching conditions.
+
+    `schemas` is a list of (box_order, schema name) pairs.
+    '''
+    selects = []
+    parameters = []
+    for box_order, schema in schemas:
+        where_parts, where_parameters = build_where_clause(conditions, inputs_table=f'{schema}.inputs')
+        sql = f'''
+            SELECT {box_order} AS box_order, name, content_id, kind, freeze_time_str, freeze_time_unix
+            FROM {schema}.beads
+        '''
+        if where_parts:
+            sql += ' WHERE ' + ' AND '.join(where_parts)
+        selects.append(sql)
+        parameters.extend(where_parameters)
+    return ' UNION ALL '.join(selects), parameters
+
+
+def catalog_query_sql(union_sql, order, limit, unique):
+    '''
+    SQL selecting rows of union_sql in order, deduplicated by content_id when unique.
+
+    With unique the first bead (in order) is kept for each content_id.
+    '''
+    order_by = order_by_sql(order)
+    columns = 'box_order, name, content_id, kind, freeze_time_str, freeze_time_unix'
+    if unique:
+        sql = f'''
+            SELECT {columns} FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY content_id ORDER BY {order_by}) AS nth
+                FROM ({union_sql})
+            )
+            WHERE nth = 1
+        '''
+    else:
+        sql = f'SELECT {columns} FROM ({union_sql})'
+    sql += f' ORDER BY {order_by}'
+    if limit is not None:
+        sql += ' LIMIT ?'
+    return sql
+
+
+def load_inputs_for_query(conn, schemas, conditions):
+    '''
+    Load input rows of all beads matching conditions in the attached boxes.
+
+    Returns a dict (box_order, name, content_id) -> list of input rows, see group_input_rows.
+    '''
+    sql, parameters = inputs_union_sql(schemas, conditions)
+    inputs_by_bead = {}
+    for box_order, bead_name, bead_content_id, *input_row in conn.execute(sql, parameters):
+        inputs_by_bead.setdefault((box_order, bead_name, bead_content_id), []).append(tuple(input_row))
+    return inputs_by_bead
+
+
+def inputs_union_sql(schemas, conditions):
+    '''UNION ALL of the input rows of beads matching conditions, tagged with box_order.'''
+    selects = []
+    parameters = []
+    for box_order, schema in schemas:
+        where_parts, where_parameters = build_where_clause(conditions, inputs_table=f'{schema}.inputs')
+        sql = f'''
+            SELECT {box_order} AS box_order, bead_name, bead_content_id,
+                   input_name, input_kind, input_content_id, input_freeze_time_str
+            FROM {schema}.inputs AS inputs
+            JOIN {schema}.beads AS beads
+                ON beads.name = inputs.bead_name AND beads.content_id = inputs.bead_content_id
+        '''
+        if where_parts:
+            sql += ' WHERE ' + ' AND '.join(where_parts)
+        selects.append(sql)
+        parameters.extend(where_parameters)
+    return ' UNION ALL '.join(selects), parameters
+
+
+def load_inputs_for_keys(conn, schemas, keys):
+    '''
+    Load input rows of the given (box_order, name, content_id)-s.
+
+    Keys are looked up STREAM_BATCH_SIZE at a time, see load_inputs_for_beads.
+    Returns a dict (box_order, name, content_id) -> list of input rows, see group_input_rows.
+    '''
+    inputs_by_bead = {}
+    for box_order, schema in schemas:
+        bead_keys = [(name, content_id) for key_box_order, name, content_id in keys if key_box_order == box_order]
+        for start in range(0, len(bead_keys), STREAM_BATCH_SIZE):
+            sql, parameters = bead_inputs_sql(bead_keys[start:start + STREAM_BATCH_SIZE], f'{schema}.inputs')
+            for (name, content_id), input_rows in group_input_rows(conn.execute(sql, parameters)).items():
+                inputs_by_bead[(box_order, name, content_id)] = input_rows
+    return inputs_by_bead
+
+
+def unique_results(results):
+    '''Keep the first of (row, input rows) results for each content_id.'''
+    seen_content_ids = set()
+    unique = []
+    for row, input_rows in results:
+        content_id = row[2]
+        if content_id not in seen_content_ids:
+            seen_content_ids.add(content_id)
+            unique.append((row, input_rows))
+    return unique
+
+
+class BoxCatalog:
+    '''
+    Search beads across indexed boxes with one SQL statement.
+
+    Boxes are attached in chunks of at most the SQLite attachment limit,
+    results of chunks are merged in Python.
+    '''
+
+    def __init__(self, boxes):
+        self.boxes = list(boxes)
+
+    def _connect(self):
+        return closing(sqlite3.connect(':memory:', uri=True))
+
+    def _chunks(self, conn):
+        max_attached = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        for start in range(0, len(self.boxes), max_attached):
+            yield list(enumerate(self.boxes[start:start + max_attached], start=start))
+
+    def get_beads(self, conditions, order=None, limit=None, unique=False) -> list[Bead]:
+        '''
+        Retrieve beads matching conditions from all boxes.
+
+        Beads are ordered by freeze time if order is given, otherwise in box order.
+        With unique only the first bead (in that order) is kept for each content_id.
+        '''
+        try:
+            with self._connect() as conn:
+                chunks = list(self._chunks(conn))
+                # duplicates across chunks are dropped only after merging,
+                # so a chunk can not be limited to the first unique beads
+                chunk_limit = None if unique and len(chunks) > 1 else limit
+                results = []
+                for boxes in chunks:
+                    results.extend(self._query_chunk(conn, boxes, conditions, order, chunk_limit, unique))
+        except sqlite3.Error as e:
+            raise BoxIndexError(f"Failed to query box indexes: {e}")
+
+        if len(chunks) > 1:
+            row_sort_key = sort_key(order)
+            results.sort(key=lambda result: row_sort_key(result[0]))
+            if unique:
+                results = unique_results(results)
+        if limit is not None:
+            results = results[:limit]
+        return [
+            BeadRecord.from_row(row[1:], self.boxes[row[0]].name, input_rows)
+            for row, input_rows in results]
+
+    def _query_chunk(self, conn, boxes, conditions, order, limit, unique):
+        '''
+        Query a chunk of (box_order, box)-s.
+
+        Returns (row, input rows) pairs, see sort_key for rows.
+        '''
+        schemas = []
+        for box_order, box in boxes:
+            schema = f'box{box_order}'
+            index_uri = box.resolver.index_path.as_uri() + '?mode=ro'
+            conn.execute('ATTACH DATABASE ? AS ' + schema, (index_uri,))
+            schemas.append((box_order, schema))
+        try:
+            union_sql, parameters = beads_union_sql(schemas, conditions)
+            sql = catalog_query_sql(union_sql, order, limit, unique)
+            if limit is not None:
+                parameters = parameters + [limit]
+            rows = conn.execute(sql, parameters).fetchall()
+            if not rows:
+                return []
+
+            if limit is None:
+                inputs_by_bead = load_inputs_for_query(conn, schemas, conditions)
+            else:
+                inputs_by_bead = load_inputs_for_keys(conn, schemas, [row[:3] for row in rows])
+            return [(row, inputs_by_bead.get(row[:3], ())) for row in rows]
+        finally:
+            for _box_order, schema in schemas:
+                conn.execute('DETACH DATABASE ' + schema)
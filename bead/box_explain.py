@@ -0,0 +1,66 @@
+'''
+How searches were answered by boxes: resolver, SQL, archives opened, rows and wall time.
+
+Boxes report a QueryTrace for each search to their `on_query` callback (if set).
+'''
+
+import os
+
+import attr
+
+from .box_query import QueryCondition
+
+# Environment variable switching on the explanation of searches of all commands
+EXPLAIN_ENV = 'BEAD_EXPLAIN'
+
+
+def is_explain_requested(environ=os.environ) -> bool:
+    value = environ.get(EXPLAIN_ENV)
+    return value is not None and value.strip().lower() not in ('', '0', 'off', 'no', 'never')
+
+
+@attr.s(auto_attribs=True)
+class QueryTrace:
+    '''
+    A search answered by a box (or by the catalog of boxes).
+
+    `query` is a description of the search, `sql` (with `query_plan`) is only known for indexed boxes.
+    A cached search was answered from the box's query cache, without asking the resolver.
+    '''
+    box_name: str
+    resolver: str
+    query: str
+    seconds: float = 0.0
+    rows: int = 0
+    archives_opened: int = 0
+    cached: bool = False
+    sql: str | None = None
+    query_plan: list[str] = attr.Factory(list)
+
+
+def _describe_value(value):
+    if isinstance(value, (set, frozenset)):
+        return f'{len(value)} content ids'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return repr(value)
+
+
+def describe_conditions(conditions, order=None, limit=None) -> str:
+    '''Human readable description of a search.'''
+    parts = [
+        tag.name.lower() if tag in (QueryCondition.VERIFIED, QueryCondition.UNDAMAGED)
+        else f'{tag.name.lower()}={_describe_value(value)}'
+        for tag, value in conditions]
+    if order is not None:
+        parts.append(order.name.lower())
+    if limit is not None:
+        parts.append(f'limit={limit}')
+    return 'search ' + (' '.join(parts) if parts else 'all')
+
+
+def describe_lookups(lookups) -> str:
+    '''Human readable description of a batch of lookups.'''
+    content_ids = sum(1 for lookup in lookups if lookup.content_id is not None)
+    kinds = len(lookups) - content_ids
+    return f'lookup {content_ids} content ids, {kinds} kinds'
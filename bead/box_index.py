@@ -2,21 +2,136 @@
 SQLite-based index for bead storage and retrieval.
 '''
 
-import sqlite3
 from contextlib import closing
+import functools
+import hashlib
+import os
 from pathlib import Path
+import random
+import sqlite3
+import time
+from typing import Callable
+from typing import Iterator
+
+import appdirs
+import attr
 
+from . import layouts
+from . import zipopener
 from .bead import Bead
+from .bead import BeadRecord
+from .box_query import BeadLookup
 from .box_query import QueryCondition
+from .box_query import QueryOrder
 from .exceptions import BoxIndexError
 from .meta import InputSpec
+from .tech.parallel import map_unordered
+from .tech.timestamp import time_from_timestamp
+from .tech.timestamp import unix_microseconds
 from .ziparchive import ZipArchive
 
+# Number of archives written to the index in a single transaction.
+# Each committed batch is a checkpoint, an interrupted rebuild continues from the last one.
+INDEX_BATCH_SIZE = 500
+
+# Default number of threads reading archives while indexing.
+# Reading is mostly I/O (and hashing/decompression, that release the GIL),
+# so threads give a speedup even on network file systems with few CPUs.
+DEFAULT_INDEX_JOBS = min(8, os.cpu_count() or 1)
+
+# Number of lookups answered by a single statement of lookup_beads, keeps the number of SQL parameters low
+LOOKUP_BATCH_SIZE = 500
+
+# Number of beads streamed by iter_query_beads, for which inputs are loaded together
+STREAM_BATCH_SIZE = 500
+
+# freeze_time_unix bound of kind lookups without time
+MAX_FREEZE_TIME_UNIX = 2**63 - 1
+
+# index_state key marking a rebuild, that has not finished yet
+REBUILD_IN_PROGRESS = 'rebuild_in_progress'
+
+# index_state key of the box directory mtime (in ns) at the last complete sync
+DIRECTORY_MTIME_NS = 'directory_mtime_ns'
+
+# A directory modified this recently might be modified again without its mtime changing,
+# as file system timestamps can be coarse (1-2s on some network and FAT file systems).
+# Its mtime is not recorded as a sync checkpoint.
+DIRECTORY_MTIME_SLACK_NS = 2_000_000_000
+
+# Seconds a connection waits for a lock held by another process (SQLite busy timeout)
+BUSY_TIMEOUT_SECONDS = 10.0
+
+# Updates still failing with "database is locked" (e.g. when the busy handler is not used by SQLite
+# to avoid a deadlock) are retried: after a random delay of up to BUSY_RETRY_DELAY_SECONDS,
+# doubled for each attempt, so that writers retrying together do not collide again.
+BUSY_RETRY_ATTEMPTS = 5
+BUSY_RETRY_DELAY_SECONDS = 0.1
+
+# Suffix of the pending-ingest queue next to the index.
+# It holds names of stored archives, that could not be added to the index, one per line.
+PENDING_SUFFIX = '.pending'
+
+# beads.verify_status values
+VERIFY_UNVERIFIED = 'unverified'  # indexed from metadata only, content not checked yet
+VERIFY_OK = 'ok'
+VERIFY_DAMAGED = 'damaged'
+
+# Secondary indexes, matching the shape of the queries run against the index
+INDEXES = (
+    # time-based queries and ordering of whole box
+    ('idx_beads_freeze_time_unix', 'beads(freeze_time_unix)'),
+    # by_name with time conditions, newest/oldest of a name
+    ('idx_beads_name_freeze_time_unix', 'beads(name, freeze_time_unix)'),
+    # by_kind with time conditions, newest/oldest of a kind (input update)
+    ('idx_beads_kind_freeze_time_unix', 'beads(kind, freeze_time_unix)'),
+    # by_content_id (input load, status)
+    ('idx_beads_content_id', 'beads(content_id)'),
+    # sync, unindex, verification updates
+    ('idx_beads_file_path', 'beads(file_path)'),
+    # inputs of beads: loading and deleting them
+    ('idx_inputs_bead', 'inputs(bead_name, bead_content_id)'),
+    # reverse dependencies: beads using a given input
+    ('idx_inputs_input_content_id', 'inputs(input_content_id)'),
+    # upstream closure: inputs of beads with a given content_id
+    ('idx_inputs_bead_content_id', 'inputs(bead_content_id)'),
+)
+
+# Dependency graph subqueries, {inputs} is the (possibly schema qualified) inputs table
+
+# content_ids of beads directly using the bead with content_id ?
+CONSUMERS_SQL = 'SELECT bead_content_id FROM {inputs} WHERE input_content_id = ?'
+
+# content_ids of all transitive inputs of the bead with content_id ?
+UPSTREAM_SQL = '''
+    WITH RECURSIVE upstream(content_id) AS (
+        SELECT input_content_id FROM {inputs} WHERE bead_content_id = ?
+        UNION
+        SELECT inputs.input_content_id
+        FROM {inputs} AS inputs JOIN upstream ON inputs.bead_content_id = upstream.content_id
+    )
+    SELECT content_id FROM upstream
+'''
+
+# content_ids of all beads transitively using the bead with content_id ?
+DOWNSTREAM_SQL = '''
+    WITH RECURSIVE downstream(content_id) AS (
+        SELECT bead_content_id FROM {inputs} WHERE input_content_id = ?
+        UNION
+        SELECT inputs.bead_content_id
+        FROM {inputs} AS inputs JOIN downstream ON inputs.input_content_id = downstream.content_id
+    )
+    SELECT content_id FROM downstream
+'''
+
 
 def create_update_connection(index_path: Path):
-    '''Create database connection for updates and ensure schema exists.'''
-    conn = sqlite3.connect(str(index_path))
+    '''Create database connection for updates and ensure schema is up to date.'''
+    conn = sqlite3.connect(str(index_path), timeout=BUSY_TIMEOUT_SECONDS)
     try:
+        # keep the rollback journal file around between transactions:
+        # creating and deleting it would change the box directory mtime used by sync
+        conn.execute('PRAGMA journal_mode = TRUNCATE')
         create_schema(conn)
     except Exception:
         conn.close()
@@ -26,12 +141,52 @@ def create_update_connection(index_path: Path):
 
 def create_query_connection(index_path: Path):
     '''Create read-only database connection for queries.'''
-    conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_SECONDS)
     return closing(conn)
 
 
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
 def create_schema(conn):
-    '''Create database schema if it doesn't exist.'''
+    '''
+    Create database schema or migrate an existing one to SCHEMA_VERSION.
+
+    Each migration is applied in its own transaction, together with the version bump,
+    so an interrupted migration is simply repeated on the next connection.
+    The transactions take the write lock up front (BEGIN IMMEDIATE) and re-read the version,
+    so a migration applied meanwhile by another process is not applied again.
+    '''
+    version = _checked_schema_version(conn)
+    while version < SCHEMA_VERSION:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = _checked_schema_version(conn)
+            if version < SCHEMA_VERSION:
+                MIGRATIONS[version](conn)
+                version += 1
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def _checked_schema_version(conn):
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise BoxIndexError(
+            f'Index schema version {version} is newer than supported ({SCHEMA_VERSION}), '
+            + 'upgrade bead to update it')
+    return version
+
+
+# Migrations - MIGRATIONS[n] upgrades schema version n to n + 1.
+# Indexes created before versioning have version 0 with any prefix of the migrations
+# already applied, therefore all migrations are idempotent.
+
+def _create_tables(conn):
     conn.execute('''
         CREATE TABLE IF NOT EXISTS beads (
             name TEXT NOT NULL,
@@ -43,13 +198,6 @@ def create_schema(conn):
             PRIMARY KEY (name, content_id)
         )
     ''')
-    
-    # Create index on unix timestamp for fast time-based queries
-    conn.execute('''
-        CREATE INDEX IF NOT EXISTS idx_beads_freeze_time_unix 
-        ON beads(freeze_time_unix)
-    ''')
-    
     conn.execute('''
         CREATE TABLE IF NOT EXISTS inputs (
             bead_name TEXT NOT NULL,
@@ -61,56 +209,372 @@ def create_schema(conn):
             FOREIGN KEY (bead_name, bead_content_id) REFERENCES beads(name, content_id)
         )
     ''')
-    
-    conn.commit()
 
 
-def get_indexed_files(conn):
-    '''Get set of file paths already in index.'''
-    cursor = conn.execute('SELECT file_path FROM beads')
-    return {row[0] for row in cursor.fetchall()}
+def _create_index_state(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS index_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+def _add_verification_columns(conn):
+    # beads indexed before verification was tracked were all validated on indexing
+    add_missing_columns(conn, 'beads', (
+        ('verify_status', f"TEXT NOT NULL DEFAULT '{VERIFY_OK}'"),
+        ('verified_at', 'INTEGER'),
+    ))
+
+
+def _add_fingerprint_columns(conn):
+    # archive file fingerprint at the time of indexing, to detect replaced archives
+    add_missing_columns(conn, 'beads', (
+        ('file_size', 'INTEGER'),
+        ('file_mtime_ns', 'INTEGER'),
+        ('file_inode', 'INTEGER'),
+    ))
+    request_backfill(conn, FINGERPRINT_BACKFILL)
+
+
+def _add_size_columns(conn):
+    # uncompressed sizes of archive members (the archive size is file_size)
+    add_missing_columns(conn, 'beads', (
+        ('data_bytes', 'INTEGER'),
+        ('uncompressed_bytes', 'INTEGER'),
+    ))
+    request_backfill(conn, SIZE_BACKFILL)
+
+
+def create_indexes(conn):
+    '''Create secondary indexes if they don't exist.'''
+    for index_name, index_definition in INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {index_definition}')
+
+
+MIGRATIONS = (
+    _create_tables,
+    _create_index_state,
+    _add_verification_columns,
+    _add_fingerprint_columns,
+    create_indexes,
+    _add_size_columns,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def add_missing_columns(conn, table, column_definitions):
+    '''Add columns to an existing table, that are not yet there.'''
+    existing_columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for column, definition in column_definitions:
+        if column not in existing_columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class Backfill:
+    '''
+    Fill columns of beads added by a migration, without reindexing the archives.
+
+    `read(archive_path)` returns the values of `columns` for an archive.
+    Rows having NULL in the first column are filled.
+    '''
+    name: str
+    columns: tuple
+    read: Callable
+
+
+FINGERPRINT_BACKFILL = Backfill(
+    'fingerprints',
+    ('file_size', 'file_mtime_ns', 'file_inode'),
+    lambda archive_path: file_fingerprint(os.stat(archive_path)))
+
+
+def member_sizes(zipfile):
+    '''Uncompressed size of data files and of all members of an archive.'''
+    data_prefix = layouts.Archive.DATA + '/'
+    infos = zipfile.infolist()
+    data_bytes = sum(info.file_size for info in infos if info.filename.startswith(data_prefix))
+    return data_bytes, sum(info.file_size for info in infos)
+
+
+def read_member_sizes(archive_path: Path):
+    try:
+        return member_sizes(zipopener.open(archive_path))
+    finally:
+        zipopener.close(archive_path)
+
+
+SIZE_BACKFILL = Backfill('sizes', ('data_bytes', 'uncompressed_bytes'), read_member_sizes)
+
+BACKFILLS = (FINGERPRINT_BACKFILL, SIZE_BACKFILL)
+
+# index_state key prefix for backfills requested by migrations, but not yet finished
+BACKFILL_PENDING_PREFIX = 'backfill_pending:'
 
 
-def insert_bead_record(conn, archive, relative_path):
-    '''Insert bead record into database.'''
+def request_backfill(conn, backfill):
+    conn.execute(
+        'INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)',
+        (BACKFILL_PENDING_PREFIX + backfill.name, '1'))
+
+
+def run_backfills(conn, box_directory: Path, jobs=1):
+    '''
+    Run backfills requested by migrations, committing in batches of INDEX_BATCH_SIZE.
+
+    Archive files, that can not be read are left for sync to reindex or remove.
+    '''
+    for backfill in BACKFILLS:
+        state_key = BACKFILL_PENDING_PREFIX + backfill.name
+        if get_state(conn, state_key) is None:
+            continue
+        file_paths = [
+            file_path for (file_path,) in conn.execute(
+                f'SELECT file_path FROM beads WHERE {backfill.columns[0]} IS NULL')]
+
+        def read(file_path, backfill=backfill):
+            try:
+                return file_path, backfill.read(box_directory / file_path)
+            except Exception:
+                return file_path, None
+
+        assignments = ', '.join(f'{column} = ?' for column in backfill.columns)
+        sql = f'UPDATE beads SET {assignments} WHERE file_path = ?'
+        batch = []
+        for file_path, values in map_unordered(read, file_paths, jobs):
+            if values is not None:
+                batch.append((*values, file_path))
+            if len(batch) >= INDEX_BATCH_SIZE:
+                conn.executemany(sql, batch)
+                conn.commit()
+                batch = []
+        conn.executemany(sql, batch)
+        set_state(conn, state_key, None)
+        conn.commit()
+
+
+def now_unix_microseconds():
+    return int(time.time() * 1_000_000)
+
+
+def file_fingerprint(stat_result):
+    '''Fingerprint of a file, that changes when the file is modified or replaced.'''
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+def get_indexed_fingerprints(conn):
+    '''
+    Get file paths already in index with their fingerprints.
+
+    Returns dict file_path -> fingerprint, the fingerprint is None if it could not be backfilled.
+    '''
+    cursor = conn.execute('SELECT file_path, file_size, file_mtime_ns, file_inode FROM beads')
+    return {
+        file_path: (None if file_size is None else (file_size, file_mtime_ns, file_inode))
+        for file_path, file_size, file_mtime_ns, file_inode in cursor.fetchall()}
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class ArchiveRecord:
+    '''
+    Index rows of a single archive, ready to be bulk inserted.
+    '''
+    bead_row: tuple
+    input_rows: tuple
+
+    @property
+    def key(self):
+        name, content_id = self.bead_row[:2]
+        return name, content_id
+
+
+def read_archive_record(archive_path: Path, box_directory: Path, verify=True) -> ArchiveRecord:
+    '''
+    Read archive, returning its index rows.
+
+    With verify, the archive content is validated (every file is rehashed),
+    otherwise only metadata is read and the bead is recorded as unverified.
+    '''
+    # fingerprint is taken first: if the file changes while read, the next sync reads it again
+    fingerprint = file_fingerprint(os.stat(archive_path))
+    archive = ZipArchive(archive_path, box_name='')
+    if verify:
+        archive.validate()
+        verify_status, verified_at = VERIFY_OK, now_unix_microseconds()
+    else:
+        verify_status, verified_at = VERIFY_UNVERIFIED, None
+
+    relative_path = archive_path.relative_to(box_directory)
     freeze_time_unix = timestamp_to_unix_utc_microseconds(archive.freeze_time_str)
-    conn.execute('''
-        INSERT OR REPLACE INTO beads 
-        (name, content_id, kind, freeze_time_str, freeze_time_unix, file_path)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (archive.name, archive.content_id, archive.kind, 
-          archive.freeze_time_str, freeze_time_unix, str(relative_path)))
+    bead_row = (
+        archive.name, archive.content_id, archive.kind,
+        archive.freeze_time_str, freeze_time_unix, str(relative_path),
+        verify_status, verified_at,
+        *fingerprint,
+        *member_sizes(archive.zipfile))
+    input_rows = tuple(
+        (archive.name, archive.content_id,
+         input_spec.name, input_spec.kind, input_spec.content_id, input_spec.freeze_time_str)
+        for input_spec in archive.inputs)
+    return ArchiveRecord(bead_row, input_rows)
 
 
-def delete_bead_inputs(conn, name, content_id):
-    '''Delete existing inputs for a bead.'''
-    conn.execute('DELETE FROM inputs WHERE bead_name = ? AND bead_content_id = ?',
-                (name, content_id))
+def _read_archive_record_or_none(archive_path: Path, box_directory: Path, verify=True):
+    try:
+        return read_archive_record(archive_path, box_directory, verify)
+    except Exception:
+        # invalid archives are not indexed
+        return None
+    finally:
+        # archives are read only once while indexing, do not keep them open
+        zipopener.close(archive_path)
 
 
-def insert_input_record(conn, bead_name, bead_content_id, input_spec):
-    '''Insert single input record into database.'''
-    conn.execute('''
-        INSERT INTO inputs 
-        (bead_name, bead_content_id, input_name, input_kind, 
+def read_archive_records(archive_paths, box_directory: Path, jobs=1, verify=True):
+    '''
+    Read archives on `jobs` threads, yielding ArchiveRecord-s (None for invalid archives).
+
+    Records are yielded in completion order.
+    '''
+    read = functools.partial(_read_archive_record_or_none, box_directory=box_directory, verify=verify)
+    return map_unordered(read, archive_paths, jobs)
+
+
+def insert_archive_records(conn, records):
+    '''Insert or replace beads and their inputs with bulk statements.'''
+    conn.executemany(
+        'DELETE FROM inputs WHERE bead_name = ? AND bead_content_id = ?',
+        [record.key for record in records])
+    conn.executemany('''
+        INSERT OR REPLACE INTO beads
+        (name, content_id, kind, freeze_time_str, freeze_time_unix, file_path,
+         verify_status, verified_at,
+         file_size, file_mtime_ns, file_inode,
+         data_bytes, uncompressed_bytes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [record.bead_row for record in records])
+    conn.executemany('''
+        INSERT INTO inputs
+        (bead_name, bead_content_id, input_name, input_kind,
          input_content_id, input_freeze_time_str)
         VALUES (?, ?, ?, ?, ?, ?)
-    ''', (bead_name, bead_content_id, input_spec.name, 
-          input_spec.kind, input_spec.content_id, input_spec.freeze_time_str))
+    ''', [input_row for record in records for input_row in record.input_rows])
+
+
+def is_busy_error(e: Exception) -> bool:
+    return isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+
+
+def retry_when_busy(update: Callable):
+    '''Call update(), retrying with jittered exponential backoff while the index is locked.'''
+    for attempt in range(BUSY_RETRY_ATTEMPTS):
+        try:
+            return update()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == BUSY_RETRY_ATTEMPTS - 1:
+                raise
+        time.sleep(random.uniform(0, BUSY_RETRY_DELAY_SECONDS * 2 ** attempt))
+
+
+def append_pending_archive_names(pending_path: Path, names):
+    '''
+    Append archive names to the pending-ingest queue.
+
+    The queue is only ever appended to (a short O_APPEND write is atomic), and taken over as a whole
+    by claim_pending_archive_names, so concurrent writers need no locking.
+    '''
+    data = b''.join(os.fsencode(name) + b'\n' for name in names)
+    fd = os.open(pending_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def read_pending_archive_names(pending_path: Path) -> list[str]:
+    '''Archive names in the pending-ingest queue, without duplicates.'''
+    try:
+        data = Path(pending_path).read_bytes()
+    except FileNotFoundError:
+        return []
+    return list(dict.fromkeys(os.fsdecode(line) for line in data.splitlines() if line))
+
+
+def claim_pending_archive_names(pending_path: Path):
+    '''
+    Take over the pending-ingest queue by moving it to a name unique to this claim.
 
+    Returns (claimed path, archive names), (None, []) if nothing is queued.
+    Writers appending later start a new queue.
+    The claimed path is to be removed after its archives are indexed.
+    '''
+    claimed_path = pending_path.with_name(f'{pending_path.name}.{os.getpid()}-{random.getrandbits(32):08x}')
+    try:
+        os.rename(pending_path, claimed_path)
+    except FileNotFoundError:
+        return None, []
+    return claimed_path, read_pending_archive_names(claimed_path)
 
-def delete_bead_record(conn, file_path):
-    '''Delete bead and its inputs by file path.'''
+
+def delete_bead_records(conn, file_paths):
+    '''Delete beads and their inputs by file paths.'''
+    file_path_rows = [(file_path,) for file_path in file_paths]
     # First delete inputs
-    conn.execute('''
-        DELETE FROM inputs 
+    conn.executemany('''
+        DELETE FROM inputs
         WHERE (bead_name, bead_content_id) IN (
             SELECT name, content_id FROM beads WHERE file_path = ?
         )
-    ''', (file_path,))
-    
-    # Then delete the bead
-    conn.execute('DELETE FROM beads WHERE file_path = ?', (file_path,))
+    ''', file_path_rows)
+
+    # Then delete the beads
+    conn.executemany('DELETE FROM beads WHERE file_path = ?', file_path_rows)
+
+
+def get_files_to_verify(conn, recheck=False):
+    '''Get file paths of beads, that are not verified yet (all beads with recheck).'''
+    if recheck:
+        cursor = conn.execute('SELECT file_path FROM beads')
+    else:
+        cursor = conn.execute('SELECT file_path FROM beads WHERE verify_status = ?', (VERIFY_UNVERIFIED,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def update_verify_status(conn, verify_results):
+    '''Record results of content verification: (file_path, verify_status, verified_at) tuples.'''
+    conn.executemany(
+        'UPDATE beads SET verify_status = ?, verified_at = ? WHERE file_path = ?',
+        [(verify_status, verified_at, file_path) for file_path, verify_status, verified_at in verify_results])
+
+
+def verify_archive_file(archive_path: Path):
+    '''Validate archive content, returning the new verify_status, or None if the file is gone.'''
+    if not archive_path.exists():
+        return None
+    try:
+        ZipArchive(archive_path, box_name='').validate()
+        return VERIFY_OK
+    except Exception:
+        # an archive, that can not be fully read is damaged as well
+        return VERIFY_DAMAGED
+    finally:
+        zipopener.close(archive_path)
+
+
+def get_state(conn, key):
+    '''Get value of an index state variable, None if not set.'''
+    row = conn.execute('SELECT value FROM index_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_state(conn, key, value):
+    '''Set (or delete with None value) an index state variable.'''
+    if value is None:
+        conn.execute('DELETE FROM index_state WHERE key = ?', (key,))
+    else:
+        conn.execute('INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)', (key, value))
 
 
 def find_file_path(conn, name, content_id):
@@ -126,11 +590,9 @@ def find_file_path(conn, name, content_id):
 def timestamp_to_unix_utc_microseconds(timestamp):
     """Convert timestamp to UTC unix microseconds for database storage."""
     if hasattr(timestamp, 'timestamp'):
-        return int(timestamp.timestamp() * 1_000_000)
+        return unix_microseconds(timestamp)
     elif isinstance(timestamp, str):
-        from .tech.timestamp import time_from_timestamp
-        dt = time_from_timestamp(timestamp)
-        return int(dt.timestamp() * 1_000_000)
+        return unix_microseconds(time_from_timestamp(timestamp))
     return timestamp
 
 
@@ -146,8 +608,12 @@ def normalize_timestamp_value(value):
     return timestamp_to_unix_utc_microseconds(value)
 
 
-def build_where_clause(conditions):
-    '''Build SQL WHERE clause from query conditions.'''
+def build_where_clause(conditions, inputs_table='inputs'):
+    '''
+    Build SQL WHERE clause from query conditions.
+
+    `inputs_table` is the inputs table of the same index as the queried beads table.
+    '''
     condition_mapping = {
         QueryCondition.BEAD_NAME: ('name = ?', lambda v: v),
         QueryCondition.KIND: ('kind = ?', lambda v: v),
@@ -157,6 +623,14 @@ def build_where_clause(conditions):
         QueryCondition.OLDER_THAN: ('freeze_time_unix < ?', normalize_timestamp_value),
         QueryCondition.AT_OR_NEWER: ('freeze_time_unix >= ?', normalize_timestamp_value),
         QueryCondition.AT_OR_OLDER: ('freeze_time_unix <= ?', normalize_timestamp_value),
+        QueryCondition.VERIFIED: ('verify_status = ?', lambda _: VERIFY_OK),
+        QueryCondition.UNDAMAGED: ('verify_status != ?', lambda _: VERIFY_DAMAGED),
+        QueryCondition.CONSUMES: (
+            f'content_id IN ({CONSUMERS_SQL.format(inputs=inputs_table)})', lambda v: v),
+        QueryCondition.UPSTREAM_OF: (
+            f'content_id IN ({UPSTREAM_SQL.format(inputs=inputs_table)})', lambda v: v),
+        QueryCondition.DOWNSTREAM_OF: (
+            f'content_id IN ({DOWNSTREAM_SQL.format(inputs=inputs_table)})', lambda v: v),
     }
     
     where_parts = []
@@ -171,52 +645,194 @@ def build_where_clause(conditions):
     return where_parts, parameters
 
 
-def query_beads(conn, conditions, box_name):
-    '''Execute query and return list of Bead instances.'''
+def query_beads(conn, conditions, box_name, order=None, limit=None):
+    '''
+    Execute query and return list of Bead instances.
+
+    Results are sorted by freeze time (oldest first, unless order is QueryOrder.NEWEST_FIRST).
+    With a limit only the first `limit` rows are read.
+    '''
     where_parts, parameters = build_where_clause(conditions)
-    
-    sql = 'SELECT name, content_id, kind, freeze_time_str, file_path FROM beads'
+    limit_parameters = [] if limit is None else [limit]
+    rows = conn.execute(beads_query_sql(where_parts, order, limit), parameters + limit_parameters).fetchall()
+    if not rows:
+        return []
+
+    if limit is None:
+        inputs_by_bead = load_inputs_for_query(conn, where_parts, parameters)
+    else:
+        # the query might match many more beads than returned
+        inputs_by_bead = load_inputs_for_beads(conn, [(name, content_id) for name, content_id, *_ in rows])
+    return [
+        BeadRecord.from_row(row, box_name, inputs_by_bead.get((row[0], row[1]), ()))
+        for row in rows]
+
+
+def iter_query_beads(conn, conditions, box_name, order=None, limit=None):
+    '''
+    Stream Bead instances matching a query, in the order of query_beads.
+
+    Rows are read from the cursor STREAM_BATCH_SIZE at a time, with inputs loaded for each batch.
+    '''
+    cursor = conn.execute(*query_sql(conditions, order, limit))
+    while rows := cursor.fetchmany(STREAM_BATCH_SIZE):
+        inputs_by_bead = load_inputs_for_beads(conn, [(name, content_id) for name, content_id, *_ in rows])
+        for row in rows:
+            yield BeadRecord.from_row(row, box_name, inputs_by_bead.get((row[0], row[1]), ()))
+
+
+def query_sql(conditions, order=None, limit=None):
+    '''SQL and parameters selecting bead rows matching conditions, see query_beads.'''
+    where_parts, parameters = build_where_clause(conditions)
+    if limit is not None:
+        parameters = parameters + [limit]
+    return beads_query_sql(where_parts, order, limit), parameters
+
+
+def beads_query_sql(where_parts, order=None, limit=None):
+    '''SQL selecting bead rows matching where_parts, with a `?` parameter for limit.'''
+    sql = 'SELECT name, content_id, kind, freeze_time_str, freeze_time_unix FROM beads'
     if where_parts:
         sql += ' WHERE ' + ' AND '.join(where_parts)
-    sql += ' ORDER BY freeze_time_unix'
-    
-    cursor = conn.execute(sql, parameters)
-    
-    beads = []
-    for row in cursor.fetchall():
-        name, content_id, kind, freeze_time_str, file_path = row
-        
-        bead = Bead()
-        bead.name = name
-        bead.content_id = content_id
-        bead.kind = kind
-        bead.freeze_time_str = freeze_time_str
-        bead.box_name = box_name
-        
-        bead.inputs = load_bead_inputs(conn, name, content_id)
-        beads.append(bead)
-    
-    return beads
+    if order == QueryOrder.NEWEST_FIRST:
+        sql += ' ORDER BY freeze_time_unix DESC'
+    else:
+        sql += ' ORDER BY freeze_time_unix'
+    if limit is not None:
+        sql += ' LIMIT ?'
+    return sql
 
 
-def load_bead_inputs(conn, name, content_id):
-    '''Load input specifications for a bead.'''
-    cursor = conn.execute('''
-        SELECT input_name, input_kind, input_content_id, input_freeze_time_str
-        FROM inputs WHERE bead_name = ? AND bead_content_id = ?
-    ''', (name, content_id))
-    
-    inputs = []
-    for row in cursor.fetchall():
-        input_name, input_kind, input_content_id, input_freeze_time_str = row
-        inputs.append(InputSpec(
-            name=input_name,
-            kind=input_kind,
-            content_id=input_content_id,
-            freeze_time_str=input_freeze_time_str
-        ))
-    
-    return inputs
+def inputs_query_sql(where_parts):
+    '''
+    SQL selecting input rows of beads matching where_parts.
+
+    The where clause is the one built for the beads table: the column names of
+    the two tables do not overlap, so it can be applied to the join unchanged.
+    '''
+    sql = '''
+        SELECT bead_name, bead_content_id,
+               input_name, input_kind, input_content_id, input_freeze_time_str
+        FROM inputs
+        JOIN beads ON beads.name = inputs.bead_name AND beads.content_id = inputs.bead_content_id
+    '''
+    if where_parts:
+        sql += ' WHERE ' + ' AND '.join(where_parts)
+    return sql
+
+
+def group_input_rows(rows):
+    '''
+    Group (bead_name, bead_content_id, name, kind, content_id, freeze_time_str) input rows by bead.
+
+    Returns a dict (bead_name, bead_content_id) -> list of (name, kind, content_id, freeze_time_str).
+    '''
+    inputs_by_bead = {}
+    for bead_name, bead_content_id, *input_row in rows:
+        inputs_by_bead.setdefault((bead_name, bead_content_id), []).append(tuple(input_row))
+    return inputs_by_bead
+
+
+def load_inputs_for_query(conn, where_parts, parameters):
+    '''
+    Load input specifications for all beads matching a query in one round trip.
+
+    Returns a dict (bead_name, bead_content_id) -> list of input rows, see group_input_rows.
+    '''
+    return group_input_rows(conn.execute(inputs_query_sql(where_parts), parameters))
+
+
+def bead_inputs_sql(bead_keys, inputs_table='inputs'):
+    '''SQL and parameters selecting input rows of the given (bead_name, bead_content_id)-s.'''
+    values = ', '.join('(?, ?)' for _ in bead_keys)
+    sql = f'''
+        SELECT bead_name, bead_content_id,
+               input_name, input_kind, input_content_id, input_freeze_time_str
+        FROM {inputs_table}
+        WHERE (bead_name, bead_content_id) IN (VALUES {values})
+    '''
+    return sql, [part for key in bead_keys for part in key]
+
+
+def load_inputs_for_beads(conn, bead_keys):
+    '''
+    Load input specifications for the given (bead_name, bead_content_id)-s.
+
+    Keys are bound as parameters, so they are looked up STREAM_BATCH_SIZE at a time
+    to stay within the SQLite limit on the number of parameters of a statement.
+    Returns a dict (bead_name, bead_content_id) -> list of input rows, see group_input_rows.
+    '''
+    inputs_by_bead = {}
+    for start in range(0, len(bead_keys), STREAM_BATCH_SIZE):
+        sql, parameters = bead_inputs_sql(bead_keys[start:start + STREAM_BATCH_SIZE])
+        inputs_by_bead.update(group_input_rows(conn.execute(sql, parameters)))
+    return inputs_by_bead
+
+
+LOOKUP_SQL = '''
+    WITH lookups(lookup_no, kind, content_id, freeze_time_unix) AS (VALUES {values})
+    SELECT lookup_no, name, content_id, kind, freeze_time_str, freeze_time_unix FROM (
+        SELECT lookups.lookup_no, beads.name, beads.content_id, beads.kind,
+               beads.freeze_time_str, beads.freeze_time_unix,
+               ROW_NUMBER() OVER (PARTITION BY lookups.lookup_no ORDER BY beads.freeze_time_unix) AS nth
+        FROM lookups
+        JOIN beads ON beads.content_id = lookups.content_id
+        UNION ALL
+        SELECT lookups.lookup_no, beads.name, beads.content_id, beads.kind,
+               beads.freeze_time_str, beads.freeze_time_unix,
+               ROW_NUMBER() OVER (PARTITION BY lookups.lookup_no ORDER BY beads.freeze_time_unix DESC) AS nth
+        FROM lookups
+        JOIN beads ON beads.kind = lookups.kind AND beads.freeze_time_unix <= lookups.freeze_time_unix
+    )
+    WHERE nth = 1
+'''
+
+
+def lookup_parameters(lookup_no, lookup: BeadLookup):
+    '''(lookup_no, kind, content_id, freeze_time_unix) row of the lookups table of LOOKUP_SQL.'''
+    if lookup.content_id is not None:
+        return (lookup_no, None, lookup.content_id, None)
+    freeze_time_unix = MAX_FREEZE_TIME_UNIX if lookup.time is None else normalize_timestamp_value(lookup.time)
+    return (lookup_no, lookup.kind, None, freeze_time_unix)
+
+
+def lookup_sql(lookups, start=0):
+    '''SQL and parameters answering lookups, numbered from start.'''
+    values = ', '.join('(?, ?, ?, ?)' for _ in lookups)
+    parameters = [
+        parameter
+        for lookup_no, lookup in enumerate(lookups, start=start)
+        for parameter in lookup_parameters(lookup_no, lookup)]
+    return LOOKUP_SQL.format(values=values), parameters
+
+
+def lookup_beads(conn, lookups, box_name):
+    '''
+    Answer BeadLookup-s with one statement per LOOKUP_BATCH_SIZE of them.
+
+    Returns a list of Bead-s or None-s, one for each lookup.
+    '''
+    answers = [None] * len(lookups)
+    for start in range(0, len(lookups), LOOKUP_BATCH_SIZE):
+        rows = conn.execute(*lookup_sql(lookups[start:start + LOOKUP_BATCH_SIZE], start)).fetchall()
+        if not rows:
+            continue
+        inputs_by_bead = load_inputs_for_beads(conn, list({(name, content_id) for _, name, content_id, *_ in rows}))
+        for lookup_no, *row in rows:
+            answers[lookup_no] = BeadRecord.from_row(row, box_name, inputs_by_bead.get((row[0], row[1]), ()))
+    return answers
+
+
+def read_change_counter(index_path: Path) -> int:
+    '''
+    The file change counter in the header of an SQLite database.
+
+    It is incremented by every committed transaction in rollback journal modes (used for indexes),
+    by any process - reading it is much cheaper than opening the database.
+    '''
+    with open(index_path, 'rb') as f:
+        header = f.read(28)
+    return int.from_bytes(header[24:28], 'big')
 
 
 def index_path_exists(box_directory: Path) -> bool:
@@ -236,97 +852,361 @@ def can_read_index(box_directory: Path) -> bool:
         return False
 
 
-def ensure_index(box_directory: Path) -> bool:
-    """Ensure SQLite index exists, creating it if necessary."""
+def is_index_up_to_date(index_path: Path) -> bool:
+    """Test if SQLite index has (at least) the current schema version."""
     try:
-        index_path = box_directory / '.index.sqlite'
+        with create_query_connection(index_path) as conn:
+            return get_schema_version(conn) >= SCHEMA_VERSION
+    except Exception:
+        return False
+
+
+def ensure_index(index_path: Path) -> bool:
+    """Ensure SQLite index exists with current schema, creating or migrating it if necessary."""
+    def create_or_migrate():
         with create_update_connection(index_path):
             pass
+
+    try:
+        retry_when_busy(create_or_migrate)
         return True
     except Exception:
         return False
 
 
+def user_cache_path(box_directory: Path, category: str, suffix: str) -> Path:
+    """
+    Location of a user-local file of a box in the user's cache directory, keyed by the box's absolute path.
+    """
+    box_directory = Path(box_directory).resolve()
+    digest = hashlib.sha256(str(box_directory).encode('utf-8')).hexdigest()[:16]
+    return Path(appdirs.user_cache_dir('bead')) / category / f'{box_directory.name}-{digest}{suffix}'
+
+
+def shadow_index_path(box_directory: Path) -> Path:
+    """
+    Location of a user-local index for a box, that can not hold its own index.
+
+    Shadow indexes are in the user's cache directory, keyed by the box's absolute path.
+    """
+    return user_cache_path(box_directory, 'shadow-indexes', '.sqlite')
+
+
 class BoxIndex:
     '''
     SQLite-based index for a bead box implementing BoxResolver protocol.
     '''
     
-    def __init__(self, box_directory: Path):
+    def __init__(self, box_directory: Path, index_path: Path | None = None):
         self.box_directory = Path(box_directory)
-        self.index_path = self.box_directory / '.index.sqlite'
-        ensure_index(self.box_directory)
+        if index_path is None:
+            index_path = self.box_directory / '.index.sqlite'
+        self.index_path = Path(index_path)
+        self.pending_path = self.index_path.with_name(self.index_path.name + PENDING_SUFFIX)
+        self._update_count = 0
+        ensure_index(self.index_path)
     
-    def rebuild(self):
-        '''Rebuild index from scratch by scanning all files.'''
-        if self.index_path.exists():
+    @property
+    def generation(self):
+        '''
+        Changes with every update of the index, by this instance or by others (see read_change_counter).
+
+        None if unknown.
+        '''
+        try:
+            return self._update_count, read_change_counter(self.index_path)
+        except OSError:
+            return None
+
+    def rebuild(self, jobs=1, progress=None, verify=True):
+        '''
+        Rebuild index from scratch by scanning all files.
+
+        Archives are read on `jobs` threads, and committed in batches of INDEX_BATCH_SIZE.
+        Without verify only metadata is read, content can be verified later with `verify()`.
+        If a rebuild is interrupted, the next rebuild (or sync) continues where it stopped.
+
+        `progress(done, total)` is called after each archive processed.
+        '''
+        if not self._is_rebuild_interrupted() and self.index_path.exists():
             self.index_path.unlink()
-        
-        for zip_path in self.box_directory.glob('*.zip'):
-            self.index_archive_file(zip_path)
-    
-    def sync(self):
-        '''Add new files to index and remove deleted files.'''
+
+        with create_update_connection(self.index_path) as conn:
+            set_state(conn, REBUILD_IN_PROGRESS, '1')
+            conn.commit()
+
+            try:
+                self._sync(conn, jobs, progress, verify, full=True)
+            finally:
+                self._update_count += 1
+
+    def _is_rebuild_interrupted(self):
         try:
             with create_query_connection(self.index_path) as conn:
-                indexed_files = get_indexed_files(conn)
-
-            # Get current files in directory
-            current_files = set()
-            for archive_path in self.box_directory.glob('*.zip'):
-                relative_path = archive_path.relative_to(self.box_directory)
-                current_files.add(str(relative_path))
-                
-                # Add new files to index
-                if str(relative_path) not in indexed_files:
-                    self.index_archive_file(archive_path)
-            
-            # Remove files from index that no longer exist
-            orphaned_files = indexed_files - current_files
-            for file_path in orphaned_files:
-                orphaned_archive_path = self.box_directory / file_path
-                self.unindex_archive_file(orphaned_archive_path)
+                return get_state(conn, REBUILD_IN_PROGRESS) is not None
         except Exception:
-            pass
-    
-    def index_archive_file(self, archive_path: Path):
-        '''Add single bead to index.'''
+            return False
+
+    def sync(self, jobs=1, progress=None, verify=True, full=False):
+        '''
+        Add new and changed files to index and remove deleted files.
+
+        Files are compared by their fingerprint (size, mtime, inode), only
+        new and changed archives are read.
+        The whole scan is skipped if the box directory has not changed since
+        the last sync. As archives overwritten in place do not change the
+        directory, `full` forces the scan.
+
+        See `rebuild` for `jobs`, `progress` and `verify`.
+        Raises BoxIndexError if the index could not be updated (e.g. it is locked or not writable),
+        the batches committed before the failure remain in the index.
+        '''
+        claimed_path = None
         try:
-            archive = ZipArchive(archive_path, box_name='')
-            archive.validate()
-            
-            relative_path = archive_path.relative_to(self.box_directory)
-            
+            # archives queued by writers are found by the scan
+            claimed_path, pending_names = claim_pending_archive_names(self.pending_path)
             with create_update_connection(self.index_path) as conn:
-                insert_bead_record(conn, archive, relative_path)
-                delete_bead_inputs(conn, archive.name, archive.content_id)
-                
-                for input_spec in archive.inputs:
-                    insert_input_record(conn, archive.name, archive.content_id, input_spec)
-                
+                self._sync(conn, jobs, progress, verify, full)
+            pending_names = []
+        except Exception as e:
+            raise BoxIndexError(f"Failed to sync index: {e}") from e
+        finally:
+            self._update_count += 1
+            if claimed_path is not None:
+                if pending_names:
+                    append_pending_archive_names(self.pending_path, pending_names)
+                claimed_path.unlink()
+
+    def _sync(self, conn, jobs, progress, verify, full):
+        # columns added by migrations are filled in before anything else,
+        # indexes created before fingerprints were recorded adopt the current ones
+        run_backfills(conn, self.box_directory, jobs)
+
+        directory_mtime_ns = os.stat(self.box_directory).st_mtime_ns
+        if not full and get_state(conn, DIRECTORY_MTIME_NS) == str(directory_mtime_ns):
+            return
+
+        indexed_fingerprints = get_indexed_fingerprints(conn)
+
+        # Get current files in directory
+        current_files = set()
+        changed_archive_paths = []
+        for entry in os.scandir(self.box_directory):
+            # same files as glob('*.zip') would find
+            if entry.name.startswith('.') or not entry.name.endswith('.zip') or not entry.is_file():
+                continue
+            current_files.add(entry.name)
+            if indexed_fingerprints.get(entry.name) != file_fingerprint(entry.stat()):
+                changed_archive_paths.append(self.box_directory / entry.name)
+
+        # Replaced archives might have different content, forget their old version
+        delete_bead_records(conn, [path.name for path in changed_archive_paths if path.name in indexed_fingerprints])
+
+        # Add new and changed files to index
+        self._index_archive_files(conn, changed_archive_paths, jobs, progress, verify)
+
+        # Remove files from index that no longer exist
+        delete_bead_records(conn, indexed_fingerprints.keys() - current_files)
+
+        # Directory is fully indexed, also an interrupted rebuild is finished
+        set_state(conn, REBUILD_IN_PROGRESS, None)
+        is_directory_settled = time.time_ns() - directory_mtime_ns > DIRECTORY_MTIME_SLACK_NS
+        set_state(conn, DIRECTORY_MTIME_NS, str(directory_mtime_ns) if is_directory_settled else None)
+        conn.commit()
+
+    def _index_archive_files(self, conn, archive_paths, jobs=1, progress=None, verify=True):
+        '''
+        Index archives in batches, committing after each batch.
+
+        Archives are read in parallel, but written only from the calling thread.
+        '''
+        total = len(archive_paths)
+        batch = []
+        records = read_archive_records(archive_paths, self.box_directory, jobs, verify)
+        for done, record in enumerate(records, start=1):
+            if record is not None:
+                batch.append(record)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                insert_archive_records(conn, batch)
                 conn.commit()
+                batch = []
+            if progress is not None:
+                progress(done, total)
+        insert_archive_records(conn, batch)
+        conn.commit()
+
+    def index_archive_file(self, archive_path: Path, verify=True):
+        '''
+        Add single bead to index.
+
+        Updates are retried while other writers hold the index (see retry_when_busy).
+        If the index still can not be updated, the archive is added to the pending-ingest queue
+        instead, and indexed by the next index_archive_file or sync.
+        Archives queued by others are indexed after this one.
+        '''
+        try:
+            record = _read_archive_record_or_none(archive_path, self.box_directory, verify)
+            if record is None:
+                return
+
+            try:
+                retry_when_busy(lambda: self._insert_archive_records([record]))
+            except Exception:
+                append_pending_archive_names(self.pending_path, [str(archive_path.relative_to(self.box_directory))])
+                return
+            self._index_pending_archive_files(verify)
         except Exception:
             pass
-    
+        finally:
+            self._update_count += 1
+
+    def _insert_archive_records(self, records):
+        with create_update_connection(self.index_path) as conn:
+            insert_archive_records(conn, records)
+            conn.commit()
+
+    def _index_pending_archive_files(self, verify):
+        '''Index archives in the pending-ingest queue, putting them back if the index is still locked.'''
+        if not self.pending_path.exists():
+            return
+        claimed_path, names = claim_pending_archive_names(self.pending_path)
+        if claimed_path is None:
+            return
+        try:
+            archive_paths = [self.box_directory / name for name in names if (self.box_directory / name).exists()]
+            records = [
+                record for record in read_archive_records(archive_paths, self.box_directory, verify=verify)
+                if record is not None]
+            try:
+                retry_when_busy(lambda: self._insert_archive_records(records))
+            except Exception:
+                append_pending_archive_names(self.pending_path, names)
+        finally:
+            claimed_path.unlink(missing_ok=True)
+
+    def verify(self, jobs=1, progress=None, recheck=False):
+        '''
+        Verify content of beads indexed without verification (all beads with recheck).
+
+        Results are committed in batches, so an interrupted verification continues
+        where it stopped. Archives that have disappeared are left unchanged for `sync`.
+
+        Returns list of file paths (relative to box directory) found damaged.
+        '''
+        with create_update_connection(self.index_path) as conn:
+            file_paths = get_files_to_verify(conn, recheck)
+
+            def verify_file(file_path):
+                return file_path, verify_archive_file(self.box_directory / file_path), now_unix_microseconds()
+
+            damaged_file_paths = []
+            batch = []
+            for done, (file_path, verify_status, verified_at) in enumerate(
+                    map_unordered(verify_file, file_paths, jobs), start=1):
+                if verify_status is not None:
+                    batch.append((file_path, verify_status, verified_at))
+                if verify_status == VERIFY_DAMAGED:
+                    damaged_file_paths.append(file_path)
+                if len(batch) >= INDEX_BATCH_SIZE:
+                    update_verify_status(conn, batch)
+                    conn.commit()
+                    batch = []
+                if progress is not None:
+                    progress(done, len(file_paths))
+            update_verify_status(conn, batch)
+            conn.commit()
+        self._update_count += 1
+        return damaged_file_paths
+
     def unindex_archive_file(self, archive_path: Path):
         '''Remove bead from index by file path.'''
         try:
             relative_path = archive_path.relative_to(self.box_directory)
-            
+
             with create_update_connection(self.index_path) as conn:
-                delete_bead_record(conn, str(relative_path))
+                delete_bead_records(conn, [str(relative_path)])
                 conn.commit()
         except Exception:
             pass
-    
-    def get_beads(self, conditions, box_name: str) -> list[Bead]:
-        '''Query beads from index.'''
+        finally:
+            self._update_count += 1
+
+    def vacuum(self):
+        '''Rebuild the index file, returning space of deleted rows to the file system.'''
+        with create_update_connection(self.index_path) as conn:
+            conn.execute('VACUUM')
+
+    def analyze(self):
+        '''Collect statistics for the SQLite query planner.'''
+        with create_update_connection(self.index_path) as conn:
+            conn.execute('ANALYZE')
+            conn.commit()
+
+    def get_beads(self, conditions, box_name: str, order=None, limit=None) -> list[Bead]:
+        '''Query beads from index, sorted by freeze time and limited in SQL.'''
         try:
             with create_query_connection(self.index_path) as conn:
-                return query_beads(conn, conditions, box_name)
+                return query_beads(conn, conditions, box_name, order, limit)
         except Exception as e:
             raise BoxIndexError(f"Failed to query index: {e}")
     
+    def iter_beads(self, conditions, box_name: str, order=None, limit=None) -> Iterator[Bead]:
+        '''Stream beads from index, sorted by freeze time and limited in SQL.'''
+        try:
+            with create_query_connection(self.index_path) as conn:
+                yield from iter_query_beads(conn, conditions, box_name, order, limit)
+        except sqlite3.Error as e:
+            raise BoxIndexError(f"Failed to query index: {e}")
+
+    def lookup_beads(self, lookups: list[BeadLookup], box_name: str) -> list[Bead | None]:
+        '''Answer many lookups at once, see the BoxResolver protocol.'''
+        try:
+            with create_query_connection(self.index_path) as conn:
+                return lookup_beads(conn, lookups, box_name)
+        except sqlite3.Error as e:
+            raise BoxIndexError(f"Failed to query index: {e}")
+
+    def query_plan(self, sql, parameters=()) -> list[str]:
+        '''Steps of answering sql, as reported by EXPLAIN QUERY PLAN.'''
+        try:
+            with create_query_connection(self.index_path) as conn:
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            raise BoxIndexError(f"Failed to query index: {e}")
+        return [detail for _id, _parent, _notused, detail in rows]
+
+    def iter_bead_rows(self):
+        '''
+        Stream (name, content_id, kind, freeze_time_str) of all beads, oldest first.
+
+        Together with iter_input_rows it exports the whole dependency graph
+        in two table scans, without creating Bead objects.
+        '''
+        try:
+            with create_query_connection(self.index_path) as conn:
+                yield from conn.execute(
+                    'SELECT name, content_id, kind, freeze_time_str FROM beads ORDER BY freeze_time_unix')
+        except sqlite3.Error as e:
+            raise BoxIndexError(f"Failed to query index: {e}")
+
+    def iter_input_rows(self):
+        '''
+        Stream (bead_name, bead_content_id, InputSpec) of all inputs of all beads.
+        '''
+        try:
+            with create_query_connection(self.index_path) as conn:
+                cursor = conn.execute('''
+                    SELECT bead_name, bead_content_id,
+                           input_name, input_kind, input_content_id, input_freeze_time_str
+                    FROM inputs
+                ''')
+                for row in cursor:
+                    bead_name, bead_content_id, input_name, input_kind, input_content_id, input_freeze_time_str = row
+                    yield bead_name, bead_content_id, InputSpec.from_trusted(
+                        input_name, input_kind, input_content_id, input_freeze_time_str)
+        except sqlite3.Error as e:
+            raise BoxIndexError(f"Failed to query index: {e}")
+
     def get_file_path(self, name: str, content_id: str) -> Path:
         '''Get file path for bead.'''
         try:
@@ -1,6 +1,9 @@
+from datetime import datetime
 from enum import Enum
 from enum import auto
 
+import attr
+
 
 class QueryCondition(Enum):
     BEAD_NAME = auto()
@@ -11,3 +14,55 @@ class QueryCondition(Enum):
     OLDER_THAN = auto()
     AT_OR_NEWER = auto()
     AT_OR_OLDER = auto()
+    VERIFIED = auto()
+    UNDAMAGED = auto()
+    # dependency graph (within the box): value is a content_id
+    CONSUMES = auto()
+    UPSTREAM_OF = auto()
+    DOWNSTREAM_OF = auto()
+
+
+class QueryOrder(Enum):
+    """
+    Order of query results by freeze time.
+    """
+    OLDEST_FIRST = auto()
+    NEWEST_FIRST = auto()
+
+
+@attr.s(frozen=True, auto_attribs=True)
+class BeadLookup:
+    """
+    A search answered by at most one bead, to be run in batches.
+
+    With a content_id the answer is the oldest bead with that content_id,
+    otherwise it is the newest bead of kind frozen at or before time (any time, if time is None).
+    """
+    kind: str | None = None
+    content_id: str | None = None
+    time: datetime | None = None
+
+    @classmethod
+    def by_content_id(cls, content_id: str) -> 'BeadLookup':
+        return cls(content_id=content_id)
+
+    @classmethod
+    def newest_of_kind(cls, kind: str, at_or_older: datetime | None = None) -> 'BeadLookup':
+        return cls(kind=kind, time=at_or_older)
+
+    @property
+    def conditions(self) -> list:
+        """The lookup as conditions of a search, see `order`."""
+        if self.content_id is not None:
+            return [(QueryCondition.CONTENT_ID, self.content_id)]
+        conditions = [(QueryCondition.KIND, self.kind)]
+        if self.time is not None:
+            conditions.append((QueryCondition.AT_OR_OLDER, self.time))
+        return conditions
+
+    @property
+    def order(self) -> QueryOrder:
+        """Order of the beads matching `conditions`, the answer is the first of them."""
+        if self.content_id is not None:
+            return QueryOrder.OLDEST_FIRST
+        return QueryOrder.NEWEST_FIRST
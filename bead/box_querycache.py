@@ -0,0 +1,88 @@
+"""
+Search results of a box, remembered for the lifetime of the process.
+
+A single command often runs the same search more than once (e.g. for the status and the update of inputs).
+Results are valid while the resolver of the box is the same, and its generation has not changed:
+the generation of a resolver changes with every change of the beads it knows about
+(store, index sync, verification - also by other processes), see the BoxResolver protocol.
+"""
+
+import threading
+from typing import Callable
+from typing import Hashable
+from typing import Iterable
+
+
+class QueryCache:
+    """
+    Results by key, dropped when the resolver or its generation changes.
+
+    Nothing is cached while the generation is None (unknown).
+
+    `hits` and `misses` count the keys found and not found in the cache, for profiling.
+    It is safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        self._resolver = None
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _validate(self, resolver):
+        generation = resolver.generation
+        if resolver is not self._resolver or generation is None or generation != self._generation:
+            self._results.clear()
+            self._resolver = resolver
+            self._generation = generation
+
+    def get(self, resolver, key: Hashable, compute: Callable[[], object]):
+        """Result for key, compute() if not cached."""
+        [result] = self.get_many(resolver, [key], lambda keys: [compute()])
+        return result
+
+    def get_many(self, resolver, keys: Iterable[Hashable], compute_missing: Callable[[list], list]) -> list:
+        """
+        Results for keys, computing the ones not cached with one call.
+
+        compute_missing is called with the list of missing keys, and returns their results in the same order.
+        """
+        keys = list(keys)
+        with self._lock:
+            self._validate(resolver)
+            generation = self._generation
+            results = {key: self._results[key] for key in keys if key in self._results}
+            missing = list(dict.fromkeys(key for key in keys if key not in results))
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            computed = dict(zip(missing, compute_missing(missing)))
+            results.update(computed)
+            with self._lock:
+                # results computed while the resolver changed might be outdated already
+                if generation is not None and resolver is self._resolver and generation == self._generation:
+                    self._results.update(computed)
+        return [results[key] for key in keys]
+
+    def contains(self, resolver, key: Hashable) -> bool:
+        """Is the result for key cached (without computing, or counting it as a hit or miss)."""
+        with self._lock:
+            self._validate(resolver)
+            return key in self._results
+
+    def put(self, resolver, key: Hashable, result, generation: Hashable | None):
+        """
+        Remember a result computed by other means, when the resolver was at generation.
+
+        The result is dropped, when the resolver has changed since.
+        """
+        with self._lock:
+            self._validate(resolver)
+            if generation is not None and generation == self._generation:
+                self._results[key] = result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
@@ -0,0 +1,102 @@
+"""
+Metadata of archives in boxes without index, persisted between processes.
+
+A box searched without index has all its archives opened by every search.
+The cache keeps what is read from them, so that later processes open only new or changed archives.
+"""
+
+import os
+import threading
+
+from . import tech
+from .bead import Bead
+from .bead import BeadRecord
+from .box_index import user_cache_path
+
+Path = tech.fs.Path
+persistence = tech.persistence
+
+# Caches written in another format are ignored (and overwritten)
+RAW_CACHE_VERSION = 1
+
+
+def raw_cache_path(box_directory: Path) -> Path:
+    """
+    Location of the archive cache of a box.
+
+    Caches are in the user's cache directory, keyed by the box's absolute path.
+    """
+    return user_cache_path(box_directory, 'raw-caches', '.json')
+
+
+class ArchiveCache:
+    """
+    Beads read from archive files, valid while the file has the same (size, mtime).
+
+    Entries are file name -> [size, mtime_ns, bead row, input rows],
+    see BeadRecord.from_row for the rows.
+    It is safe to use from multiple threads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries = None
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                content = persistence.file_load(self.path)
+                entries = content['archives'] if content['version'] == RAW_CACHE_VERSION else {}
+            except (OSError, ValueError, LookupError, TypeError):
+                entries = {}
+            self._entries = entries
+        return self._entries
+
+    def get(self, file_name: str, stat_result: os.stat_result, box_name: str) -> Bead | None:
+        """Bead of file_name, None if not cached or the file has changed since."""
+        with self._lock:
+            entry = self._load().get(file_name)
+        if entry is None:
+            return None
+        try:
+            size, mtime_ns, bead_row, input_rows = entry
+            if (size, mtime_ns) != (stat_result.st_size, stat_result.st_mtime_ns):
+                return None
+            return BeadRecord.from_row(bead_row, box_name, tuple(tuple(input_row) for input_row in input_rows))
+        except (ValueError, TypeError):
+            # damaged entry
+            return None
+
+    def put(self, file_name: str, stat_result: os.stat_result, bead: Bead):
+        bead_row = [bead.name, bead.content_id, bead.kind, bead.freeze_time_str, bead.freeze_time_unix]
+        input_rows = [
+            [input.name, input.kind, input.content_id, input.freeze_time_str]
+            for input in bead.inputs]
+        with self._lock:
+            self._load()[file_name] = [stat_result.st_size, stat_result.st_mtime_ns, bead_row, input_rows]
+            self._changed = True
+
+    def save(self, box_directory: Path):
+        """
+        Write the cache, if it has changed.
+
+        Entries of archives no longer in box_directory are dropped.
+        The cache is only an optimization: failures are ignored.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            try:
+                with os.scandir(box_directory) as dir_entries:
+                    file_names = {dir_entry.name for dir_entry in dir_entries}
+                archives = {
+                    file_name: entry for file_name, entry in self._entries.items() if file_name in file_names}
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}-{threading.get_ident()}')
+                persistence.file_dump({'version': RAW_CACHE_VERSION, 'archives': archives}, temp_path)
+                os.replace(temp_path, self.path)
+                self._changed = False
+            except OSError:
+                pass
@@ -1,16 +1,37 @@
+import functools
+import itertools
+import operator
+import os
+import threading
 from typing import Iterable
 from typing import Iterator
 
 from . import tech
 from .bead import Archive
 from .bead import Bead
+from .bead import BeadRecord
+from .box_query import BeadLookup
 from .box_query import QueryCondition
+from .box_query import QueryOrder
+from .box_rawcache import ArchiveCache
 from .exceptions import InvalidArchive
+from .tech.parallel import map_ordered
+from .tech.parallel import map_unordered
+from .tech.timestamp import time_from_timestamp
+from .ziparchive import freeze_time_str_from_file_path
 from .ziparchive import ZipArchive
 
 Path = tech.fs.Path
 
 
+def _is_valid(archive):
+    try:
+        archive.validate()
+    except InvalidArchive:
+        return False
+    return True
+
+
 # Filesystem-specific condition checking for beads
 _CHECKERS = {
     QueryCondition.BEAD_NAME: lambda name: lambda bead: bead.name == name,
@@ -21,9 +42,50 @@ _CHECKERS = {
     QueryCondition.OLDER_THAN: lambda timestamp: lambda bead: bead.freeze_time < timestamp,
     QueryCondition.AT_OR_NEWER: lambda timestamp: lambda bead: bead.freeze_time >= timestamp,
     QueryCondition.AT_OR_OLDER: lambda timestamp: lambda bead: bead.freeze_time <= timestamp,
+    # there is no stored verification state, archives are validated on the spot
+    QueryCondition.VERIFIED: lambda _: _is_valid,
+    QueryCondition.UNDAMAGED: lambda _: _is_valid,
+    QueryCondition.CONSUMES: lambda content_id: lambda bead: any(
+        input.content_id == content_id for input in bead.inputs),
+    # closures are computed by RawFilesystemResolver, the parameter is the set of content_ids in it
+    QueryCondition.UPSTREAM_OF: lambda content_ids: lambda bead: bead.content_id in content_ids,
+    QueryCondition.DOWNSTREAM_OF: lambda content_ids: lambda bead: bead.content_id in content_ids,
+}
+
+_CLOSURE_CONDITIONS = (QueryCondition.UPSTREAM_OF, QueryCondition.DOWNSTREAM_OF)
+
+# Conditions, that need the archive itself, not just its metadata
+_ARCHIVE_CONDITIONS = (QueryCondition.VERIFIED, QueryCondition.UNDAMAGED)
+
+# Number of threads opening archives while scanning a box.
+# Opening an archive is a few round trips on network file systems (sshfs, NFS),
+# threads hide this latency, independent of the number of CPUs.
+DEFAULT_SCAN_JOBS = 8
+
+# Conditions, that can be evaluated on the freeze time in archive file names
+_TIME_OPERATORS = {
+    QueryCondition.AT_TIME: operator.eq,
+    QueryCondition.NEWER_THAN: operator.gt,
+    QueryCondition.OLDER_THAN: operator.lt,
+    QueryCondition.AT_OR_NEWER: operator.ge,
+    QueryCondition.AT_OR_OLDER: operator.le,
 }
 
 
+def dependency_closure(edges, content_id):
+    '''
+    Content ids reachable from content_id following edges (content_id -> set of content_ids).
+    '''
+    closure = set()
+    todo = list(edges.get(content_id, ()))
+    while todo:
+        next_content_id = todo.pop()
+        if next_content_id not in closure:
+            closure.add(next_content_id)
+            todo.extend(edges.get(next_content_id, ()))
+    return closure
+
+
 def compile_conditions(conditions):
     '''
     Compile list of (check-type, check-param)-s into a match function.
@@ -38,16 +100,65 @@ def compile_conditions(conditions):
     return match
 
 
+def compile_time_conditions(conditions):
+    '''
+    Compile the time conditions among conditions into a match function of freeze times.
+    '''
+    checks = [(_TIME_OPERATORS[tag], timestamp) for tag, timestamp in conditions if tag in _TIME_OPERATORS]
+
+    def match(freeze_time):
+        return all(compare(freeze_time, timestamp) for compare, timestamp in checks)
+    return match
+
+
+def freeze_times_from_file_names(paths):
+    '''
+    Freeze times in archive file names as a dict path -> freeze time.
+
+    Returns None if any of the names has no valid timestamp.
+    '''
+    freeze_times = {}
+    for path in paths:
+        freeze_time_str = freeze_time_str_from_file_path(path)
+        if freeze_time_str is None:
+            return None
+        try:
+            freeze_times[path] = time_from_timestamp(freeze_time_str)
+        except ValueError:
+            return None
+    return freeze_times
+
+
 class RawFilesystemResolver:
     """
     Filesystem-based bead resolver with lazy caching.
     """
 
-    def __init__(self, box_directory: Path):
+    def __init__(self, box_directory: Path, jobs: int = DEFAULT_SCAN_JOBS, archive_cache: ArchiveCache | None = None):
         self.box_directory = Path(box_directory)
+        self.jobs = jobs
+        # metadata of archives persisted between processes, archives are opened only if changed
+        self.archive_cache = archive_cache
         self._bead_cache = {}  # (name, content_id) -> Bead
+        self._update_count = 0
+        # number of archive files opened (by scans), for explaining searches
+        self.archives_opened = 0
+        self._archives_opened_lock = threading.Lock()
         self._path_cache = {}  # (name, content_id) -> Path
 
+    @property
+    def generation(self):
+        """
+        Changes with every archive added through this instance, or added/removed by others.
+
+        Others are noticed by the modification time of the box directory
+        (archives overwritten in place are not). None if unknown.
+        """
+        try:
+            return self._update_count, os.stat(self.box_directory).st_mtime_ns
+        except OSError:
+            return None
+
     def _cache_bead_and_path(self, bead: Bead, path: Path) -> None:
         """Cache both bead and path for given bead."""
         key = (bead.name, bead.content_id)
@@ -62,51 +173,204 @@ class RawFilesystemResolver:
             pattern = '*.zip'
         return self.box_directory.glob(pattern)
 
-    def get_beads(self, conditions, box_name: str) -> list[Bead]:
-        """Retrieve beads matching conditions by scanning filesystem."""
+    def get_beads(self, conditions, box_name: str, order=None, limit=None) -> list[Bead]:
+        """
+        Retrieve beads matching conditions by scanning filesystem.
+
+        Time conditions are evaluated on the freeze times in the archive file names,
+        only archives passing them are opened.
+        When both order and limit are given, archives are opened in the order of
+        the freeze times in their file names, and scanning stops after `limit` matches.
+        """
+        conditions, paths = self._prepare_scan(conditions, box_name)
+        match = compile_conditions(conditions)
+        open_archives = any(tag in _ARCHIVE_CONDITIONS for tag, _ in conditions)
+
+        freeze_times = freeze_times_from_file_names(paths)
+        if freeze_times is not None:
+            beads = self._get_beads_by_file_name(
+                freeze_times, box_name, conditions, match, order, limit, open_archives)
+            if beads is not None:
+                return beads
+
+        beads = []
+        # read in the order of paths, so that a limit without order (first()) picks the same beads every time
+        for _path, bead, is_match in self._scan(paths, box_name, match, True, open_archives):
+            if is_match:
+                beads.append(bead)
+                if order is None and limit is not None and len(beads) >= limit:
+                    break
+        if order is not None:
+            beads.sort(key=lambda bead: bead.freeze_time_unix, reverse=order == QueryOrder.NEWEST_FIRST)
+        if limit is not None:
+            return beads[:limit]
+        return beads
+
+    def iter_beads(self, conditions, box_name: str, order=None, limit=None) -> Iterator[Bead]:
+        """
+        Stream beads matching conditions.
+
+        Without order archives are read and matching beads yielded one by one, in the order of file names.
+        With order all matching beads are collected (by get_beads) before the first one is yielded.
+        """
+        if order is not None:
+            yield from self.get_beads(conditions, box_name, order, limit)
+            return
+
+        conditions, paths = self._prepare_scan(conditions, box_name)
         match = compile_conditions(conditions)
+        open_archives = any(tag in _ARCHIVE_CONDITIONS for tag, _ in conditions)
+        beads = (
+            bead
+            for _path, bead, is_match in self._scan(paths, box_name, match, True, open_archives)
+            if is_match)
+        yield from itertools.islice(beads, limit)
+
+    def _prepare_scan(self, conditions, box_name: str):
+        """
+        Resolve closures in conditions, and find the paths of archives, that might match.
 
+        Returns the resolved conditions and the list of candidate paths, sorted by file name.
+        """
+        if any(tag in _CLOSURE_CONDITIONS for tag, _ in conditions):
+            conditions = self._resolve_closures(conditions, box_name)
         bead_names = {
             value
             for tag, value in conditions
             if tag == QueryCondition.BEAD_NAME}
+        if len(bead_names) > 1:
+            return conditions, []
         if bead_names:
-            if len(bead_names) > 1:
-                return []
-            paths = self._glob_bead_files(bead_names.pop())
-        else:
-            paths = self._glob_bead_files()
+            return conditions, sorted(self._glob_bead_files(bead_names.pop()))
+        return conditions, sorted(self._glob_bead_files())
+
+    def lookup_beads(self, lookups: list[BeadLookup], box_name: str) -> list[Bead | None]:
+        """
+        Answer many lookups with a single scan of the box.
+
+        Returns a list of Bead-s or None-s, one for each lookup.
+        """
+        by_content_id = {}  # content_id -> lookup numbers
+        by_kind = {}  # kind -> lookup numbers
+        for lookup_no, lookup in enumerate(lookups):
+            if lookup.content_id is not None:
+                by_content_id.setdefault(lookup.content_id, []).append(lookup_no)
+            else:
+                by_kind.setdefault(lookup.kind, []).append(lookup_no)
+
+        answers = [None] * len(lookups)
+        if not lookups:
+            return answers
+        for _path, bead, _ in self._scan(self._glob_bead_files(), box_name, ordered=True):
+            for lookup_no in by_content_id.get(bead.content_id, ()):
+                answer = answers[lookup_no]
+                if answer is None or bead.freeze_time < answer.freeze_time:
+                    answers[lookup_no] = bead
+            for lookup_no in by_kind.get(bead.kind, ()):
+                answer = answers[lookup_no]
+                time = lookups[lookup_no].time
+                if time is not None and bead.freeze_time > time:
+                    continue
+                if answer is None or bead.freeze_time > answer.freeze_time:
+                    answers[lookup_no] = bead
+        return answers
+
+    def _resolve_closures(self, conditions, box_name: str):
+        """
+        Replace the content_id of closure conditions with the content_ids in the closure.
+
+        Needs the dependency graph of the whole box, so all archives are read.
+        """
+        upstream = {}    # content_id -> input content_ids
+        downstream = {}  # content_id -> content_ids of consumers
+        for _path, bead, _ in self._scan(self._glob_bead_files(), box_name):
+            for input in bead.inputs:
+                upstream.setdefault(bead.content_id, set()).add(input.content_id)
+                downstream.setdefault(input.content_id, set()).add(bead.content_id)
+        edges = {
+            QueryCondition.UPSTREAM_OF: upstream,
+            QueryCondition.DOWNSTREAM_OF: downstream}
+        return [
+            (tag, dependency_closure(edges[tag], value) if tag in _CLOSURE_CONDITIONS else value)
+            for tag, value in conditions]
+
+    def _get_beads_by_file_name(self, freeze_times, box_name: str, conditions, match, order, limit, open_archives):
+        """
+        Find matching beads, opening only archives with a matching freeze time in their file name.
+
+        `freeze_times` is the freeze time of each candidate path, as in its file name.
+        With order, archives are opened in file name order and scanning stops after `limit` matches.
+
+        Returns None if the file names can not be trusted:
+        the freeze time of an opened archive differs from its file name.
+        File names are otherwise trusted as written by Box.store.
+        """
+        match_freeze_time = compile_time_conditions(conditions)
+        paths = [path for path, freeze_time in freeze_times.items() if match_freeze_time(freeze_time)]
+        if order is not None:
+            paths.sort(key=freeze_times.__getitem__, reverse=order == QueryOrder.NEWEST_FIRST)
 
         beads = []
-        for archive in self._archives_from(paths, box_name):
-            if match(archive):
-                bead = self._bead_from_archive(archive)
+        for path, bead, is_match in self._scan(paths, box_name, match, True, open_archives):
+            if bead.freeze_time != freeze_times[path]:
+                return None
+            if is_match:
                 beads.append(bead)
+                if limit is not None and len(beads) >= limit:
+                    break
         return beads
 
-    def _archives_from(self, paths: Iterable[Path], box_name: str) -> Iterator[Archive]:
-        for path in paths:
-            try:
-                archive = ZipArchive(path, box_name)
-                # Cache the archive as we process it
-                bead = self._bead_from_archive(archive)
-                self._cache_bead_and_path(bead, path)
-            except InvalidArchive:
-                # TODO: log/report problem
-                pass
-            else:
-                yield archive
+    def _scan(
+            self, paths: Iterable[Path], box_name: str, match=None, ordered=False, open_archives=False,
+    ) -> Iterator[tuple]:
+        """
+        Read archives on `jobs` threads, yielding (path, bead, whether it matches) for valid archives.
+
+        Results are yielded as archives are read, or in the order of paths if ordered.
+        When the caller stops early, archives not being read yet are skipped.
+        See _read_archive for open_archives.
+        """
+        read = functools.partial(self._read_archive, box_name=box_name, match=match, open_archives=open_archives)
+        map_paths = map_ordered if ordered else map_unordered
+        try:
+            for result in map_paths(read, paths, self.jobs):
+                if result is not None:
+                    path, bead, _ = result
+                    self._cache_bead_and_path(bead, path)
+                    yield result
+        finally:
+            if self.archive_cache is not None:
+                self.archive_cache.save(self.box_directory)
+
+    def _read_archive(self, path: Path, box_name: str, match=None, open_archives=False):
+        """
+        Read bead from archive and evaluate match on it (on a scanning thread).
+
+        Unchanged archives are not opened, their bead comes from archive_cache -
+        unless open_archives, as match needs the archive itself.
+        Everything needed later is read here, so the archive is not opened again by the caller.
+        Returns None for invalid archives.
+        """
+        try:
+            stat_result = os.stat(path)
+            if self.archive_cache is not None and not open_archives:
+                bead = self.archive_cache.get(path.name, stat_result, box_name)
+                if bead is not None:
+                    return path, bead, match is None or match(bead)
+            with self._archives_opened_lock:
+                self.archives_opened += 1
+            archive = ZipArchive(path, box_name)
+            bead = self._bead_from_archive(archive)
+            if self.archive_cache is not None:
+                self.archive_cache.put(path.name, stat_result, bead)
+            return path, bead, match is None or match(archive)
+        except (InvalidArchive, OSError):
+            # TODO: log/report problem
+            return None
 
     def _bead_from_archive(self, archive: Archive) -> Bead:
         """Create a Bead instance from Archive metadata."""
-        bead = Bead()
-        bead.kind = archive.kind
-        bead.name = archive.name
-        bead.inputs = archive.inputs
-        bead.content_id = archive.content_id
-        bead.freeze_time_str = archive.freeze_time_str
-        bead.box_name = archive.box_name
-        return bead
+        return BeadRecord.from_archive(archive)
 
     def get_file_path(self, name: str, content_id: str) -> Path:
         """Get file path for bead by name and content_id."""
@@ -117,16 +381,9 @@ class RawFilesystemResolver:
             return self._path_cache[key]
 
         # Search filesystem and cache result
-        for path in self._glob_bead_files(name):
-            try:
-                archive = ZipArchive(path, box_name='')
-                if archive.name == name and archive.content_id == content_id:
-                    # Cache the successful lookup
-                    bead = self._bead_from_archive(archive)
-                    self._cache_bead_and_path(bead, path)
-                    return path
-            except InvalidArchive:
-                continue
+        for path, bead, _ in self._scan(self._glob_bead_files(name), box_name='', ordered=True):
+            if bead.name == name and bead.content_id == content_id:
+                return path
 
         raise LookupError(f"Bead not found: name='{name}', content_id='{content_id}'")
 
@@ -140,3 +397,5 @@ class RawFilesystemResolver:
         except InvalidArchive:
             # Skip invalid archives
             pass
+        finally:
+            self._update_count += 1
@@ -0,0 +1,137 @@
+'''
+Health and storage statistics of indexed boxes.
+
+Everything is computed from the index, archives are not opened.
+'''
+
+import os
+import time
+
+import attr
+
+from .box_index import VERIFY_DAMAGED
+from .box_index import VERIFY_UNVERIFIED
+from .box_index import BoxIndex
+from .box_index import create_query_connection
+from .box_query import QueryCondition
+from .box_query import QueryOrder
+
+
+@attr.s(frozen=True, auto_attribs=True)
+class NameStats:
+    name: str
+    versions: int
+    archive_bytes: int
+    data_bytes: int
+
+
+@attr.s(frozen=True, auto_attribs=True)
+class BoxStats:
+    '''
+    Statistics of an indexed box.
+
+    Byte totals cover beads with known sizes only, `unknown_sizes` beads are not counted.
+    `orphaned_beads` are indexed, but their archive is gone,
+    `orphaned_inputs` are inputs of beads not in the index.
+    '''
+    names: int
+    versions: int
+    archive_bytes: int
+    data_bytes: int
+    uncompressed_bytes: int
+    unknown_sizes: int
+    by_name: list[NameStats]
+    index_bytes: int
+    free_index_bytes: int
+    unverified: int
+    damaged: int
+    orphaned_beads: int
+    orphaned_inputs: int
+    query_seconds: dict[str, float]
+
+    @property
+    def fragmentation(self) -> float:
+        '''Part of the index file, that is unused (reclaimed by vacuum).'''
+        return self.free_index_bytes / self.index_bytes if self.index_bytes else 0.0
+
+
+def _count(conn, sql, parameters=()):
+    return conn.execute(sql, parameters).fetchone()[0]
+
+
+def _count_orphaned_beads(conn, box_directory):
+    with os.scandir(box_directory) as entries:
+        file_names = {entry.name for entry in entries}
+    return sum(1 for (file_path,) in conn.execute('SELECT file_path FROM beads') if file_path not in file_names)
+
+
+def representative_queries(conn):
+    '''
+    Queries, that searches commonly run: (description, conditions, order, limit)-s.
+
+    Parameters are taken from the most common bead name and kind, and the newest bead.
+    '''
+    row = conn.execute('''
+        SELECT name, kind, content_id FROM beads
+        WHERE name = (SELECT name FROM beads GROUP BY name ORDER BY COUNT(*) DESC LIMIT 1)
+        ORDER BY freeze_time_unix DESC LIMIT 1
+    ''').fetchone()
+    if row is None:
+        return []
+    name, kind, content_id = row
+    return [
+        ('newest by name', [(QueryCondition.BEAD_NAME, name)], QueryOrder.NEWEST_FIRST, 1),
+        ('newest by kind', [(QueryCondition.KIND, kind)], QueryOrder.NEWEST_FIRST, 1),
+        ('by content id', [(QueryCondition.CONTENT_ID, content_id)], None, None),
+        ('consumers', [(QueryCondition.CONSUMES, content_id)], None, None),
+        ('all beads', [], None, None),
+    ]
+
+
+def time_queries(box_index: BoxIndex, queries) -> dict[str, float]:
+    '''Wall time of running each query with box_index.get_beads, including loading inputs.'''
+    query_seconds = {}
+    for description, conditions, order, limit in queries:
+        start = time.perf_counter()
+        box_index.get_beads(conditions, box_name='', order=order, limit=limit)
+        query_seconds[description] = time.perf_counter() - start
+    return query_seconds
+
+
+def collect_stats(box_index: BoxIndex, timings=True) -> BoxStats:
+    '''Collect statistics of an indexed box, with timings of representative queries.'''
+    with create_query_connection(box_index.index_path) as conn:
+        by_name = [
+            NameStats(*row) for row in conn.execute('''
+                SELECT name, COUNT(*), COALESCE(SUM(file_size), 0), COALESCE(SUM(data_bytes), 0)
+                FROM beads
+                GROUP BY name
+                ORDER BY SUM(file_size) DESC, name
+            ''')]
+        archive_bytes, data_bytes, uncompressed_bytes, unknown_sizes = conn.execute('''
+            SELECT COALESCE(SUM(file_size), 0), COALESCE(SUM(data_bytes), 0), COALESCE(SUM(uncompressed_bytes), 0),
+                   COUNT(*) - COUNT(uncompressed_bytes)
+            FROM beads
+        ''').fetchone()
+        page_size = _count(conn, 'PRAGMA page_size')
+        queries = representative_queries(conn) if timings else []
+        stats = dict(
+            names=len(by_name),
+            versions=sum(name_stats.versions for name_stats in by_name),
+            archive_bytes=archive_bytes,
+            data_bytes=data_bytes,
+            uncompressed_bytes=uncompressed_bytes,
+            unknown_sizes=unknown_sizes,
+            by_name=by_name,
+            index_bytes=_count(conn, 'PRAGMA page_count') * page_size,
+            free_index_bytes=_count(conn, 'PRAGMA freelist_count') * page_size,
+            unverified=_count(conn, 'SELECT COUNT(*) FROM beads WHERE verify_status = ?', (VERIFY_UNVERIFIED,)),
+            damaged=_count(conn, 'SELECT COUNT(*) FROM beads WHERE verify_status = ?', (VERIFY_DAMAGED,)),
+            orphaned_beads=_count_orphaned_beads(conn, box_index.box_directory),
+            orphaned_inputs=_count(conn, '''
+                SELECT COUNT(*) FROM inputs
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM beads WHERE name = inputs.bead_name AND content_id = inputs.bead_content_id)
+            '''),
+        )
+    return BoxStats(**stats, query_seconds=time_queries(box_index, queries))
@@ -0,0 +1,233 @@
+'''
+Keep a box index up to date while archives are added, renamed or removed.
+
+Changes are detected with inotify on Linux, or by polling the box directory elsewhere
+(and on network file systems, where inotify does not see changes made by other machines).
+Bursts of changes are collected until the box directory is quiet for a while,
+so that archives still being written are not indexed.
+'''
+
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable
+
+from .box_index import BoxIndex
+from .exceptions import BoxIndexError
+from .exceptions import BoxWatchError
+
+DEFAULT_DEBOUNCE_SECONDS = 2.0
+DEFAULT_POLL_SECONDS = 5.0
+# a failed sync (e.g. the index is locked by "bead box index") is retried after this, if no changes come
+DEFAULT_RETRY_SECONDS = 10.0
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# reported instead of names, when the changes are not known (inotify queue overflow)
+UNKNOWN_CHANGES = '*'
+
+
+def is_archive_name(name: str) -> bool:
+    '''Archives are the same files that BoxIndex.sync indexes (the index itself is hidden).'''
+    return name.endswith('.zip') and not name.startswith('.')
+
+
+class PollingWatcher:
+    '''
+    Detect archive changes by comparing (size, mtime, inode) of archives between polls.
+
+    An archive still being written changes between polls, so it is reported again and again,
+    until its size is stable.
+    '''
+
+    def __init__(self, directory: Path, interval: float = DEFAULT_POLL_SECONDS):
+        self.directory = Path(directory)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if is_archive_name(entry.name):
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        except OSError as e:
+            raise BoxWatchError(f'Can not watch {self.directory}: {e}')
+        return snapshot
+
+    def wait(self, timeout: float) -> set[str]:
+        '''
+        Wait at most `timeout` seconds for changes.
+
+        Returns the names of changed archives, empty if there were no changes.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(0, min(self.interval, deadline - time.monotonic())))
+            snapshot = self._scan()
+            changed = {
+                name
+                for name in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(name) != self._snapshot.get(name)}
+            self._snapshot = snapshot
+            if changed or time.monotonic() >= deadline:
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    '''
+    Detect archive changes with Linux inotify.
+
+    Every write to an archive is an event, so an archive still being written keeps the directory busy.
+    '''
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise BoxWatchError(f'inotify is not available: {os.strerror(ctypes.get_errno())}')
+        watch = libc.inotify_add_watch(self._fd, os.fsencode(self.directory), WATCH_MASK)
+        if watch < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise BoxWatchError(f'Can not watch {self.directory}: {os.strerror(error)}')
+
+    def wait(self, timeout: float) -> set[str]:
+        '''
+        Wait at most `timeout` seconds for changes.
+
+        Returns the names of changed archives, empty if there were no changes.
+        UNKNOWN_CHANGES is among the names, if events were lost.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            readable, _, _ = select.select([self._fd], [], [], max(0, deadline - time.monotonic()))
+            if not readable:
+                return set()
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            _watch, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                raise BoxWatchError(f'{self.directory} was removed or moved')
+            if mask & IN_Q_OVERFLOW:
+                changed.add(UNKNOWN_CHANGES)
+            elif is_archive_name(name):
+                changed.add(name)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(directory: Path, poll_interval: float | None = None):
+    '''
+    Watcher for directory: inotify if available, polling otherwise or if poll_interval is given.
+    '''
+    if poll_interval is None and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, BoxWatchError):
+            # no libc with inotify, or out of watches
+            pass
+    return PollingWatcher(directory, poll_interval or DEFAULT_POLL_SECONDS)
+
+
+def watch(
+    box_index: BoxIndex,
+    watcher,
+    debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS,
+    verify: bool = True,
+    on_sync: Callable[[set[str]], None] | None = None,
+    stop: threading.Event | None = None,
+    on_error: Callable[[BoxIndexError], None] | None = None,
+    retry_seconds: float = DEFAULT_RETRY_SECONDS,
+):
+    '''
+    Sync box_index after each burst of changes reported by watcher, until stop is set.
+
+    A burst ends when there were no changes for `debounce_seconds`,
+    by then archives copied into the box are complete:
+    either their size is stable, or they were renamed into place.
+    The index is synced once before watching, to catch up with earlier changes.
+
+    `on_sync(names)` is called after each sync with the names of changed archives.
+    A failed sync does not stop watching: it is reported to `on_error(error)`,
+    and its changes are synced again with the next burst, or after `retry_seconds` without changes.
+    '''
+    def sync(changed: set[str]) -> set[str] | None:
+        '''Sync the index, return the changes left unsynced by a failure, None on success.'''
+        try:
+            # archives overwritten in place do not change the directory mtime, force the scan
+            box_index.sync(verify=verify, full=True)
+        except BoxIndexError as e:
+            if on_error is not None:
+                on_error(e)
+            return changed
+        if changed and on_sync is not None:
+            on_sync(changed)
+        return None
+
+    stop = stop or threading.Event()
+    unsynced = sync(set())
+    last_sync_at = time.monotonic()
+    while not stop.is_set():
+        changed = watcher.wait(timeout=debounce_seconds)
+        if not changed:
+            if unsynced is not None and time.monotonic() - last_sync_at >= retry_seconds:
+                unsynced = sync(unsynced)
+                last_sync_at = time.monotonic()
+            continue
+        while not stop.is_set():
+            more_changes = watcher.wait(timeout=debounce_seconds)
+            if not more_changes:
+                break
+            changed |= more_changes
+        else:
+            return
+        unsynced = sync(changed | (unsynced or set()))
+        last_sync_at = time.monotonic()
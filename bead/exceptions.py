@@ -8,3 +8,7 @@ class BoxError(Exception):
 
 class BoxIndexError(Exception):
     """Box index operation related error"""
+
+
+class BoxWatchError(BoxError):
+    """Box directory can not be watched for changes"""
@@ -84,6 +84,20 @@ class InputSpec:
     def freeze_time(self):
         return time_from_timestamp(self.freeze_time_str)
 
+    @classmethod
+    def from_trusted(cls, name: str, kind: str, content_id: str, freeze_time_str: str) -> 'InputSpec':
+        '''
+        Create from already validated values (e.g. read back from a box index).
+
+        Skips the validating InputName conversion.
+        '''
+        spec = object.__new__(cls)
+        object.__setattr__(spec, 'name', str.__new__(InputName, name))
+        object.__setattr__(spec, 'kind', kind)
+        object.__setattr__(spec, 'content_id', content_id)
+        object.__setattr__(spec, 'freeze_time_str', freeze_time_str)
+        return spec
+
 
 def parse_inputs(meta):
     '''
@@ -0,0 +1,184 @@
+'''
+Run independent, mostly I/O bound tasks on a bounded thread pool.
+'''
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+from concurrent.futures import wait
+import queue
+import threading
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def map_unordered(function: Callable[[T], R], items: Iterable[T], jobs: int = 1) -> Iterator[R]:
+    '''
+    Yield function(item) for all items, computed on `jobs` threads.
+
+    Results are yielded in completion order.
+    The number of items in flight is bounded, so items can be a long (lazy) iterable.
+    With jobs <= 1 items are processed one after the other in the calling thread.
+    '''
+    if jobs <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    max_pending = 4 * jobs
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='bead') as executor:
+        pending = set()
+        try:
+            for item in items:
+                pending.add(executor.submit(function, item))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            _cancel(pending)
+
+
+def map_ordered(function: Callable[[T], R], items: Iterable[T], jobs: int = 1) -> Iterator[R]:
+    '''
+    Yield function(item) for all items in the order of items, computed on `jobs` threads.
+
+    Items are computed ahead of the one yielded next, at most 4 * jobs of them.
+    With jobs <= 1 items are processed one after the other in the calling thread.
+    '''
+    if jobs <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    max_pending = 4 * jobs
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='bead') as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(function, item))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            _cancel(pending)
+
+
+def _cancel(futures):
+    '''
+    Cancel futures not started yet.
+
+    Called when the consumer stops early (or on an exception), so that the remaining items are not processed.
+    '''
+    for future in futures:
+        future.cancel()
+
+
+def call_on_daemon_thread(function: Callable[..., R], *args, name: str = 'bead') -> 'Future[R]':
+    '''
+    Start function(*args) on a new daemon thread, return a Future of its result.
+
+    Unlike pool threads, a daemon thread stuck in a call (e.g. on an unreachable network mount)
+    does not keep the process from exiting.
+    '''
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+class DaemonStream(Iterator[R]):
+    '''
+    Iterate over function(*args) on a new daemon thread, and yield its items in the consuming thread.
+
+    The thread is started on creation, at most buffer_size items are computed ahead of the consumer.
+    Exceptions of the iteration are raised in the consumer,
+    concurrent.futures.TimeoutError is raised if the next item is not ready in timeout seconds.
+    The iteration is stopped (after its current item), when the stream is closed or garbage collected.
+    '''
+
+    _ITEM, _ERROR, _END = range(3)
+
+    def __init__(
+            self, function: Callable[..., Iterable[R]], *args,
+            buffer_size: int = 100, timeout: float | None = None, name: str = 'bead'):
+        self.timeout = timeout
+        self._entries = queue.Queue(buffer_size)
+        self._stopped = threading.Event()
+        self._done = False
+        # the thread must not reference the stream, so that dropping the stream stops it
+        threading.Thread(
+            target=self._produce, args=(self._entries, self._stopped, function, args), name=name, daemon=True
+        ).start()
+
+    @classmethod
+    def _produce(cls, entries, stopped, function, args):
+        items = iter(())
+        try:
+            items = iter(function(*args))
+            for item in items:
+                if not cls._put(entries, stopped, (cls._ITEM, item)):
+                    return
+        except BaseException as e:
+            cls._put(entries, stopped, (cls._ERROR, e))
+        else:
+            cls._put(entries, stopped, (cls._END, None))
+        finally:
+            # release resources of the iteration (e.g. database connections) when stopped early
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def _put(entries, stopped, entry) -> bool:
+        while not stopped.is_set():
+            try:
+                entries.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __next__(self) -> R:
+        if self._done:
+            raise StopIteration
+        try:
+            tag, value = self._entries.get(timeout=self.timeout)
+        except queue.Empty:
+            self.close()
+            raise TimeoutError(f'No item in {self.timeout} seconds')
+        if tag == self._ITEM:
+            return value
+        self.close()
+        if tag == self._ERROR:
+            raise value
+        raise StopIteration
+
+    def close(self):
+        self._done = True
+        self._stopped.set()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,152 @@
+from concurrent.futures import TimeoutError
+import itertools
+import threading
+import time
+
+import pytest
+
+from .parallel import DaemonStream
+from .parallel import map_ordered
+from .parallel import map_unordered
+
+
+def test_serial_map_keeps_order_and_thread():
+    threads = set()
+
+    def square(x):
+        threads.add(threading.get_ident())
+        return x * x
+
+    assert [0, 1, 4, 9] == list(map_unordered(square, range(4)))
+    assert {threading.get_ident()} == threads
+
+
+def test_parallel_map_returns_all_results():
+    assert set(x * x for x in range(100)) == set(map_unordered(lambda x: x * x, range(100), jobs=4))
+
+
+def test_parallel_map_uses_multiple_threads():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wait_for_other_thread(x):
+        barrier.wait()
+        return x
+
+    assert {1, 2} == set(map_unordered(wait_for_other_thread, [1, 2], jobs=2))
+
+
+def test_parallel_map_propagates_exceptions():
+    def fail(x):
+        raise ValueError(x)
+
+    with pytest.raises(ValueError):
+        list(map_unordered(fail, range(3), jobs=2))
+
+
+def test_ordered_parallel_map_keeps_order():
+    def slow_for_small(x):
+        time.sleep((10 - x) * 0.001)
+        return x * x
+
+    assert [x * x for x in range(10)] == list(map_ordered(slow_for_small, range(10), jobs=4))
+
+
+@pytest.mark.parametrize('map_function', [map_ordered, map_unordered])
+def test_parallel_map_stops_when_consumer_stops(map_function):
+    processed = []
+    lock = threading.Lock()
+
+    def process(x):
+        time.sleep(0.001)
+        with lock:
+            processed.append(x)
+        return x
+
+    results = map_function(process, range(1000), jobs=2)
+    next(results)
+    results.close()
+    # only items already submitted (at most 4 * jobs) are processed
+    assert len(processed) <= 8 + 1
+
+
+def test_daemon_stream_yields_items_from_another_thread():
+    threads = []
+
+    def numbers(n):
+        threads.append(threading.current_thread())
+        yield from range(n)
+
+    assert [0, 1, 2] == list(DaemonStream(numbers, 3, buffer_size=1))
+    assert threads[0].daemon
+    assert threading.current_thread() not in threads
+
+
+def test_daemon_stream_raises_errors_of_the_iteration():
+    def failing():
+        yield 1
+        raise ValueError('failed')
+
+    stream = DaemonStream(failing)
+    assert 1 == next(stream)
+    with pytest.raises(ValueError):
+        next(stream)
+    assert [] == list(stream)
+
+
+def test_daemon_stream_times_out():
+    released = threading.Event()
+
+    def hanging():
+        yield 1
+        released.wait()
+        yield 2
+
+    stream = DaemonStream(hanging, timeout=0.1)
+    assert 1 == next(stream)
+    with pytest.raises(TimeoutError):
+        next(stream)
+    released.set()
+
+
+def test_closed_daemon_stream_stops_iteration():
+    produced = []
+
+    def counting():
+        for n in itertools.count():
+            produced.append(n)
+            yield n
+
+    stream = DaemonStream(counting, buffer_size=1)
+    assert 0 == next(stream)
+    stream.close()
+    time.sleep(0.3)
+    count = len(produced)
+    time.sleep(0.3)
+    assert count == len(produced)
+
+
+def live_threads(name):
+    return [thread for thread in threading.enumerate() if thread.name == name and thread.is_alive()]
+
+
+def wait_for_no_live_threads(name, seconds=2):
+    deadline = time.monotonic() + seconds
+    while live_threads(name) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return live_threads(name)
+
+
+def test_dropped_daemon_stream_stops_its_thread():
+    closed = []
+
+    def endless():
+        try:
+            yield from itertools.count()
+        finally:
+            closed.append(True)
+
+    for _ in range(5):
+        assert 0 == next(DaemonStream(endless, buffer_size=1, name='dropped stream'))
+
+    assert [] == wait_for_no_live_threads('dropped stream')
+    assert [True] * 5 == closed
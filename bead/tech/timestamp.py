@@ -198,6 +198,13 @@ def timestamp():
     return datetime.now(Local).strftime('%Y%m%dT%H%M%S%f%z')
 
 
+def unix_microseconds(time: datetime) -> int:
+    '''
+        UTC unix time of a time zone aware datetime, in microseconds.
+    '''
+    return int(time.timestamp() * 1_000_000)
+
+
 # a not so forgiving parser
 def time_from_timestamp(timestamp_str):
     '''
@@ -1,7 +1,23 @@
+import shutil
+import threading
+import time
+
 import pytest
 
+from . import box_rawfs
+from .bead import BeadRecord
+from .box import DEFAULT_SEARCH_TIMEOUT_SECONDS
+from .box import SEARCH_TIMEOUT_ENV
 from .box import Box
+from .box import lookup
+from .box import search
+from .box import search_timeout_from_environment
+from .box_catalog import BoxCatalog
+from .box_index import BoxIndex
+from .box_query import BeadLookup
+from .box_query import QueryOrder
 from .tech.fs import write_file
+from .tech.test_parallel import wait_for_no_live_threads
 from .tech.timestamp import time_from_user
 from .workspace import Workspace
 
@@ -61,3 +77,365 @@ def test_box_methods_tolerate_junk_in_box(tmp_path_factory):
 
     bead_names = {b.name for b in box.all_beads()}
     assert {'bead1', 'bead2', 'BEAD3'} == bead_names
+
+
+def test_terminals_are_ordered_by_freeze_time(box):
+    assert 'bead1' == box.search().oldest().name
+    assert 'BEAD3' == box.search().newest().name
+    assert 'bead2' == box.search().newer(1).name
+    assert 'bead2' == box.search().older(1).name
+    with pytest.raises(LookupError):
+        box.search().older(3)
+
+
+@pytest.fixture
+def opened(box, monkeypatch):
+    """Names of archive files opened by the raw resolver, that opens them one by one, without cache."""
+    monkeypatch.setattr(box.resolver, 'jobs', 1)
+    monkeypatch.setattr(box.resolver, 'archive_cache', None)
+    opened = []
+    zip_archive = box_rawfs.ZipArchive
+
+    def tracing_zip_archive(path, box_name):
+        opened.append(path.name.split('_')[0])
+        return zip_archive(path, box_name)
+
+    monkeypatch.setattr(box_rawfs, 'ZipArchive', tracing_zip_archive)
+    return opened
+
+
+def test_newest_stops_opening_archives_after_match(box, opened):
+    assert 'BEAD3' == box.search().newest().name
+    assert 1 == len(opened)
+
+
+def test_time_conditions_are_evaluated_on_file_names(box, opened, timestamp):
+    assert ['BEAD3'] == [bead.name for bead in box.search().at_time(timestamp).all()]
+    assert ['BEAD3'] == opened
+
+    opened.clear()
+    beads = box.search().older_than(timestamp).newer_than(time_from_user('20160704T000000000000+0200')).all()
+    assert ['bead2'] == [bead.name for bead in beads]
+    assert ['bead2'] == opened
+
+    opened.clear()
+    assert 'bead1' == box.search().at_or_older(timestamp).oldest().name
+    assert ['bead1'] == opened
+
+
+def test_time_conditions_with_misleading_file_name(box):
+    # an archive renamed to look newer than it is
+    bead1_path = next(box.directory.glob('bead1_*.zip'))
+    bead1_path.rename(box.directory / 'bead1_20200101T000000000000+0000.zip')
+    beads = box.search().at_or_newer(time_from_user('20160704T162800000000+0200')).all()
+    assert {'bead2', 'BEAD3'} == {bead.name for bead in beads}
+
+
+def test_newest_with_misleading_file_name(box, tmp_path):
+    # an archive renamed to look newer than it is
+    bead1_path = next(box.directory.glob('bead1_*.zip'))
+    bead1_path.rename(box.directory / 'bead1_20200101T000000000000+0000.zip')
+    assert 'BEAD3' == box.search().newest().name
+
+
+def test_parallel_scan_finds_the_same_beads(box, timestamp):
+    def search(jobs):
+        box.resolver.jobs = jobs
+        return (
+            [bead.name for bead in box.search().all()],
+            box.search().newest().name,
+            [bead.name for bead in box.search().at_or_older(timestamp).all()],
+            box.search().by_name('bead2').first().name)
+
+    assert search(1) == search(4)
+
+
+def test_first_is_the_first_match_in_file_name_order(box, monkeypatch):
+    box.resolver.jobs = 4
+    box.resolver.archive_cache = None
+    zip_archive = box_rawfs.ZipArchive
+
+    def slow_first_archive(path, box_name):
+        if path.name.startswith('BEAD3_'):
+            time.sleep(0.2)
+        return zip_archive(path, box_name)
+
+    monkeypatch.setattr(box_rawfs, 'ZipArchive', slow_first_archive)
+    assert 'BEAD3' == box.search().first().name
+    assert ['BEAD3', 'bead1', 'bead2'] == [bead.name for bead in box.search().all()]
+
+
+@pytest.fixture(params=['raw', 'indexed'])
+def versions_box(request, tmp_path_factory):
+    """Box with three versions of a bead, searched directly or through an index."""
+    tmp_path = tmp_path_factory.mktemp('versions')
+    box = Box('versions', tmp_path)
+    ws = Workspace(tmp_path_factory.mktemp('ws') / 'data')
+    ws.create('kind')
+    for freeze_time in ('20160704T000000000000+0200', '20160705T000000000000+0200', '20160706T000000000000+0200'):
+        write_file(ws.directory / 'output/version', freeze_time)
+        box.store(ws, freeze_time)
+    if request.param == 'indexed':
+        BoxIndex(tmp_path).rebuild()
+        box = Box('versions', tmp_path)
+        assert isinstance(box.resolver, BoxIndex)
+    return box
+
+
+def test_lookup_beads(versions_box):
+    _oldest, middle, newest = sorted(versions_box.search().by_kind('kind').all(), key=lambda bead: bead.freeze_time)
+    lookups = [
+        BeadLookup.by_content_id(middle.content_id),
+        BeadLookup.newest_of_kind('kind'),
+        BeadLookup.newest_of_kind('kind', at_or_older=middle.freeze_time),
+        BeadLookup.newest_of_kind('kind', at_or_older=time_from_user('20160701T000000000000+0200')),
+        BeadLookup.by_content_id('unknown'),
+        BeadLookup.newest_of_kind('unknown'),
+    ]
+
+    answers = versions_box.lookup_beads(lookups)
+
+    assert [middle, newest, middle, None, None, None] == answers
+    assert 'versions' == answers[0].box_name
+
+
+def test_lookup_across_boxes(versions_box, box):
+    newest = versions_box.search().newest()
+    lookups = [BeadLookup.by_content_id(newest.content_id), BeadLookup.newest_of_kind('test-bead1')]
+
+    answers = lookup([box, versions_box], lookups)
+
+    assert [[newest], [box.search().by_kind('test-bead1').first()]] == answers
+
+
+def test_multi_box_search_orders_without_parsing_freeze_times(versions_box, box, monkeypatch):
+    boxes = [box, versions_box]
+    answers = {
+        (b.name, order): b.search().all(order)
+        for b in boxes
+        for order in (QueryOrder.OLDEST_FIRST, QueryOrder.NEWEST_FIRST)}
+    for b in boxes:
+        monkeypatch.setattr(b, 'get_beads', lambda conditions, order, limit, b=b: answers[b.name, order])
+        monkeypatch.setattr(b, 'iter_beads', lambda conditions, order, limit, b=b: iter(answers[b.name, order]))
+
+    def parse_freeze_time(bead):
+        pytest.fail('freeze time parsed')
+    monkeypatch.setattr(BeadRecord, 'freeze_time', property(parse_freeze_time))
+
+    newest_first = [bead.name for bead in search(boxes).all(QueryOrder.NEWEST_FIRST)]
+    oldest_first = [bead.name for bead in search(boxes).iter(QueryOrder.OLDEST_FIRST)]
+    # bead1 and the oldest data have the same freeze time, they remain in box order
+    assert ['data', 'data', 'BEAD3', 'bead2', 'bead1', 'data'] == newest_first
+    assert ['bead1', 'data', 'bead2', 'BEAD3', 'data', 'data'] == oldest_first
+
+
+@pytest.fixture
+def hung_box(tmp_path_factory, monkeypatch):
+    """Box, that does not answer until the end of the test (like an unreachable network mount)."""
+    box = Box('hung', tmp_path_factory.mktemp('hung'))
+    box.search_timeout = 0.1
+    released = threading.Event()
+
+    def hang(*args, **kwargs):
+        released.wait()
+        return []
+    monkeypatch.setattr(box, 'get_beads', hang)
+    monkeypatch.setattr(box, 'lookup_beads', hang)
+    yield box
+    released.set()
+
+
+def test_slow_box_is_skipped_and_reported(box, hung_box):
+    slow_boxes = []
+
+    beads = search([hung_box, box], slow_boxes.append).by_name('bead1').all()
+
+    assert ['test'] == [bead.box_name for bead in beads]
+    assert [hung_box] == slow_boxes
+
+
+def test_box_directory_is_not_touched_by_constructor(tmp_path, monkeypatch):
+    monkeypatch.setattr(Box, '_create_resolver', lambda self: pytest.fail('resolver created'))
+    Box('box', tmp_path / 'unreachable')
+
+
+def test_box_hanging_in_resolver_setup_is_skipped(box, tmp_path, monkeypatch):
+    hung_box = Box('hung', tmp_path)
+    hung_box.search_timeout = 0.1
+    released = threading.Event()
+    monkeypatch.setattr(hung_box, '_create_resolver', lambda: released.wait())
+    slow_boxes = []
+    try:
+        beads = search([hung_box, box], slow_boxes.append).by_name('bead1').all()
+    finally:
+        released.set()
+
+    assert ['test'] == [bead.box_name for bead in beads]
+    assert [hung_box] == slow_boxes
+
+
+def test_hung_box_delays_catalog_search_by_its_timeout_only(box, tmp_path, monkeypatch):
+    BoxIndex(box.directory).rebuild()
+    BoxIndex(tmp_path).rebuild()
+    boxes = [Box('hung', tmp_path), Box('test', box.directory)]
+    for indexed_box in boxes:
+        indexed_box.search_timeout = 0.4
+    released = threading.Event()
+
+    def hang(*args, **kwargs):
+        released.wait()
+        return []
+    monkeypatch.setattr(BoxCatalog, 'get_beads', hang)
+    monkeypatch.setattr(boxes[0], 'get_beads', hang)
+    slow_boxes = []
+    start = time.monotonic()
+    try:
+        beads = search(boxes, slow_boxes.append).by_name('bead1').all()
+    finally:
+        released.set()
+
+    assert time.monotonic() - start < 0.6
+    assert ['test'] == [bead.box_name for bead in beads]
+    assert [boxes[0]] == slow_boxes
+
+
+def test_slow_box_is_skipped_by_first(box, hung_box):
+    slow_boxes = []
+    assert 'bead1' == search([hung_box, box], slow_boxes.append).by_name('bead1').first().name
+    assert [hung_box] == slow_boxes
+
+
+def test_first_does_not_wait_for_later_boxes(box, hung_box):
+    hung_box.search_timeout = None
+    assert 'bead1' == search([box, hung_box]).by_name('bead1').first().name
+
+
+def test_slow_box_is_skipped_by_lookup(box, hung_box):
+    slow_boxes = []
+    answers = lookup([hung_box, box], [BeadLookup.newest_of_kind('test-bead1')], slow_boxes.append)
+    assert [['bead1']] == [[bead.name for bead in beads] for beads in answers]
+    assert [hung_box] == slow_boxes
+
+
+def test_boxes_are_searched_concurrently(box, tmp_path, monkeypatch):
+    other_box = Box('other', tmp_path)
+    # each box waits for the other one to start
+    both_started = threading.Barrier(2, timeout=5)
+
+    def get_beads_when_both_started(get_beads):
+        def wrapper(*args, **kwargs):
+            both_started.wait()
+            return get_beads(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(box, 'get_beads', get_beads_when_both_started(box.get_beads))
+    monkeypatch.setattr(other_box, 'get_beads', get_beads_when_both_started(other_box.get_beads))
+
+    assert 3 == len(search([box, other_box]).all())
+
+
+@pytest.mark.parametrize('value, timeout', [
+    (None, DEFAULT_SEARCH_TIMEOUT_SECONDS),
+    ('2.5', 2.5),
+    ('off', None),
+])
+def test_search_timeout_from_environment(value, timeout):
+    environ = {} if value is None else {SEARCH_TIMEOUT_ENV: value}
+    assert timeout == search_timeout_from_environment(environ)
+
+
+def test_search_timeout_is_off_by_default():
+    assert search_timeout_from_environment({}) is None
+
+
+def test_malformed_search_timeout_is_ignored_with_a_warning():
+    with pytest.warns(UserWarning, match=SEARCH_TIMEOUT_ENV):
+        timeout = search_timeout_from_environment({SEARCH_TIMEOUT_ENV: '1 minute'})
+    assert DEFAULT_SEARCH_TIMEOUT_SECONDS == timeout
+
+
+def test_slow_single_box_is_not_skipped(box, monkeypatch):
+    box.search_timeout = 0.1
+    get_beads = box.get_beads
+    iter_beads = box.iter_beads
+
+    def slow_get_beads(*args, **kwargs):
+        time.sleep(0.3)
+        return get_beads(*args, **kwargs)
+
+    def slow_iter_beads(*args, **kwargs):
+        time.sleep(0.3)
+        return iter_beads(*args, **kwargs)
+    monkeypatch.setattr(box, 'get_beads', slow_get_beads)
+    monkeypatch.setattr(box, 'iter_beads', slow_iter_beads)
+    slow_boxes = []
+
+    assert 'bead1' == search([box], slow_boxes.append).by_kind('test-bead1').newest().name
+    assert 'bead1' == search([box], slow_boxes.append).by_kind('test-bead1').first().name
+    assert ['bead1'] == [bead.name for bead in search([box], slow_boxes.append).by_kind('test-bead1').iter()]
+    assert [] == slow_boxes
+
+
+def test_iter_streams_archives_of_raw_box(box, opened):
+    beads = box.search().iter()
+    next(beads)
+    assert 1 == len(opened)
+    assert 2 == len(list(beads))
+
+
+@pytest.mark.parametrize('order', [QueryOrder.OLDEST_FIRST, QueryOrder.NEWEST_FIRST])
+def test_iter_merges_boxes_by_freeze_time(box, versions_box, order):
+    boxes = [versions_box, box]
+    expected = sorted(search(boxes).all(), key=lambda bead: bead.freeze_time, reverse=order == QueryOrder.NEWEST_FIRST)
+
+    assert expected == list(search(boxes).iter(order))
+
+
+def test_iter_without_order_streams_boxes_in_box_order(box, versions_box):
+    assert ['versions'] * 3 + ['test'] * 3 == [bead.box_name for bead in search([versions_box, box]).iter()]
+
+
+def test_limit(box, versions_box):
+    boxes = [versions_box, box]
+    newest = [bead.name for bead in search(boxes).limit(4).iter(QueryOrder.NEWEST_FIRST)]
+    assert ['data', 'data', 'BEAD3', 'bead2'] == newest
+    assert 2 == len(search(boxes).limit(2).all())
+    assert 2 == len(box.search().limit(2).all())
+    with pytest.raises(ValueError):
+        box.search().limit(-1)
+
+
+def test_unique_limit_counts_unique_beads(box, versions_box, tmp_path):
+    copy = Box('copy', tmp_path)
+    for path in versions_box.directory.glob('*.zip'):
+        shutil.copy(path, tmp_path)
+
+    beads = search([versions_box, copy]).unique().limit(3).iter(QueryOrder.OLDEST_FIRST)
+
+    assert ['versions'] * 3 == [bead.box_name for bead in beads]
+
+
+def test_slow_box_is_skipped_by_iter(box, hung_box, monkeypatch):
+    monkeypatch.setattr(hung_box, 'iter_beads', lambda *args: hung_box.get_beads(*args))
+    slow_boxes = []
+
+    beads = list(search([hung_box, box], slow_boxes.append).iter(QueryOrder.NEWEST_FIRST))
+
+    assert ['BEAD3', 'bead2', 'bead1'] == [bead.name for bead in beads]
+    assert [hung_box] == slow_boxes
+
+
+@pytest.mark.parametrize('order', [None, QueryOrder.NEWEST_FIRST])
+def test_dropped_iter_stops_streaming_boxes(box, tmp_path, monkeypatch, order):
+    other_box = Box('other', tmp_path)
+
+    def endless_beads(*args):
+        while True:
+            yield from box.get_beads([])
+    monkeypatch.setattr(box, 'iter_beads', endless_beads)
+    monkeypatch.setattr(other_box, 'iter_beads', endless_beads)
+
+    for _ in range(5):
+        next(search([box, other_box]).iter(order))
+
+    assert [] == wait_for_no_live_threads('search test')
+    assert [] == wait_for_no_live_threads('search other')
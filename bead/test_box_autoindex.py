@@ -0,0 +1,133 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from tests.boxes import TS1
+from tests.boxes import TS2
+from tests.boxes import TS3
+from tests.boxes import store_bead
+
+from .box import Box
+from .box_autoindex import AUTO_INDEX_ARCHIVES_ENV
+from .box_autoindex import AUTO_INDEX_SCAN_SECONDS_ENV
+from .box_autoindex import BUILD_LOCK_NAME
+from .box_autoindex import AutoIndexPolicy
+from .box_autoindex import build_index
+from .box_autoindex import exclusive_lock
+from .box_index import REBUILD_IN_PROGRESS
+from .box_index import BoxIndex
+from .box_index import create_update_connection
+from .box_index import set_state
+from .box_rawfs import RawFilesystemResolver
+
+NEVER = AutoIndexPolicy(max_archives=None, max_scan_seconds=None)
+
+
+@pytest.fixture
+def box_directory(tmp_path_factory):
+    """A box directory with 3 archives and no index."""
+    directory = tmp_path_factory.mktemp('box')
+    box = Box('test', directory, NEVER)
+    for n, freeze_time in enumerate([TS1, TS2, TS3]):
+        store_bead(box, tmp_path_factory, f'bead{n}', freeze_time, kind='kind')
+    assert isinstance(box.resolver, RawFilesystemResolver)
+    return directory
+
+
+def test_policy_from_environment():
+    assert AutoIndexPolicy() == AutoIndexPolicy.from_environment({})
+    assert AutoIndexPolicy(10, None) == AutoIndexPolicy.from_environment(
+        {AUTO_INDEX_ARCHIVES_ENV: '10', AUTO_INDEX_SCAN_SECONDS_ENV: 'off'})
+    assert AutoIndexPolicy(None, 0.5) == AutoIndexPolicy.from_environment(
+        {AUTO_INDEX_ARCHIVES_ENV: 'never', AUTO_INDEX_SCAN_SECONDS_ENV: '0.5'})
+
+
+def test_malformed_policy_in_environment_is_ignored_with_a_warning():
+    with pytest.warns(UserWarning, match=AUTO_INDEX_ARCHIVES_ENV):
+        policy = AutoIndexPolicy.from_environment({AUTO_INDEX_ARCHIVES_ENV: 'many', AUTO_INDEX_SCAN_SECONDS_ENV: '1'})
+    assert AutoIndexPolicy(AutoIndexPolicy().max_archives, 1.0) == policy
+
+
+def test_box_with_few_archives_is_not_indexed(box_directory):
+    box = Box('test', box_directory, AutoIndexPolicy(max_archives=3, max_scan_seconds=None))
+    box.all_beads()
+    box.wait_for_auto_index()
+    assert isinstance(box.resolver, RawFilesystemResolver)
+    assert not (box_directory / '.index.sqlite').exists()
+
+
+def test_box_with_many_archives_is_indexed_in_background(box_directory):
+    box = Box('test', box_directory, AutoIndexPolicy(max_archives=2, max_scan_seconds=None))
+    assert 3 == len(box.all_beads())
+    box.wait_for_auto_index()
+
+    assert isinstance(box.resolver, BoxIndex)
+    assert 3 == len(box.all_beads())
+    assert [] == list(box_directory.glob('.index.sqlite.building*'))
+    assert isinstance(Box('test', box_directory, NEVER).resolver, BoxIndex)
+
+
+def test_slow_scan_starts_indexing(box_directory):
+    box = Box('test', box_directory, AutoIndexPolicy(max_archives=None, max_scan_seconds=0))
+    assert isinstance(box.resolver, RawFilesystemResolver)
+    assert 'bead2' == box.search().newest().name
+    box.wait_for_auto_index()
+    assert isinstance(box.resolver, BoxIndex)
+    assert 'bead2' == box.search().newest().name
+
+
+def test_interrupted_build_is_not_used(box_directory):
+    (box_directory / '.index.sqlite.building').write_bytes(b'')
+    box = Box('test', box_directory, NEVER)
+    assert isinstance(box.resolver, RawFilesystemResolver)
+
+
+def test_process_exits_before_the_index_is_built(box_directory, user_cache_dir):
+    script = textwrap.dedent(f'''
+        import threading
+        from bead import box
+        box.build_index = lambda directory: threading.Event().wait()
+        policy = box.AutoIndexPolicy(max_archives=2, max_scan_seconds=None)
+        assert 3 == len(box.Box('test', {str(box_directory)!r}, policy).all_beads())
+    ''')
+    subprocess.run(
+        [sys.executable, '-c', script], check=True, timeout=30,
+        cwd=Path(__file__).parent.parent, env={**os.environ, 'XDG_CACHE_HOME': str(user_cache_dir)})
+
+
+def test_interrupted_automatic_index_is_continued(box_directory):
+    building = BoxIndex(box_directory, box_directory / '.index.sqlite.building')
+    building.rebuild(verify=False)
+    # the rebuild flag of an interrupted build
+    with create_update_connection(building.index_path) as conn:
+        set_state(conn, REBUILD_IN_PROGRESS, '1')
+        conn.commit()
+
+    box = Box('test', box_directory, AutoIndexPolicy(max_archives=2, max_scan_seconds=None))
+    assert isinstance(box.resolver, RawFilesystemResolver)
+    box.wait_for_auto_index()
+    assert isinstance(box.resolver, BoxIndex)
+    assert 3 == len(box.all_beads())
+
+
+def test_index_is_built_by_one_process_at_a_time(box_directory):
+    with exclusive_lock(box_directory / BUILD_LOCK_NAME) as locked:
+        assert locked
+        # as if another process was building the index
+        assert build_index(box_directory) is None
+        assert not (box_directory / '.index.sqlite').exists()
+
+    assert 3 == len(build_index(box_directory).get_beads([], 'test'))
+    assert [] == list(box_directory.glob('.index.sqlite.building*'))
+
+
+def test_index_built_meanwhile_by_another_process_is_used(box_directory, monkeypatch):
+    build_index(box_directory)
+    rebuilds = []
+    monkeypatch.setattr(BoxIndex, 'rebuild', lambda self, *args, **kwargs: rebuilds.append(self))
+    assert 3 == len(build_index(box_directory).get_beads([], 'test'))
+    assert [] == rebuilds
@@ -0,0 +1,131 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from tests.boxes import store_dependency_chain
+
+from . import box_catalog
+from .box import Box
+from .box import MultiBoxSearch
+from .box_catalog import BoxCatalog
+from .box_index import BoxIndex
+
+
+@pytest.fixture
+def archives(tmp_path_factory):
+    """Archives of root, middle (input: root) and leaf (input: middle)."""
+    box = Box('archives', tmp_path_factory.mktemp('archives'))
+    store_dependency_chain(box, tmp_path_factory)
+    return {path.name.split('_')[0]: path for path in box.directory.glob('*.zip')}
+
+
+def make_boxes(tmp_path_factory, archives, box_contents):
+    boxes = []
+    for n, names in enumerate(box_contents):
+        directory = tmp_path_factory.mktemp(f'box{n}')
+        for name in names:
+            shutil.copy(archives[name], directory)
+        BoxIndex(directory).rebuild()
+        boxes.append(Box(f'box{n}', directory))
+    return boxes
+
+
+@pytest.fixture
+def boxes(tmp_path_factory, archives):
+    return make_boxes(tmp_path_factory, archives, [['middle'], ['root', 'leaf'], ['root', 'middle']])
+
+
+def box_by_box(boxes):
+    """Search, that does not use the catalog (nor shares query caches with boxes)."""
+    search = MultiBoxSearch([Box(box.name, box.directory) for box in boxes])
+    search._catalog = lambda: None
+    return search
+
+
+def summary(beads):
+    return [(bead.box_name, bead.name, tuple(input.name for input in bead.inputs)) for bead in beads]
+
+
+@pytest.mark.parametrize('terminal', ['all', 'first', 'oldest', 'newest', 'newer', 'older'])
+@pytest.mark.parametrize('unique', [False, True])
+def test_catalog_finds_the_same_as_searching_box_by_box(boxes, terminal, unique):
+    def search(search):
+        if unique:
+            search = search.unique()
+        result = getattr(search, terminal)()
+        return summary(result if terminal == 'all' else [result])
+
+    assert search(box_by_box(boxes)) == search(MultiBoxSearch(boxes))
+
+
+def test_search_uses_catalog_for_indexed_boxes(boxes, monkeypatch):
+    queries = []
+    get_beads = BoxCatalog.get_beads
+
+    def tracing_get_beads(self, *args, **kwargs):
+        queries.append(args)
+        return get_beads(self, *args, **kwargs)
+
+    monkeypatch.setattr(BoxCatalog, 'get_beads', tracing_get_beads)
+    assert 'box0' == MultiBoxSearch(boxes).by_name('middle').newest().box_name
+    assert 1 == len(queries)
+
+
+def test_unique_keeps_first_in_box_order(boxes):
+    beads = MultiBoxSearch(boxes).unique().all()
+    assert [('box0', 'middle'), ('box1', 'root'), ('box1', 'leaf')] == [(b.box_name, b.name) for b in beads]
+
+
+def test_dependency_conditions_are_evaluated_per_box(boxes):
+    root = MultiBoxSearch(boxes).by_name('root').first()
+    beads = MultiBoxSearch(boxes).downstream_of(root.content_id).all()
+    # leaf is in a box without middle, so it is not reached from root there
+    assert [('box0', 'middle'), ('box2', 'middle')] == [(b.box_name, b.name) for b in beads]
+    assert summary(box_by_box(boxes).downstream_of(root.content_id).all()) == summary(beads)
+
+
+def test_more_boxes_than_attachable(tmp_path_factory, archives):
+    boxes = make_boxes(tmp_path_factory, archives, [['root'], ['middle'], ['leaf']] * 5)
+    catalog = MultiBoxSearch(boxes)
+    assert 15 == len(catalog.all())
+    assert summary(box_by_box(boxes).all()) == summary(catalog.all())
+    assert summary([box_by_box(boxes).unique().older(1)]) == summary([MultiBoxSearch(boxes).unique().older(1)])
+    assert 3 == len(MultiBoxSearch(boxes).unique().all())
+
+
+def test_mixed_boxes_are_searched_box_by_box(boxes):
+    (boxes[0].directory / '.index.sqlite').unlink()
+    boxes[0] = Box(boxes[0].name, boxes[0].directory)
+    assert MultiBoxSearch(boxes)._catalog() is None
+    assert 'box0' == MultiBoxSearch(boxes).by_name('middle').first().box_name
+
+
+def test_catalog_answers_are_cached_by_the_boxes(boxes, monkeypatch):
+    queries = []
+    get_beads = BoxCatalog.get_beads
+
+    def tracing_get_beads(self, *args, **kwargs):
+        queries.append(args)
+        return get_beads(self, *args, **kwargs)
+
+    monkeypatch.setattr(BoxCatalog, 'get_beads', tracing_get_beads)
+    beads = MultiBoxSearch(boxes).by_name('middle').all()
+    assert summary(beads) == summary(MultiBoxSearch(boxes).by_name('middle').all())
+    # the second search is answered from the query caches of the boxes
+    assert 1 == len(queries)
+
+
+def test_limited_search_loads_inputs_of_more_beads_than_parameters(tmp_path_factory, archives, monkeypatch):
+    boxes = make_boxes(tmp_path_factory, archives, [['root', 'middle', 'leaf']])
+    original_connect = sqlite3.connect
+
+    def limited_connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+        conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 5)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', limited_connect)
+    monkeypatch.setattr(box_catalog, 'STREAM_BATCH_SIZE', 2)
+    beads = BoxCatalog(boxes).get_beads([], limit=3)
+    assert [('box0', 'root', ()), ('box0', 'middle', ('root',)), ('box0', 'leaf', ('middle',))] == summary(beads)
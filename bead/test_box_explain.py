@@ -0,0 +1,115 @@
+import pytest
+
+from tests.boxes import TS1
+from tests.boxes import TS2
+from tests.boxes import store_bead
+
+from .box import Box
+from .box import search
+from .box_explain import EXPLAIN_ENV
+from .box_explain import describe_conditions
+from .box_explain import is_explain_requested
+from .box_index import BoxIndex
+from .box_query import BeadLookup
+from .box_query import QueryCondition
+from .box_query import QueryOrder
+
+
+@pytest.fixture
+def box_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('box')
+    box = Box('box', directory)
+    store_bead(box, tmp_path_factory, 'bead', TS1, kind='kind')
+    store_bead(box, tmp_path_factory, 'bead', TS2, kind='kind')
+    return directory
+
+
+def traced_box(name, directory):
+    box = Box(name, directory)
+    box.traces = []
+    box.on_query = box.traces.append
+    return box
+
+
+def test_raw_box_reports_archives_opened(box_directory):
+    box = traced_box('box', box_directory)
+    # archives opened one by one, without cache
+    box.resolver.jobs = 1
+    box.resolver.archive_cache = None
+
+    assert 'bead' == box.search().newest().name
+
+    [trace] = box.traces
+    assert ('box', 'RawFilesystemResolver') == (trace.box_name, trace.resolver)
+    assert (1, 1) == (trace.rows, trace.archives_opened)
+    assert trace.sql is None
+    assert not trace.cached
+    assert trace.seconds > 0
+
+
+def test_indexed_box_reports_sql_and_plan(box_directory):
+    BoxIndex(box_directory).rebuild()
+    box = traced_box('box', box_directory)
+
+    assert 2 == len(box.search().by_kind('kind').all())
+
+    [trace] = box.traces
+    assert ('BoxIndex', 2, 0) == (trace.resolver, trace.rows, trace.archives_opened)
+    assert 'FROM beads' in trace.sql
+    assert trace.query_plan
+
+
+def test_cached_search_is_reported(box_directory):
+    box = traced_box('box', box_directory)
+    box.search().all()
+    box.search().all()
+    assert [False, True] == [trace.cached for trace in box.traces]
+
+
+def test_lookups_are_explained_as_a_batch(box_directory):
+    BoxIndex(box_directory).rebuild()
+    box = traced_box('box', box_directory)
+
+    box.lookup_beads([BeadLookup.newest_of_kind('kind'), BeadLookup.by_content_id('unknown')])
+
+    [trace] = box.traces
+    assert 'lookup 1 content ids, 1 kinds' == trace.query
+    assert 1 == trace.rows
+    assert 'VALUES' in trace.sql
+
+
+def test_iter_is_reported_when_finished(box_directory):
+    box = traced_box('box', box_directory)
+    beads = box.search().iter()
+    next(beads)
+    assert [] == box.traces
+    assert 1 == len(list(beads))
+    [trace] = box.traces
+    assert 2 == trace.rows
+
+
+def test_catalog_search_is_reported_once(box_directory, tmp_path):
+    BoxIndex(box_directory).rebuild()
+    BoxIndex(tmp_path).rebuild()
+    traces = []
+    boxes = [Box('box', box_directory), Box('other', tmp_path)]
+    for box in boxes:
+        box.on_query = traces.append
+
+    assert 2 == len(search(boxes).all())
+
+    [trace] = traces
+    assert ('box, other', 'BoxCatalog', 2) == (trace.box_name, trace.resolver, trace.rows)
+
+
+def test_describe_conditions():
+    conditions = [(QueryCondition.KIND, 'kind'), (QueryCondition.VERIFIED, True)]
+    assert "search kind='kind' verified newest_first limit=1" == describe_conditions(
+        conditions, QueryOrder.NEWEST_FIRST, 1)
+    assert 'search all' == describe_conditions([])
+
+
+@pytest.mark.parametrize('value, requested', [(None, False), ('', False), ('off', False), ('1', True)])
+def test_is_explain_requested(value, requested):
+    environ = {} if value is None else {EXPLAIN_ENV: value}
+    assert requested == is_explain_requested(environ)
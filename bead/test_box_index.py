@@ -0,0 +1,567 @@
+from contextlib import closing
+import os
+import shutil
+import sqlite3
+import warnings
+import zipfile
+
+import attr
+import pytest
+
+from tests.boxes import TS1
+from tests.boxes import TS2
+from tests.boxes import TS3
+from tests.boxes import store_dependency_chain
+
+from . import box as bead_box
+from . import box_index
+from . import layouts
+from .bead import BeadRecord
+from .box import Box
+from .box_index import BoxIndex
+from .box_query import BeadLookup
+from .box_query import QueryOrder
+from .exceptions import BoxIndexError
+from .meta import InputName
+from .meta import InputSpec
+from .tech.timestamp import time_from_timestamp
+from .tech.timestamp import unix_microseconds
+from .workspace import Workspace
+
+
+@pytest.fixture
+def box(tmp_path_factory):
+    """Create an indexed test box with beads having inputs."""
+    box_dir = tmp_path_factory.mktemp('box')
+    BoxIndex(box_dir)
+    box = Box('test', box_dir)
+    store_dependency_chain(box, tmp_path_factory, leaf_inputs=('root', 'middle'))
+    return box
+
+
+@pytest.fixture
+def select_count(monkeypatch):
+    """Count SELECT statements issued on index connections."""
+    statements = []
+    original_connect = sqlite3.connect
+
+    def tracing_connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', tracing_connect)
+    return lambda: sum(1 for sql in statements if sql.lstrip().upper().startswith('SELECT'))
+
+
+def test_box_uses_index(box):
+    assert isinstance(box.resolver, BoxIndex)
+
+
+def test_all_beads_loads_inputs(box):
+    inputs_by_name = {
+        bead.name: sorted(input.name for input in bead.inputs)
+        for bead in box.all_beads()}
+    assert {'root': [], 'middle': ['root'], 'leaf': ['middle', 'root']} == inputs_by_name
+
+
+def test_filtered_query_loads_inputs_of_matching_beads_only(box):
+    beads = box.search().by_kind('kind-middle').all()
+    assert ['middle'] == [bead.name for bead in beads]
+    assert ['root'] == [input.name for input in beads[0].inputs]
+
+
+def test_query_inputs_in_constant_number_of_selects(box, select_count):
+    assert 3 == len(box.all_beads())
+    assert select_count() <= 2
+
+
+def test_query_without_match_does_not_load_inputs(box, select_count):
+    assert [] == box.search().by_kind('no-such-kind').all()
+    assert 1 == select_count()
+
+
+
+def test_iter_streams_beads_with_inputs_in_batches(box, monkeypatch):
+    monkeypatch.setattr(box_index, 'STREAM_BATCH_SIZE', 2)
+    inputs_by_name = {
+        bead.name: sorted(input.name for input in bead.inputs)
+        for bead in box.iter_beads([])}
+    assert {'root': [], 'middle': ['root'], 'leaf': ['middle', 'root']} == inputs_by_name
+    assert ['leaf', 'middle'] == [bead.name for bead in box.iter_beads([], QueryOrder.NEWEST_FIRST, limit=2)]
+
+
+@pytest.fixture
+def few_parameters(monkeypatch):
+    """Limit SQL statements on index connections to 5 parameters, and input loading to batches of 2 beads."""
+    original_connect = sqlite3.connect
+
+    def limited_connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+        conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 5)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', limited_connect)
+    monkeypatch.setattr(box_index, 'STREAM_BATCH_SIZE', 2)
+
+
+def test_limited_query_loads_inputs_of_more_beads_than_parameters(box, few_parameters):
+    beads = box.resolver.get_beads([], 'test', QueryOrder.NEWEST_FIRST, limit=3)
+    inputs_by_name = {bead.name: sorted(input.name for input in bead.inputs) for bead in beads}
+    assert {'root': [], 'middle': ['root'], 'leaf': ['middle', 'root']} == inputs_by_name
+
+
+def test_lookups_are_answered_in_batches_with_inputs(box, monkeypatch):
+    monkeypatch.setattr(box_index, 'LOOKUP_BATCH_SIZE', 2)
+    leaf = box.search().by_name('leaf').first()
+    lookups = [
+        BeadLookup.newest_of_kind('kind-root'),
+        BeadLookup.by_content_id(leaf.content_id),
+        BeadLookup.newest_of_kind('kind-leaf', at_or_older=time_from_timestamp(TS2)),
+        BeadLookup.newest_of_kind('kind-middle', at_or_older=time_from_timestamp(TS2)),
+    ]
+
+    answers = box.lookup_beads(lookups)
+
+    assert ['root', 'leaf', None, 'middle'] == [bead and bead.name for bead in answers]
+    assert ['middle', 'root'] == sorted(input.name for input in answers[1].inputs)
+
+
+def indexed_names(box):
+    return sorted(bead.name for bead in box.all_beads())
+
+
+def test_rebuild_indexes_all_archives_in_batches(box, monkeypatch):
+    monkeypatch.setattr(box_index, 'INDEX_BATCH_SIZE', 2)
+    box.resolver.rebuild()
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+
+
+def test_interrupted_rebuild_is_resumed(box, monkeypatch):
+    monkeypatch.setattr(box_index, 'INDEX_BATCH_SIZE', 1)
+    read_archive_record = box_index.read_archive_record
+    read_paths = []
+
+    def interrupt_after_two_archives(archive_path, *args):
+        if len(read_paths) == 2:
+            raise KeyboardInterrupt
+        read_paths.append(archive_path)
+        return read_archive_record(archive_path, *args)
+
+    monkeypatch.setattr(box_index, 'read_archive_record', interrupt_after_two_archives)
+    with pytest.raises(KeyboardInterrupt):
+        box.resolver.rebuild()
+    assert 2 == len(indexed_names(box))
+
+    monkeypatch.setattr(box_index, 'read_archive_record', read_archive_record)
+    box.resolver.rebuild()
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+
+    # a finished rebuild starts from scratch
+    (box.directory / read_paths[0].name).unlink()
+    box.resolver.rebuild()
+    assert 2 == len(indexed_names(box))
+
+
+def test_sync_adds_new_and_removes_deleted_archives(box):
+    archive_paths = sorted(box.directory.glob('*.zip'))
+    box.resolver.unindex_archive_file(archive_paths[0])
+    archive_paths[1].unlink()
+
+    box.resolver.sync()
+
+    assert 2 == len(indexed_names(box))
+    assert archive_paths[0].name in {box.resolver.get_file_path(b.name, b.content_id).name for b in box.all_beads()}
+
+
+def test_parallel_rebuild_reports_progress(box):
+    progress = []
+    box.resolver.rebuild(jobs=3, progress=lambda done, total: progress.append((done, total)))
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+    assert [(1, 3), (2, 3), (3, 3)] == progress
+
+
+def damage(archive_path):
+    with zipfile.ZipFile(archive_path, 'a') as z:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            z.writestr(f'{layouts.Archive.CODE}/definition', 'HACKED')
+
+
+def test_index_without_verification_keeps_damaged_archives_until_verified(box):
+    leaf_path = box.resolver.get_file_path('leaf', box.search().by_name('leaf').first().content_id)
+    damage(leaf_path)
+
+    box.resolver.rebuild(verify=False)
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+    assert [] == box.search().verified().all()
+    assert 3 == len(box.search().undamaged().all())
+
+    assert [leaf_path.name] == box.resolver.verify(jobs=2)
+    assert ['middle', 'root'] == sorted(bead.name for bead in box.search().verified().all())
+    assert ['middle', 'root'] == sorted(bead.name for bead in box.search().undamaged().all())
+    assert 3 == len(box.all_beads())
+
+    # already verified beads are not checked again
+    assert [] == box.resolver.verify()
+    assert [leaf_path.name] == box.resolver.verify(recheck=True)
+
+
+def test_index_with_verification_skips_damaged_archives(box):
+    leaf_path = box.resolver.get_file_path('leaf', box.search().by_name('leaf').first().content_id)
+    damage(leaf_path)
+
+    box.resolver.rebuild()
+    assert ['middle', 'root'] == sorted(bead.name for bead in box.search().verified().all())
+    assert ['middle', 'root'] == indexed_names(box)
+
+
+def create_unversioned_index(index_path, rows=()):
+    """Create an index as written before schema versioning."""
+    with closing(sqlite3.connect(index_path)) as conn:
+        conn.execute('''
+            CREATE TABLE beads (
+                name TEXT NOT NULL,
+                content_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                freeze_time_str TEXT NOT NULL,
+                freeze_time_unix INTEGER NOT NULL,
+                file_path TEXT NOT NULL,
+                PRIMARY KEY (name, content_id)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE inputs (
+                bead_name TEXT NOT NULL,
+                bead_content_id TEXT NOT NULL,
+                input_name TEXT NOT NULL,
+                input_kind TEXT NOT NULL,
+                input_content_id TEXT NOT NULL,
+                input_freeze_time_str TEXT NOT NULL
+            )
+        ''')
+        conn.executemany('INSERT INTO beads VALUES (?, ?, ?, ?, ?, ?)', rows)
+        conn.commit()
+
+
+def schema_version(index_path):
+    with closing(sqlite3.connect(index_path)) as conn:
+        return box_index.get_schema_version(conn)
+
+
+def test_unversioned_index_is_migrated(tmp_path):
+    index_path = tmp_path / '.index.sqlite'
+    create_unversioned_index(index_path, [('name', 'id', 'kind', TS1, 0, 'name.zip')])
+
+    box = Box('old', tmp_path)
+    assert isinstance(box.resolver, BoxIndex)
+    assert box_index.SCHEMA_VERSION == schema_version(index_path)
+    assert ['name'] == [bead.name for bead in box.search().verified().all()]
+
+
+def test_migration_applied_meanwhile_by_another_process_is_skipped(tmp_path, monkeypatch):
+    index_path = tmp_path / '.index.sqlite'
+    create_unversioned_index(index_path)
+    applied = []
+
+    def counting(version, migration):
+        def counting_migration(conn):
+            applied.append(version)
+            migration(conn)
+        return counting_migration
+    migrations = [counting(version, migration) for version, migration in enumerate(box_index.MIGRATIONS)]
+    monkeypatch.setattr(box_index, 'MIGRATIONS', migrations)
+
+    get_schema_version = box_index.get_schema_version
+    versions_read = []
+
+    def migrated_by_another_process_after_first_read(conn):
+        version = get_schema_version(conn)
+        versions_read.append(version)
+        if len(versions_read) == 1:
+            with closing(sqlite3.connect(index_path)) as other_conn:
+                box_index.create_schema(other_conn)
+        return version
+    monkeypatch.setattr(box_index, 'get_schema_version', migrated_by_another_process_after_first_read)
+
+    with closing(sqlite3.connect(index_path)) as conn:
+        box_index.create_schema(conn)
+
+    assert list(range(box_index.SCHEMA_VERSION)) == applied
+    assert box_index.SCHEMA_VERSION == schema_version(index_path)
+
+
+def test_migrated_index_is_backfilled_without_reading_archives(box, monkeypatch):
+    index_path = box.directory / '.index.sqlite'
+    with closing(sqlite3.connect(index_path)) as conn:
+        rows = conn.execute(
+            'SELECT name, content_id, kind, freeze_time_str, freeze_time_unix, file_path FROM beads').fetchall()
+    index_path.unlink()
+    create_unversioned_index(index_path, rows)
+
+    def fail(*args):
+        raise AssertionError('archive read')
+    monkeypatch.setattr(box_index, 'read_archive_record', fail)
+    Box(box.name, box.directory).resolver.sync(full=True)
+
+    with closing(sqlite3.connect(index_path)) as conn:
+        assert 0 == conn.execute('SELECT count(*) FROM beads WHERE file_size IS NULL').fetchone()[0]
+        assert 0 == conn.execute('SELECT count(*) FROM beads WHERE uncompressed_bytes IS NULL').fetchone()[0]
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+
+
+@pytest.fixture
+def read_only_box(box, tmp_path, monkeypatch):
+    """The indexed test box without its index, in a directory, that is not writable."""
+    (box.directory / '.index.sqlite').unlink()
+    monkeypatch.setattr(bead_box, 'is_writable_directory', lambda directory: False)
+    monkeypatch.setattr(bead_box, 'shadow_index_path', lambda box_directory: tmp_path / 'shadow.sqlite')
+    return box
+
+
+def test_read_only_box_is_searched_with_shadow_index(read_only_box, tmp_path):
+    box = Box(read_only_box.name, read_only_box.directory)
+    assert isinstance(box.resolver, BoxIndex)
+    assert tmp_path / 'shadow.sqlite' == box.resolver.index_path
+    assert not (box.directory / '.index.sqlite').exists()
+
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+    leaf = box.search().by_name('leaf').first()
+    assert ['middle', 'root'] == sorted(input.name for input in leaf.inputs)
+    assert box.directory == box.resolver.get_file_path(leaf.name, leaf.content_id).parent
+
+
+def test_shadow_index_is_synced_in_parallel_on_first_search(read_only_box, tmp_path, monkeypatch):
+    sync_jobs = []
+    sync = BoxIndex.sync
+
+    def tracing_sync(self, jobs=1, **kwargs):
+        sync_jobs.append(jobs)
+        return sync(self, jobs, **kwargs)
+    monkeypatch.setattr(BoxIndex, 'sync', tracing_sync)
+
+    box = Box(read_only_box.name, read_only_box.directory)
+    assert [] == sync_jobs
+    assert 3 == len(box.all_beads())
+    assert [box_index.DEFAULT_INDEX_JOBS] == sync_jobs
+
+
+def test_shadow_index_follows_box_changes(read_only_box):
+    assert 3 == len(Box(read_only_box.name, read_only_box.directory).all_beads())
+    next(read_only_box.directory.glob('leaf_*.zip')).unlink()
+    assert ['middle', 'root'] == indexed_names(Box(read_only_box.name, read_only_box.directory))
+
+
+def test_outdated_index_that_can_not_be_migrated_is_shadowed(read_only_box, tmp_path, monkeypatch):
+    create_unversioned_index(read_only_box.directory / '.index.sqlite')
+    ensure_index = box_index.ensure_index
+    monkeypatch.setattr(
+        box_index, 'ensure_index',
+        lambda index_path: index_path != read_only_box.directory / '.index.sqlite' and ensure_index(index_path))
+
+    box = Box('read-only', read_only_box.directory)
+    assert tmp_path / 'shadow.sqlite' == box.resolver.index_path
+    assert 0 == schema_version(read_only_box.directory / '.index.sqlite')
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+
+
+def test_index_with_newer_schema_is_not_modified(tmp_path):
+    index_path = tmp_path / '.index.sqlite'
+    with closing(sqlite3.connect(index_path)) as conn:
+        conn.execute(f'PRAGMA user_version = {box_index.SCHEMA_VERSION + 1}')
+        with pytest.raises(BoxIndexError):
+            box_index.create_schema(conn)
+    assert box_index.SCHEMA_VERSION + 1 == schema_version(index_path)
+
+
+def test_sync_reindexes_replaced_archive(box, tmp_path):
+    middle = box.search().by_name('middle').first()
+    middle_path = box.resolver.get_file_path(middle.name, middle.content_id)
+
+    ws = Workspace(tmp_path / 'middle')
+    ws.create('kind-replaced')
+    replacement_path = tmp_path / 'replacement.zip'
+    ws.pack(replacement_path, TS2, comment='replacement')
+    os.replace(replacement_path, middle_path)
+
+    box.resolver.sync()
+
+    [replaced] = box.search().by_name('middle').all()
+    assert 'kind-replaced' == replaced.kind
+    assert middle.content_id != replaced.content_id
+    assert middle_path == box.resolver.get_file_path(replaced.name, replaced.content_id)
+
+
+def test_sync_skips_unchanged_directory(box, tmp_path):
+    old_mtime_ns = 1_500_000_000 * 10**9
+    os.utime(box.directory, ns=(old_mtime_ns, old_mtime_ns))
+    box.resolver.sync()
+
+    leaf_path = next(box.directory.glob('leaf_*.zip'))
+    copy_path = box.directory / leaf_path.name.replace('leaf', 'leaf-copy')
+    shutil.copy(leaf_path, copy_path)
+    os.utime(box.directory, ns=(old_mtime_ns, old_mtime_ns))
+
+    box.resolver.sync()
+    assert ['leaf', 'middle', 'root'] == indexed_names(box)
+
+    box.resolver.sync(full=True)
+    assert ['leaf', 'leaf-copy', 'middle', 'root'] == indexed_names(box)
+
+
+def test_sync_of_recently_changed_directory_is_not_skipped(box):
+    box.resolver.sync()
+
+    leaf_path = next(box.directory.glob('leaf_*.zip'))
+    leaf_path.unlink()
+    box.resolver.sync()
+    assert ['middle', 'root'] == indexed_names(box)
+
+
+def test_limited_query_loads_inputs_of_returned_beads(box):
+    leaf = box.search().newest()
+    assert 'leaf' == leaf.name
+    assert ['middle', 'root'] == sorted(input.name for input in leaf.inputs)
+    assert 'middle' == box.search().newer(1).name
+    assert 'root' == box.search().older(2).name
+    with pytest.raises(LookupError):
+        box.search().older(3)
+
+
+def test_terminals_are_limited_in_sql(box, monkeypatch):
+    statements = []
+    original_connect = sqlite3.connect
+
+    def tracing_connect(*args, **kwargs):
+        conn = original_connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', tracing_connect)
+    box.search().by_kind('kind-leaf').newest()
+    [bead_select] = [sql for sql in statements if 'FROM beads' in sql and 'JOIN' not in sql]
+    assert 'ORDER BY freeze_time_unix DESC LIMIT 1' in bead_select
+
+
+def names(beads):
+    return sorted(bead.name for bead in beads)
+
+
+@pytest.fixture(params=['index', 'raw'])
+def graph_box(request, box):
+    if request.param == 'raw':
+        (box.directory / '.index.sqlite').unlink()
+        box = Box(box.name, box.directory)
+        assert not isinstance(box.resolver, BoxIndex)
+    return box
+
+
+def test_consumers_of(graph_box):
+    root = graph_box.search().by_name('root').first()
+    middle = graph_box.search().by_name('middle').first()
+    assert ['leaf', 'middle'] == names(graph_box.search().consumers_of(root.content_id).all())
+    assert ['leaf'] == names(graph_box.search().consumers_of(middle.content_id).all())
+
+
+def test_upstream_of(graph_box):
+    leaf = graph_box.search().by_name('leaf').first()
+    middle = graph_box.search().by_name('middle').first()
+    assert ['middle', 'root'] == names(graph_box.search().upstream_of(leaf.content_id).all())
+    assert ['root'] == names(graph_box.search().upstream_of(middle.content_id).all())
+    assert 'middle' == graph_box.search().upstream_of(leaf.content_id).newest().name
+
+
+def test_downstream_of(graph_box):
+    root = graph_box.search().by_name('root').first()
+    leaf = graph_box.search().by_name('leaf').first()
+    assert ['leaf', 'middle'] == names(graph_box.search().downstream_of(root.content_id).all())
+    assert [] == graph_box.search().downstream_of(leaf.content_id).all()
+    assert ['leaf'] == names(graph_box.search().downstream_of(root.content_id).by_kind('kind-leaf').all())
+
+
+def test_query_results_are_compact_immutable_records(box):
+    leaf = box.search().by_name('leaf').first()
+    assert isinstance(leaf, BeadRecord)
+    assert not hasattr(leaf, '__dict__')
+    with pytest.raises(attr.exceptions.FrozenInstanceError):
+        leaf.name = 'other'
+    assert leaf.freeze_time == time_from_timestamp(TS3)
+    assert unix_microseconds(leaf.freeze_time) == leaf.freeze_time_unix
+
+
+def test_record_inputs_equal_validated_input_specs(box):
+    middle = box.search().by_name('middle').first()
+    root = box.search().by_name('root').first()
+    assert (InputSpec('root', 'kind-root', root.content_id, TS1),) == middle.inputs
+    assert isinstance(middle.inputs[0].name, InputName)
+    assert middle.inputs is middle.inputs
+
+
+def test_retry_when_busy_retries_locked_updates_only(monkeypatch):
+    monkeypatch.setattr(box_index, 'BUSY_RETRY_DELAY_SECONDS', 0)
+    attempts = []
+
+    def update():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return 'updated'
+
+    assert 'updated' == box_index.retry_when_busy(update)
+    assert 3 == len(attempts)
+
+    def broken_update():
+        attempts.append(1)
+        raise sqlite3.OperationalError('no such table: beads')
+
+    attempts.clear()
+    with pytest.raises(sqlite3.OperationalError):
+        box_index.retry_when_busy(broken_update)
+    assert 1 == len(attempts)
+
+
+@pytest.fixture
+def locked_index(box, monkeypatch):
+    """Hold the write lock of the box index, as a concurrent writer would."""
+    monkeypatch.setattr(box_index, 'BUSY_TIMEOUT_SECONDS', 0.01)
+    monkeypatch.setattr(box_index, 'BUSY_RETRY_DELAY_SECONDS', 0.001)
+    conn = sqlite3.connect(box.resolver.index_path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    yield conn
+    conn.close()
+
+
+def copy_archive(box, name, new_name):
+    archive_path = next(box.directory.glob(f'{name}_*.zip'))
+    copy_path = box.directory / archive_path.name.replace(name, new_name)
+    shutil.copy(archive_path, copy_path)
+    return copy_path
+
+
+def pending_files(box):
+    return sorted(path.name for path in box.directory.glob('.index.sqlite.pending*'))
+
+
+def test_archive_stored_while_index_is_locked_is_indexed_by_next_store(box, locked_index):
+    copy_path = copy_archive(box, 'leaf', 'leaf-copy')
+    box.resolver.index_archive_file(copy_path)
+    assert [copy_path.name] == box_index.read_pending_archive_names(box.resolver.pending_path)
+
+    locked_index.execute('ROLLBACK')
+    box.resolver.index_archive_file(copy_archive(box, 'leaf', 'leaf-other'))
+
+    assert ['leaf', 'leaf-copy', 'leaf-other', 'middle', 'root'] == indexed_names(box)
+    assert [] == pending_files(box)
+
+
+def test_sync_indexes_queued_archives(box, locked_index):
+    box.resolver.index_archive_file(copy_archive(box, 'leaf', 'leaf-copy'))
+    with pytest.raises(BoxIndexError):
+        box.resolver.sync()
+    assert ['.index.sqlite.pending'] == pending_files(box)
+
+    locked_index.execute('ROLLBACK')
+    box.resolver.sync()
+
+    assert ['leaf', 'leaf-copy', 'middle', 'root'] == indexed_names(box)
+    assert [] == pending_files(box)
@@ -0,0 +1,109 @@
+'''
+Check, that queries run against the box index use the secondary indexes.
+
+Without them searches, sync and rebuild degrade to full table scans.
+'''
+
+from contextlib import closing
+import sqlite3
+
+import pytest
+
+from .box_index import beads_query_sql
+from .box_index import build_where_clause
+from .box_index import create_schema
+from .box_index import inputs_query_sql
+from .box_query import QueryCondition
+from .tech.timestamp import time_from_timestamp
+
+TIME = time_from_timestamp('20160704T162800000000+0200')
+
+
+@pytest.fixture
+def conn():
+    with closing(sqlite3.connect(':memory:')) as conn:
+        create_schema(conn)
+        yield conn
+
+
+def query_plan(conn, sql, parameters=()):
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    return '\n'.join(detail for _id, _parent, _notused, detail in rows)
+
+
+def plan_of_beads_query(conn, conditions):
+    where_parts, parameters = build_where_clause(conditions)
+    return query_plan(conn, beads_query_sql(where_parts), parameters)
+
+
+def plan_of_inputs_query(conn, conditions):
+    where_parts, parameters = build_where_clause(conditions)
+    return query_plan(conn, inputs_query_sql(where_parts), parameters)
+
+
+def test_by_name_with_time(conn):
+    plan = plan_of_beads_query(
+        conn, [(QueryCondition.BEAD_NAME, 'name'), (QueryCondition.AT_OR_OLDER, TIME)])
+    assert 'USING INDEX idx_beads_name_freeze_time_unix (name=? AND freeze_time_unix<?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_by_kind_with_time(conn):
+    plan = plan_of_beads_query(
+        conn, [(QueryCondition.KIND, 'kind'), (QueryCondition.NEWER_THAN, TIME)])
+    assert 'USING INDEX idx_beads_kind_freeze_time_unix (kind=? AND freeze_time_unix>?)' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_by_content_id(conn):
+    plan = plan_of_beads_query(conn, [(QueryCondition.CONTENT_ID, 'content_id')])
+    assert 'USING INDEX idx_beads_content_id (content_id=?)' in plan
+
+
+def test_all_beads_ordered_by_index(conn):
+    plan = plan_of_beads_query(conn, [])
+    assert 'SCAN beads USING INDEX idx_beads_freeze_time_unix' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_inputs_of_beads_by_kind(conn):
+    plan = plan_of_inputs_query(conn, [(QueryCondition.KIND, 'kind')])
+    assert 'USING INDEX idx_beads_kind_freeze_time_unix (kind=?)' in plan
+    assert 'USING INDEX idx_inputs_bead (bead_name=? AND bead_content_id=?)' in plan
+
+
+def test_delete_inputs_of_bead(conn):
+    plan = query_plan(
+        conn, 'DELETE FROM inputs WHERE bead_name = ? AND bead_content_id = ?', ('name', 'content_id'))
+    assert 'USING INDEX idx_inputs_bead (bead_name=? AND bead_content_id=?)' in plan
+
+
+def test_delete_by_file_path(conn):
+    plan = query_plan(conn, 'DELETE FROM beads WHERE file_path = ?', ('file.zip',))
+    assert 'USING INDEX idx_beads_file_path (file_path=?)' in plan
+
+    plan = query_plan(conn, '''
+        DELETE FROM inputs
+        WHERE (bead_name, bead_content_id) IN (
+            SELECT name, content_id FROM beads WHERE file_path = ?
+        )
+    ''', ('file.zip',))
+    assert 'USING INDEX idx_beads_file_path (file_path=?)' in plan
+    assert 'USING INDEX idx_inputs_bead (bead_name=? AND bead_content_id=?)' in plan
+
+
+def test_consumers_of_content_id(conn):
+    plan = query_plan(conn, 'SELECT bead_name FROM inputs WHERE input_content_id = ?', ('content_id',))
+    assert 'USING INDEX idx_inputs_input_content_id (input_content_id=?)' in plan
+
+
+def test_upstream_closure(conn):
+    plan = plan_of_beads_query(conn, [(QueryCondition.UPSTREAM_OF, 'content_id')])
+    assert 'USING INDEX idx_inputs_bead_content_id (bead_content_id=?)' in plan
+    assert 'SCAN inputs' not in plan
+
+
+def test_downstream_closure(conn):
+    plan = plan_of_beads_query(conn, [(QueryCondition.DOWNSTREAM_OF, 'content_id')])
+    assert 'USING INDEX idx_inputs_input_content_id (input_content_id=?)' in plan
+    assert 'SCAN inputs' not in plan
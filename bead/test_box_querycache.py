@@ -0,0 +1,101 @@
+import pytest
+
+from tests.boxes import TS1
+from tests.boxes import TS2
+
+from .box import Box
+from .box_index import BoxIndex
+from .box_index import read_change_counter
+from .box_query import BeadLookup
+from .workspace import Workspace
+
+
+@pytest.fixture(params=['raw', 'indexed'])
+def box_directory(request, tmp_path_factory):
+    directory = tmp_path_factory.mktemp('box')
+    if request.param == 'indexed':
+        BoxIndex(directory).rebuild()
+    return directory
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    workspace = Workspace(tmp_path / 'bead')
+    workspace.create('kind')
+    return workspace
+
+
+@pytest.fixture
+def box(box_directory, workspace):
+    box = Box('box', box_directory)
+    box.store(workspace, TS1)
+    return box
+
+
+def test_repeated_search_is_answered_from_cache(box):
+    assert 1 == len(box.search().by_kind('kind').all())
+    assert (0, 1) == (box.query_cache.hits, box.query_cache.misses)
+
+    assert 1 == len(box.search().by_kind('kind').all())
+    assert (1, 1) == (box.query_cache.hits, box.query_cache.misses)
+
+
+def test_cached_results_are_copied(box):
+    box.search().all().clear()
+    assert 1 == len(box.search().all())
+
+
+def test_store_invalidates_cache(box, workspace):
+    assert 1 == len(box.search().all())
+    box.store(workspace, TS2)
+    assert 2 == len(box.search().all())
+
+
+def test_store_by_other_box_invalidates_cache(box, box_directory, workspace):
+    assert 1 == len(box.search().all())
+    Box('other', box_directory).store(workspace, TS2)
+    assert 2 == len(box.search().all())
+
+
+def test_lookups_are_cached_one_by_one(box, monkeypatch):
+    kind_lookup = BeadLookup.newest_of_kind('kind')
+    unknown_lookup = BeadLookup.newest_of_kind('unknown')
+    box.lookup_beads([kind_lookup])
+    asked = []
+    lookup_beads = box.resolver.lookup_beads
+
+    def tracing_lookup_beads(lookups, box_name):
+        asked.extend(lookups)
+        return lookup_beads(lookups, box_name)
+    monkeypatch.setattr(box.resolver, 'lookup_beads', tracing_lookup_beads)
+
+    answers = box.lookup_beads([unknown_lookup, kind_lookup])
+
+    assert [None, 'bead'] == [bead and bead.name for bead in answers]
+    assert [unknown_lookup] == asked
+
+
+def test_sync_of_index_invalidates_cache(tmp_path, workspace):
+    box = Box('box', tmp_path)
+    box.store(workspace, TS1)
+    BoxIndex(tmp_path).rebuild()
+    box = Box('box', tmp_path)
+    assert 1 == len(box.search().all())
+
+    # archive moved in by hand, indexed by someone else
+    (tmp_path / 'raw').mkdir()
+    other = Box('raw', tmp_path / 'raw')
+    other.store(workspace, TS2)
+    for path in other.directory.glob('*.zip'):
+        path.rename(tmp_path / path.name)
+    assert 1 == len(box.search().all())
+    BoxIndex(tmp_path).sync()
+
+    assert 2 == len(box.search().all())
+
+
+def test_change_counter_follows_commits(tmp_path, workspace):
+    box_index = BoxIndex(tmp_path)
+    counter = read_change_counter(box_index.index_path)
+    Box('box', tmp_path).store(workspace, TS1)
+    assert counter < read_change_counter(box_index.index_path)
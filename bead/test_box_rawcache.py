@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from tests.boxes import TS2
+from tests.boxes import TS3
+from tests.boxes import store_dependency_chain
+
+from . import box_rawfs
+from .box import Box
+from .box_rawcache import raw_cache_path
+from .tech import persistence
+from .tech.timestamp import time_from_user
+from .workspace import Workspace
+
+
+@pytest.fixture
+def box(tmp_path_factory):
+    """Box without index, with beads root, middle (input: root) and leaf (no inputs)."""
+    box = Box('test', tmp_path_factory.mktemp('box'))
+    store_dependency_chain(box, tmp_path_factory, leaf_inputs=())
+    return box
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Names of beads, whose archive was opened by a raw resolver."""
+    opened = []
+    zip_archive = box_rawfs.ZipArchive
+
+    def tracing_zip_archive(path, box_name):
+        opened.append(path.name.split('_')[0])
+        return zip_archive(path, box_name)
+
+    monkeypatch.setattr(box_rawfs, 'ZipArchive', tracing_zip_archive)
+    return opened
+
+
+def new_process_box(box):
+    """The same box, as seen by a new process (nothing cached in memory)."""
+    return Box(box.name, box.directory)
+
+
+def summary(beads):
+    return sorted((bead.name, bead.kind, tuple(input.name for input in bead.inputs)) for bead in beads)
+
+
+def test_unchanged_archives_are_not_opened_again(box, opened):
+    expected = summary(box.all_beads())
+    assert raw_cache_path(box.directory).exists()
+
+    opened.clear()
+    assert expected == summary(new_process_box(box).all_beads())
+    assert 'middle' == new_process_box(box).search().by_kind('kind-middle').newest().name
+    assert [] == opened
+
+
+def test_new_and_changed_archives_are_opened(box, opened, tmp_path):
+    box.all_beads()
+    leaf_path = next(box.directory.glob('leaf_*.zip'))
+    os.utime(leaf_path, ns=(0, 0))
+    ws = Workspace(tmp_path / 'new')
+    ws.create('kind-new')
+    box.store(ws, TS3)
+
+    opened.clear()
+    assert ['leaf', 'middle', 'new', 'root'] == sorted(bead.name for bead in new_process_box(box).all_beads())
+    assert ['leaf', 'new'] == sorted(opened)
+
+
+def test_verified_search_opens_archives(box, opened):
+    box.all_beads()
+    opened.clear()
+    assert 3 == len(new_process_box(box).search().verified().all())
+    assert 3 == len(opened)
+
+
+def test_file_path_is_found_from_cache(box, opened):
+    middle = box.search().at_time(time_from_user(TS2)).first()
+    opened.clear()
+    path = new_process_box(box).resolver.get_file_path(middle.name, middle.content_id)
+    assert path.name.startswith('middle_')
+    assert [] == opened
+
+
+def test_damaged_cache_is_ignored(box):
+    expected = summary(box.all_beads())
+    raw_cache_path(box.directory).write_text('{"version": 1, "archives": {"x": 1')
+    assert expected == summary(new_process_box(box).all_beads())
+
+
+def test_deleted_archives_are_dropped_from_cache(box, tmp_path):
+    box.all_beads()
+    next(box.directory.glob('leaf_*.zip')).unlink()
+    ws = Workspace(tmp_path / 'new')
+    ws.create('kind-new')
+    box.store(ws, TS3)
+    new_process_box(box).all_beads()
+
+    archives = persistence.file_load(raw_cache_path(box.directory))['archives']
+    assert ['middle', 'new', 'root'] == sorted(file_name.split('_')[0] for file_name in archives)
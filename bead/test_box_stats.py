@@ -0,0 +1,62 @@
+import pytest
+
+from tests.boxes import TS1
+from tests.boxes import TS2
+from tests.boxes import store_bead
+
+from .box import Box
+from .box_index import BoxIndex
+from .box_stats import collect_stats
+
+
+@pytest.fixture
+def box(tmp_path_factory):
+    """Indexed box with two versions of 'big' and one of 'small'."""
+    box_dir = tmp_path_factory.mktemp('box')
+    BoxIndex(box_dir)
+    box = Box('test', box_dir)
+    store_bead(box, tmp_path_factory, 'big', TS1, data=b'x' * 10_000)
+    store_bead(box, tmp_path_factory, 'big', TS2, data=b'x' * 20_000)
+    store_bead(box, tmp_path_factory, 'small', TS1, data=b'x' * 100)
+    return box
+
+
+def test_counts_and_sizes(box):
+    stats = collect_stats(box.resolver)
+
+    assert 2 == stats.names
+    assert 3 == stats.versions
+    assert 30_100 == stats.data_bytes
+    assert stats.uncompressed_bytes > stats.data_bytes
+    assert sum(path.stat().st_size for path in box.directory.glob('*.zip')) == stats.archive_bytes
+    assert 0 == stats.unknown_sizes
+    assert [('big', 2, 30_000), ('small', 1, 100)] == [(s.name, s.versions, s.data_bytes) for s in stats.by_name]
+
+
+def test_index_health(box):
+    next(box.directory.glob('small_*.zip')).unlink()
+    stats = collect_stats(box.resolver)
+
+    assert 1 == stats.orphaned_beads
+    assert 0 == stats.orphaned_inputs
+    assert 0 == stats.unverified
+    assert 0 == stats.damaged
+    assert stats.index_bytes > 0
+    assert 0 <= stats.fragmentation < 1
+
+
+def test_query_timings(box):
+    stats = collect_stats(box.resolver)
+    assert {'newest by name', 'newest by kind', 'by content id', 'consumers', 'all beads'} == set(stats.query_seconds)
+    assert {} == collect_stats(box.resolver, timings=False).query_seconds
+
+
+def test_vacuum_returns_free_space(box):
+    for archive_path in box.directory.glob('big_*.zip'):
+        archive_path.unlink()
+    box.resolver.sync()
+    box.resolver.analyze()
+    box.resolver.vacuum()
+    stats = collect_stats(box.resolver)
+    assert 1 == stats.versions
+    assert 0 == stats.free_index_bytes
@@ -0,0 +1,234 @@
+import shutil
+import sys
+import threading
+
+import pytest
+
+from tests.boxes import TS1
+from tests.boxes import TS2
+from tests.boxes import store_bead
+
+from .box import Box
+from .box_index import BoxIndex
+from .box_watch import InotifyWatcher
+from .box_watch import PollingWatcher
+from .box_watch import UNKNOWN_CHANGES
+from .box_watch import create_watcher
+from .box_watch import watch
+from .exceptions import BoxIndexError
+from .exceptions import BoxWatchError
+
+inotify = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+
+
+@pytest.fixture
+def archives(tmp_path_factory):
+    box = Box('archives', tmp_path_factory.mktemp('archives'))
+    store_bead(box, tmp_path_factory, 'a', TS1)
+    store_bead(box, tmp_path_factory, 'b', TS2)
+    return {path.name.split('_')[0]: path for path in box.directory.glob('*.zip')}
+
+
+@pytest.fixture(params=['polling', pytest.param('inotify', marks=inotify)])
+def make_watcher(request):
+    watchers = []
+
+    def make_watcher(directory):
+        if request.param == 'inotify':
+            watcher = InotifyWatcher(directory)
+        else:
+            watcher = PollingWatcher(directory, interval=0.01)
+        watchers.append(watcher)
+        return watcher
+
+    yield make_watcher
+    for watcher in watchers:
+        watcher.close()
+
+
+def test_watcher_reports_new_renamed_and_deleted_archives(tmp_path, archives, make_watcher):
+    watcher = make_watcher(tmp_path)
+    assert set() == watcher.wait(timeout=0.05)
+
+    shutil.copy(archives['a'], tmp_path / 'a.zip')
+    assert {'a.zip'} == watcher.wait(timeout=5)
+    assert set() == watcher.wait(timeout=0.05)
+
+    (tmp_path / 'a.zip').rename(tmp_path / 'renamed.zip')
+    changed = watcher.wait(timeout=5)
+    changed |= watcher.wait(timeout=0.05)
+    assert {'a.zip', 'renamed.zip'} == changed
+
+    (tmp_path / 'renamed.zip').unlink()
+    assert {'renamed.zip'} == watcher.wait(timeout=5)
+
+
+def test_watcher_ignores_hidden_and_other_files(tmp_path, make_watcher):
+    watcher = make_watcher(tmp_path)
+    (tmp_path / '.index.sqlite').write_bytes(b'index')
+    (tmp_path / '.hidden.zip').write_bytes(b'zip')
+    (tmp_path / 'notes.txt').write_text('text')
+    assert set() == watcher.wait(timeout=0.1)
+
+
+def test_polling_watcher_reports_growing_archive_until_stable(tmp_path):
+    watcher = PollingWatcher(tmp_path, interval=0.01)
+    with open(tmp_path / 'a.zip', 'wb') as f:
+        for _ in range(3):
+            f.write(b'partial')
+            f.flush()
+            assert {'a.zip'} == watcher.wait(timeout=5)
+    assert set() == watcher.wait(timeout=0.05)
+
+
+def test_polling_watcher_fails_for_missing_directory(tmp_path):
+    with pytest.raises(BoxWatchError):
+        PollingWatcher(tmp_path / 'missing')
+
+
+def test_create_watcher_polls_when_interval_given(tmp_path):
+    watcher = create_watcher(tmp_path, poll_interval=0.5)
+    assert isinstance(watcher, PollingWatcher)
+    assert 0.5 == watcher.interval
+
+
+class FakeWatcher:
+    '''Replays a sequence of wait() results, then sets stop.'''
+
+    def __init__(self, results, stop, on_wait=None):
+        self.results = list(results)
+        self.stop = stop
+        self.on_wait = on_wait
+
+    def wait(self, timeout):
+        if self.on_wait is not None:
+            self.on_wait()
+        if not self.results:
+            self.stop.set()
+            return set()
+        return self.results.pop(0)
+
+
+@pytest.fixture
+def box_index(tmp_path):
+    return BoxIndex(tmp_path)
+
+
+def indexed_names(box_index):
+    return sorted(bead.name for bead in box_index.get_beads([], 'box'))
+
+
+def test_watch_syncs_once_after_a_burst(box_index, archives):
+    stop = threading.Event()
+    syncs = []
+    copies = iter(['a', 'b'])
+
+    def copy_next_archive():
+        name = next(copies, None)
+        if name is not None:
+            shutil.copy(archives[name], box_index.box_directory)
+
+    watcher = FakeWatcher([{'a.zip'}, {'b.zip'}, set()], stop, on_wait=copy_next_archive)
+    watch(box_index, watcher, debounce_seconds=0, verify=False, on_sync=syncs.append, stop=stop)
+
+    assert [{'a.zip', 'b.zip'}] == syncs
+    assert ['a', 'b'] == indexed_names(box_index)
+
+
+def test_watch_catches_up_before_watching(box_index, archives):
+    shutil.copy(archives['a'], box_index.box_directory)
+    stop = threading.Event()
+    watch(box_index, FakeWatcher([], stop), debounce_seconds=0, stop=stop)
+    assert ['a'] == indexed_names(box_index)
+
+
+def test_watch_removes_deleted_archives(box_index, archives):
+    archive_path = box_index.box_directory / archives['a'].name
+    shutil.copy(archives['a'], archive_path)
+    box_index.sync()
+    stop = threading.Event()
+    watcher = FakeWatcher([{UNKNOWN_CHANGES}, set()], stop, on_wait=lambda: archive_path.unlink(missing_ok=True))
+    watch(box_index, watcher, debounce_seconds=0, stop=stop)
+    assert [] == indexed_names(box_index)
+
+
+def fail_sync_once(box_index, monkeypatch, after=0):
+    """Make box_index.sync fail as if the index was locked, after `after` successful syncs."""
+    sync = box_index.sync
+    calls = []
+
+    def fail_once(*args, **kwargs):
+        calls.append(None)
+        if len(calls) == after + 1:
+            raise BoxIndexError('Failed to sync index: database is locked')
+        return sync(*args, **kwargs)
+
+    monkeypatch.setattr(box_index, 'sync', fail_once)
+
+
+def test_watch_continues_after_failed_catch_up(box_index, archives, monkeypatch):
+    fail_sync_once(box_index, monkeypatch)
+    errors = []
+    shutil.copy(archives['a'], box_index.box_directory)
+    stop = threading.Event()
+    watcher = FakeWatcher([set()], stop)
+    watch(box_index, watcher, debounce_seconds=0, stop=stop, on_error=errors.append, retry_seconds=0)
+    assert 1 == len(errors)
+    assert ['a'] == indexed_names(box_index)
+
+
+def test_watch_syncs_changes_of_failed_sync_with_next_burst(box_index, archives, monkeypatch):
+    fail_sync_once(box_index, monkeypatch, after=1)
+    errors = []
+    stop = threading.Event()
+    syncs = []
+    copies = iter(['a', None, 'b'])
+
+    def copy_next_archive():
+        name = next(copies, None)
+        if name is not None:
+            shutil.copy(archives[name], box_index.box_directory)
+
+    watcher = FakeWatcher([{'a.zip'}, set(), {'b.zip'}, set()], stop, on_wait=copy_next_archive)
+    watch(
+        box_index, watcher, debounce_seconds=0, verify=False, on_sync=syncs.append, stop=stop,
+        on_error=errors.append)
+
+    assert 1 == len(errors)
+    assert [{'a.zip', 'b.zip'}] == syncs
+    assert ['a', 'b'] == indexed_names(box_index)
+
+
+def test_watch_retries_failed_sync_without_new_changes(box_index, archives, monkeypatch):
+    fail_sync_once(box_index, monkeypatch, after=1)
+    errors = []
+    stop = threading.Event()
+    syncs = []
+    watcher = FakeWatcher(
+        [{'a.zip'}, set(), set()], stop, on_wait=lambda: shutil.copy(archives['a'], box_index.box_directory))
+    watch(
+        box_index, watcher, debounce_seconds=0, verify=False, on_sync=syncs.append, stop=stop,
+        on_error=errors.append, retry_seconds=0)
+
+    assert 1 == len(errors)
+    assert [{'a.zip'}] == syncs
+    assert ['a'] == indexed_names(box_index)
+
+
+@inotify
+def test_watch_indexes_archive_copied_into_box(box_index, archives):
+    stop = threading.Event()
+    synced = threading.Event()
+    watcher = InotifyWatcher(box_index.box_directory)
+    thread = threading.Thread(
+        target=watch, args=(box_index, watcher),
+        kwargs=dict(debounce_seconds=0.1, on_sync=lambda names: synced.set(), stop=stop))
+    thread.start()
+    try:
+        shutil.copy(archives['a'], box_index.box_directory)
+        assert synced.wait(timeout=10)
+    finally:
+        stop.set()
+        thread.join()
+        watcher.close()
+    assert ['a'] == indexed_names(box_index)
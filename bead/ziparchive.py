@@ -212,3 +212,20 @@ assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3_20150923.zip')
 assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3_20150923T010203012345+0200.zip')
 assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3_20150923T010203012345-0200.zip')
 assert 'bead-2015v3' == bead_name_from_file_path('path/to/bead-2015v3_20150923.zip')
+
+
+def freeze_time_str_from_file_path(path):
+    '''
+    Parse the freeze time part of a file path as created by Box.store.
+
+    Returns None, if the file name does not end in a full timestamp.
+    '''
+    name_with_timestamp, ext = os.path.splitext(os.path.basename(path))
+    match = re.search('_([0-9]{8}[tT][0-9]{12}[-+][0-9]{4})$', name_with_timestamp)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+assert '20150923T010203012345+0200' == freeze_time_str_from_file_path('path/to/bead_20150923T010203012345+0200.zip')
+assert freeze_time_str_from_file_path('bead-2015v3_20150923.zip') is None
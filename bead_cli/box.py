@@ -1,8 +1,16 @@
+import time
 from typing import TYPE_CHECKING
 
 from bead import tech
+from bead.box import search
+from bead.box_index import DEFAULT_INDEX_JOBS
+from bead.box_query import QueryOrder
+from bead.box_watch import DEFAULT_DEBOUNCE_SECONDS
+from bead.tech.timestamp import time_from_user
 
 from .cmdparse import Command
+from .common import print_query_trace
+from .common import warn_slow_box
 
 if TYPE_CHECKING:
     from .environment import Environment
@@ -78,14 +86,56 @@ class CmdForget(Command):
             print(f'WARNING: no box defined with "{name}"')
 
 
-def reindex(box):
+class IndexProgress:
+    '''
+    Print progress and estimated remaining time of indexing on a single line.
+    '''
+
+    MIN_REPORT_INTERVAL = 0.5  # seconds
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.last_report_time = 0.0
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if done < total and now - self.last_report_time < self.MIN_REPORT_INTERVAL:
+            return
+        self.last_report_time = now
+        elapsed = now - self.start_time
+        eta = elapsed / done * (total - done)
+        print(f'\r  {done}/{total} archives, elapsed {format_duration(elapsed)}, ETA {format_duration(eta)}',
+              end='', flush=True)
+        if done == total:
+            print()
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+def JOBS(parser):
+    parser.arg(
+        '--jobs', '-j', type=int, default=DEFAULT_INDEX_JOBS,
+        help='Number of archives read in parallel')
+
+
+def NO_VERIFY(parser):
+    parser.arg(
+        '--no-verify', dest='verify', action='store_false',
+        help='Index metadata only, without checking archive content (see "bead box verify")')
+
+
+def reindex(box, jobs=1, verify=True):
     '''Rebuild index for a single box.'''
     from bead.box_index import BoxIndex
 
     try:
         print(f'Rebuilding index for box "{box.name}" at {box.location}')
         box_index = BoxIndex(box.location)
-        box_index.rebuild()
+        box_index.rebuild(jobs=jobs, progress=IndexProgress(), verify=verify)
         print('  ✓ Done')
         return True
     except Exception as e:
@@ -93,14 +143,14 @@ def reindex(box):
         return False
 
 
-def reindex_directory(directory):
+def reindex_directory(directory, jobs=1, verify=True):
     '''Rebuild index for a directory.'''
     from bead.box_index import BoxIndex
 
     try:
         print(f'Rebuilding index for directory {directory}')
         box_index = BoxIndex(directory)
-        box_index.rebuild()
+        box_index.rebuild(jobs=jobs, progress=IndexProgress(), verify=verify)
         print('  ✓ Done')
         return True
     except Exception as e:
@@ -108,7 +158,7 @@ def reindex_directory(directory):
         return False
 
 
-def reindex_all(boxes):
+def reindex_all(boxes, jobs=1, verify=True):
     '''Rebuild indexes for all boxes.'''
     if not boxes:
         print('No boxes defined')
@@ -118,7 +168,7 @@ def reindex_all(boxes):
     success_count = 0
 
     for box in boxes:
-        if reindex(box):
+        if reindex(box, jobs, verify):
             success_count += 1
 
     print(f'Completed: {success_count}/{len(boxes)} boxes rebuilt successfully')
@@ -139,6 +189,8 @@ class CmdReindex(Command):
             group.add_argument('--all', action='store_true', help='Rebuild all boxes')
         
         arg(setup_mutually_exclusive_args)
+        arg(JOBS)
+        arg(NO_VERIFY)
 
     def run(self, args, env: 'Environment'):
         if not any([args.box, args.dir, args.all]):
@@ -146,7 +198,7 @@ class CmdReindex(Command):
             boxes = env.get_boxes()
             if len(boxes) == 1:
                 # Auto-use the single box
-                reindex(boxes[0])
+                reindex(boxes[0], args.jobs, args.verify)
                 return
             elif len(boxes) == 0:
                 print('ERROR: No boxes defined. Use "bead box add" to define a box first.')
@@ -156,14 +208,14 @@ class CmdReindex(Command):
                 return
         
         if args.all:
-            reindex_all(env.get_boxes())
+            reindex_all(env.get_boxes(), args.jobs, args.verify)
         elif args.dir:
             # Rebuild specific directory
             directory = args.dir
             if not directory.is_dir():
                 print(f'ERROR: "{directory}" is not an existing directory!')
                 return
-            reindex_directory(directory)
+            reindex_directory(directory, args.jobs, args.verify)
         else:
             # Rebuild specific box by name
             box_name = args.box
@@ -176,17 +228,17 @@ class CmdReindex(Command):
                 print(f'ERROR: Box "{box_name}" not found')
                 return
             
-            reindex(box)
+            reindex(box, args.jobs, args.verify)
 
 
-def index(box):
+def index(box, jobs=1, verify=True, full=False):
     '''Create or update index for a single box.'''
     from bead.box_index import BoxIndex
     
     try:
         print(f'Indexing box "{box.name}" at {box.location}')
         box_index = BoxIndex(box.location)
-        box_index.sync()
+        box_index.sync(jobs=jobs, progress=IndexProgress(), verify=verify, full=full)
         print('  ✓ Done')
         return True
     except Exception as e:
@@ -194,14 +246,14 @@ def index(box):
         return False
 
 
-def index_directory(directory):
+def index_directory(directory, jobs=1, verify=True, full=False):
     '''Create or update index for a directory.'''
     from bead.box_index import BoxIndex
     
     try:
         print(f'Indexing directory {directory}')
         box_index = BoxIndex(directory)
-        box_index.sync()
+        box_index.sync(jobs=jobs, progress=IndexProgress(), verify=verify, full=full)
         print('  ✓ Done')
         return True
     except Exception as e:
@@ -209,7 +261,7 @@ def index_directory(directory):
         return False
 
 
-def index_all(boxes):
+def index_all(boxes, jobs=1, verify=True, full=False):
     '''Create or update indexes for all boxes.'''
     if not boxes:
         print('No boxes defined')
@@ -219,7 +271,7 @@ def index_all(boxes):
     success_count = 0
     
     for box in boxes:
-        if index(box):
+        if index(box, jobs, verify, full):
             success_count += 1
     
     print(f'Completed: {success_count}/{len(boxes)} boxes indexed successfully')
@@ -240,6 +292,11 @@ class CmdIndex(Command):
             group.add_argument('--all', action='store_true', help='Index all boxes')
         
         arg(setup_mutually_exclusive_args)
+        arg(JOBS)
+        arg(NO_VERIFY)
+        arg('--full', action='store_true',
+            help='Check all archives, even if the box directory has not changed since the last index'
+            ' (finds archives overwritten in place)')
 
     def run(self, args, env: 'Environment'):
         if not any([args.box, args.dir, args.all]):
@@ -247,7 +304,7 @@ class CmdIndex(Command):
             boxes = env.get_boxes()
             if len(boxes) == 1:
                 # Auto-use the single box
-                index(boxes[0])
+                index(boxes[0], args.jobs, args.verify, args.full)
                 return
             elif len(boxes) == 0:
                 print('ERROR: No boxes defined. Use "bead box add" to define a box first.')
@@ -257,14 +314,14 @@ class CmdIndex(Command):
                 return
         
         if args.all:
-            index_all(env.get_boxes())
+            index_all(env.get_boxes(), args.jobs, args.verify, args.full)
         elif args.dir:
             # Index specific directory
             directory = args.dir
             if not directory.is_dir():
                 print(f'ERROR: "{directory}" is not an existing directory!')
                 return
-            index_directory(directory)
+            index_directory(directory, args.jobs, args.verify, args.full)
         else:
             # Index specific box by name
             box_name = args.box
@@ -277,4 +334,330 @@ class CmdIndex(Command):
                 print(f'ERROR: Box "{box_name}" not found')
                 return
             
-            index(box)
+            index(box, args.jobs, args.verify, args.full)
+
+
+def verify(location, description, jobs=1, recheck=False):
+    '''Verify content of indexed beads in a box directory.'''
+    from bead.box_index import BoxIndex
+    from bead.box_index import index_path_exists
+
+    print(f'Verifying {description}')
+    if not index_path_exists(tech.fs.Path(location)):
+        print('  ✗ Failed: not indexed, use "bead box index" first')
+        return False
+    try:
+        damaged_file_paths = BoxIndex(location).verify(jobs=jobs, progress=IndexProgress(), recheck=recheck)
+    except Exception as e:
+        print(f'  ✗ Failed: {e}')
+        return False
+    for file_path in sorted(damaged_file_paths):
+        print(f'  DAMAGED: {file_path}')
+    print('  ✓ Done')
+    return True
+
+
+class CmdVerify(Command):
+    '''
+    Verify content of archives indexed with "--no-verify" and record the results in the index.
+
+    Searches can then exclude damaged (or not yet verified) beads.
+    Progress is saved regularly, so an interrupted verification continues where it stopped.
+    It is safe to run it in the background.
+    '''
+
+    def declare(self, arg):
+        def setup_mutually_exclusive_args(parser):
+            group = parser.argparser.add_mutually_exclusive_group()
+            group.add_argument('--box', help='Box name to verify')
+            group.add_argument('--dir', type=tech.fs.Path, help='Box directory to verify')
+            group.add_argument('--all', action='store_true', help='Verify all boxes')
+
+        arg(setup_mutually_exclusive_args)
+        arg(JOBS)
+        arg('--recheck', action='store_true', help='Verify already verified beads as well')
+
+    def run(self, args, env: 'Environment'):
+        if args.dir:
+            if not args.dir.is_dir():
+                print(f'ERROR: "{args.dir}" is not an existing directory!')
+                return
+            verify(args.dir, f'directory {args.dir}', args.jobs, args.recheck)
+            return
+
+        boxes = env.get_boxes()
+        if args.box:
+            boxes = [box for box in boxes if box.name == args.box]
+            if not boxes:
+                print(f'ERROR: Unknown box "{args.box}"')
+                return
+        elif not args.all:
+            if len(boxes) == 0:
+                print('ERROR: No boxes defined. Use "bead box add" to define a box first.')
+                return
+            if len(boxes) > 1:
+                print('ERROR: Multiple boxes defined. Must specify either --box, --dir, or --all')
+                return
+
+        for box in boxes:
+            verify(box.location, f'box "{box.name}" at {box.location}', args.jobs, args.recheck)
+
+
+def watch(location, description, poll_interval=None, debounce_seconds=DEFAULT_DEBOUNCE_SECONDS, verify=True):
+    '''Keep the index of a box directory up to date, until interrupted.'''
+    from bead.box_index import BoxIndex
+    from bead.box_watch import InotifyWatcher
+    from bead.box_watch import UNKNOWN_CHANGES
+    from bead.box_watch import create_watcher
+    from bead.box_watch import watch as watch_box
+    from bead.exceptions import BoxIndexError
+    from bead.exceptions import BoxWatchError
+
+    def report(changed_names):
+        names = sorted(changed_names - {UNKNOWN_CHANGES})
+        print(f'  Indexed changes: {", ".join(names) if names else "(unknown)"}', flush=True)
+
+    def report_error(error):
+        print(f'  ✗ Failed: {error} (will retry)', flush=True)
+
+    try:
+        watcher = create_watcher(tech.fs.Path(location), poll_interval)
+    except BoxWatchError as e:
+        print(f'  ✗ Failed: {e}')
+        return False
+    method = 'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'
+    print(f'Watching {description} ({method}), press Ctrl-C to stop', flush=True)
+    try:
+        watch_box(BoxIndex(location), watcher, debounce_seconds, verify, on_sync=report, on_error=report_error)
+    except KeyboardInterrupt:
+        pass
+    except (BoxWatchError, BoxIndexError) as e:
+        print(f'  ✗ Failed: {e}')
+        return False
+    finally:
+        watcher.close()
+    print('  ✓ Done')
+    return True
+
+
+class CmdWatch(Command):
+    '''
+    Keep the index of a box up to date, while archives are added, renamed or removed.
+
+    Uses inotify on Linux, and polls the box directory elsewhere.
+    Use "--poll" on network file systems, where inotify does not see changes made on other machines.
+    Archives are indexed only after the box directory was quiet for the debounce time,
+    so archives still being copied are not read.
+    '''
+
+    def declare(self, arg):
+        def setup_mutually_exclusive_args(parser):
+            group = parser.argparser.add_mutually_exclusive_group()
+            group.add_argument('--box', help='Box name to watch')
+            group.add_argument('--dir', type=tech.fs.Path, help='Box directory to watch')
+
+        arg(setup_mutually_exclusive_args)
+        arg('--poll', type=float, metavar='SECONDS', dest='poll_interval',
+            help='Poll the box directory every SECONDS, instead of using inotify')
+        arg('--debounce', type=float, metavar='SECONDS', dest='debounce_seconds', default=DEFAULT_DEBOUNCE_SECONDS,
+            help='Index changes after the box directory was quiet for SECONDS (default: %(default)s)')
+        arg(NO_VERIFY)
+
+    def run(self, args, env: 'Environment'):
+        if args.dir:
+            if not args.dir.is_dir():
+                print(f'ERROR: "{args.dir}" is not an existing directory!')
+                return
+            watch(args.dir, f'directory {args.dir}', args.poll_interval, args.debounce_seconds, args.verify)
+            return
+
+        boxes = env.get_boxes()
+        if args.box:
+            boxes = [box for box in boxes if box.name == args.box]
+            if not boxes:
+                print(f'ERROR: Unknown box "{args.box}"')
+                return
+        elif len(boxes) == 0:
+            print('ERROR: No boxes defined. Use "bead box add" to define a box first.')
+            return
+        elif len(boxes) > 1:
+            print('ERROR: Multiple boxes defined. Must specify either --box or --dir')
+            return
+
+        box, = boxes
+        watch(
+            box.location, f'box "{box.name}" at {box.location}',
+            args.poll_interval, args.debounce_seconds, args.verify)
+
+
+def format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024 or unit == 'TiB':
+            return f'{size} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def print_stats(stats, top):
+    print(f'  Beads: {stats.names} names, {stats.versions} versions')
+    print(f'  Archives: {format_bytes(stats.archive_bytes)}')
+    print(f'  Uncompressed: {format_bytes(stats.uncompressed_bytes)} (data: {format_bytes(stats.data_bytes)})')
+    if stats.unknown_sizes:
+        print(f'  Sizes not known: {stats.unknown_sizes} beads (run "bead box index")')
+    print(
+        f'  Index: {format_bytes(stats.index_bytes)}'
+        f', {stats.fragmentation:.0%} fragmented ({format_bytes(stats.free_index_bytes)} free)')
+    print(f'  Unverified: {stats.unverified}, damaged: {stats.damaged}')
+    print(f'  Orphaned: {stats.orphaned_beads} beads without archive, {stats.orphaned_inputs} inputs without bead')
+    if stats.by_name and top:
+        print('  Largest names:')
+        for name_stats in stats.by_name[:top]:
+            print(
+                f'    {name_stats.name}: {name_stats.versions} versions, {format_bytes(name_stats.archive_bytes)}'
+                f' (data: {format_bytes(name_stats.data_bytes)})')
+    if stats.query_seconds:
+        print('  Query times:')
+        for description, seconds in stats.query_seconds.items():
+            print(f'    {description}: {seconds * 1000:.1f} ms')
+
+
+def stats(location, description, top=10, vacuum=False, analyze=False):
+    '''Report statistics of an indexed box directory, after maintenance if requested.'''
+    from bead.box_index import BoxIndex
+    from bead.box_index import index_path_exists
+    from bead.box_stats import collect_stats
+
+    print(f'Statistics of {description}')
+    if not index_path_exists(tech.fs.Path(location)):
+        print('  ✗ Failed: not indexed, use "bead box index" first')
+        return False
+    try:
+        box_index = BoxIndex(location)
+        if vacuum:
+            print('  Vacuuming index')
+            box_index.vacuum()
+        if analyze:
+            print('  Analyzing index')
+            box_index.analyze()
+        print_stats(collect_stats(box_index), top)
+    except Exception as e:
+        print(f'  ✗ Failed: {e}')
+        return False
+    return True
+
+
+class CmdStats(Command):
+    '''
+    Report bead counts, storage use and index health of indexed boxes.
+
+    With "--vacuum" and "--analyze" the index is also maintained (before the report).
+    '''
+
+    def declare(self, arg):
+        def setup_mutually_exclusive_args(parser):
+            group = parser.argparser.add_mutually_exclusive_group()
+            group.add_argument('--box', help='Box name to report on')
+            group.add_argument('--dir', type=tech.fs.Path, help='Box directory to report on')
+
+        arg(setup_mutually_exclusive_args)
+        arg('--top', type=int, default=10, metavar='N', help='Show the N names using the most space')
+        arg('--vacuum', action='store_true', help='Compact the index file')
+        arg('--analyze', action='store_true', help='Update query planner statistics of the index')
+
+    def run(self, args, env: 'Environment'):
+        if args.dir:
+            if not args.dir.is_dir():
+                print(f'ERROR: "{args.dir}" is not an existing directory!')
+                return
+            stats(args.dir, f'directory {args.dir}', args.top, args.vacuum, args.analyze)
+            return
+
+        boxes = env.get_boxes()
+        if args.box:
+            boxes = [box for box in boxes if box.name == args.box]
+            if not boxes:
+                print(f'ERROR: Unknown box "{args.box}"')
+                return
+        for box in boxes:
+            stats(box.location, f'box "{box.name}" at {box.location}', args.top, args.vacuum, args.analyze)
+
+
+# "bead box query" options with a value -> BeadSearch method
+QUERY_CONDITIONS = (
+    ('name', 'by_name'),
+    ('kind', 'by_kind'),
+    ('content_id', 'by_content_id'),
+    ('at', 'at_time'),
+    ('newer_than', 'newer_than'),
+    ('older_than', 'older_than'),
+    ('at_or_newer', 'at_or_newer'),
+    ('at_or_older', 'at_or_older'),
+    ('consumers_of', 'consumers_of'),
+    ('upstream_of', 'upstream_of'),
+    ('downstream_of', 'downstream_of'),
+)
+
+
+class CmdQuery(Command):
+    '''
+    Search beads in boxes, print the matching ones.
+
+    With "--explain" (or the BEAD_EXPLAIN environment variable, for all commands)
+    the resolver, SQL, query plan, archives opened, rows and time of each box is printed to stderr.
+    '''
+
+    def declare(self, arg):
+        arg('--box', action='append', dest='box_names', metavar='NAME',
+            help='Search only this box (can be repeated, default: all boxes)')
+        arg('--name', help='Bead name')
+        arg('--kind', help='Bead kind')
+        arg('--content-id', help='Content id of the bead')
+        for option in ('at', 'newer-than', 'older-than', 'at-or-newer', 'at-or-older'):
+            arg(f'--{option}', type=time_from_user, metavar='TIME', help=f'Freeze time {option.replace("-", " ")} TIME')
+        arg('--consumers-of', metavar='CONTENT_ID', help='Beads having the bead as input')
+        arg('--upstream-of', metavar='CONTENT_ID', help='Beads the bead depends on (transitively)')
+        arg('--downstream-of', metavar='CONTENT_ID', help='Beads depending on the bead (transitively)')
+        arg('--verified', action='store_true', help='Only beads with verified content')
+        arg('--undamaged', action='store_true', help='Exclude beads known to be damaged')
+
+        def setup_order_args(parser):
+            group = parser.argparser.add_mutually_exclusive_group()
+            group.add_argument('--newest', dest='order', action='store_const', const=QueryOrder.NEWEST_FIRST,
+                               help='Newest beads first')
+            group.add_argument('--oldest', dest='order', action='store_const', const=QueryOrder.OLDEST_FIRST,
+                               help='Oldest beads first')
+        arg(setup_order_args)
+        arg('--limit', type=int, metavar='N', help='Print at most N beads')
+        arg('--unique', action='store_true', help='Print beads with the same content only once')
+        arg('--explain', action='store_true', help='Explain how each box answered the search (on stderr)')
+
+    def run(self, args, env: 'Environment'):
+        boxes = env.get_boxes()
+        if args.box_names:
+            unknown = set(args.box_names) - {box.name for box in boxes}
+            if unknown:
+                print(f'ERROR: Unknown box "{sorted(unknown)[0]}"')
+                return
+            boxes = [box for box in boxes if box.name in args.box_names]
+        if args.explain:
+            for box in boxes:
+                box.on_query = print_query_trace
+
+        bead_search = search(boxes, warn_slow_box)
+        for option, method in QUERY_CONDITIONS:
+            value = getattr(args, option)
+            if value is not None:
+                getattr(bead_search, method)(value)
+        if args.verified:
+            bead_search.verified()
+        if args.undamaged:
+            bead_search.undamaged()
+        if args.unique:
+            bead_search.unique()
+        if args.limit is not None:
+            if args.limit < 0:
+                print('ERROR: --limit must not be negative')
+                return
+            bead_search.limit(args.limit)
+
+        for bead in bead_search.all(args.order):
+            print(f'{bead.box_name}: {bead.name} {bead.freeze_time_str} {bead.content_id}')
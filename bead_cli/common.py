@@ -31,11 +31,31 @@ def warning(msg):
     sys.stderr.write('\n')
 
 
+def warn_slow_box(box):
+    warning(f'Box "{box.name}" did not answer in {box.search_timeout:g} seconds - its beads are ignored')
+
+
 def info(msg):
     sys.stderr.write(msg)
     sys.stderr.write('\n')
 
 
+def print_query_trace(trace):
+    '''
+    Explain how a box answered a search (see bead.box_explain).
+    '''
+    lines = [
+        f'EXPLAIN box "{trace.box_name}" ({trace.resolver}): {trace.query}',
+        f'  {trace.seconds * 1000:.1f} ms, {trace.rows} rows, {trace.archives_opened} archives opened'
+        + (', cached' if trace.cached else ''),
+    ]
+    if trace.sql is not None:
+        lines.append('  SQL: ' + ' '.join(trace.sql.split()))
+    lines.extend(f'  PLAN: {step}' for step in trace.query_plan)
+    # a single write: boxes are searched concurrently
+    info('\n'.join(lines))
+
+
 def OPTIONAL_WORKSPACE(parser):
     '''
     Define `workspace` as option, defaulting to current directory
@@ -101,7 +121,7 @@ def resolve_bead(env, bead_ref_base, time) -> Archive:
 
     # not a file - try box search
     boxes = env.get_boxes()
-    bead = bead_box.search(boxes).by_name(bead_ref_base).at_or_older(time).newest()
+    bead = bead_box.search(boxes, warn_slow_box).by_name(bead_ref_base).at_or_older(time).newest()
     return bead_box.resolve(boxes, bead)
 
 
@@ -5,9 +5,12 @@ User specific environment
 import os
 
 from bead.box import Box
+from bead.box_explain import is_explain_requested
 from bead.tech import persistence
 from bead.tech.fs import Path
 
+from .common import print_query_trace
+
 ENV_BOXES = 'boxes'
 BOX_NAME = 'name'
 BOX_LOCATION = 'directory'
@@ -23,6 +26,8 @@ class Environment:
     def __init__(self, filename: Path):
         self.filename = filename
         self._content = {}
+        # (name, location) -> Box, boxes are reused to share their query caches within the process
+        self._boxes = {}
         if os.path.exists(self.filename):
             self.load()
 
@@ -40,9 +45,12 @@ class Environment:
 
     def get_boxes(self):
         def box(box_spec):
-            return Box(
-                box_spec.get(BOX_NAME),
-                Path(box_spec.get(BOX_LOCATION)))
+            key = (box_spec.get(BOX_NAME), Path(box_spec.get(BOX_LOCATION)))
+            if key not in self._boxes:
+                self._boxes[key] = Box(*key)
+                if is_explain_requested():
+                    self._boxes[key].on_query = print_query_trace
+            return self._boxes[key]
         return [box(spec) for spec in self._content.get(ENV_BOXES, ())]
 
     def set_boxes(self, boxes):
@@ -1,8 +1,10 @@
 import os.path
 from typing import TYPE_CHECKING
 
+from bead.box import lookup
 from bead.box import resolve
 from bead.box import search
+from bead.box_query import BeadLookup
 from bead.exceptions import InvalidArchive
 from bead.workspace import Workspace
 
@@ -19,6 +21,7 @@ from .common import assert_valid_workspace
 from .common import die
 from .common import resolve_bead
 from .common import verify_with_feedback
+from .common import warn_slow_box
 from .common import warning
 
 if TYPE_CHECKING:
@@ -124,11 +127,15 @@ class CmdUpdate(Command):
         if args.bead_offset:
             die("--next, --prev can not be specified when updating all inputs")
         workspace = get_workspace(args)
-        for input in workspace.inputs:
+        inputs = workspace.inputs
+        boxes = env.get_boxes()
+        candidates = lookup(
+            boxes, [BeadLookup.newest_of_kind(input.kind, args.bead_time) for input in inputs], warn_slow_box)
+        for input, beads in zip(inputs, candidates):
             try:
-                bead = search(env.get_boxes()).by_kind(input.kind).at_or_older(args.bead_time).newest()
+                bead = _newest(beads)
                 # Resolve bead to archive for _update_input
-                archive = resolve(env.get_boxes(), bead)
+                archive = resolve(boxes, bead)
             except LookupError:
                 if workspace.is_loaded(input.name):
                     print(
@@ -156,14 +163,14 @@ class CmdUpdate(Command):
             try:
                 if args.bead_offset:
                     # handle --prev --next - use kind instead of bead name
-                    query = search(boxes).by_kind(input.kind)
+                    query = search(boxes, warn_slow_box).by_kind(input.kind)
                     if args.bead_offset == 1:
                         bead = query.newer_than(input.freeze_time).oldest()  # next = oldest of newer beads
                     else:
                         bead = query.older_than(input.freeze_time).newest()  # prev = newest of older beads
                 else:
                     # --time - use kind instead of bead name
-                    bead = search(boxes).by_kind(input.kind).at_or_older(args.bead_time).newest()
+                    bead = search(boxes, warn_slow_box).by_kind(input.kind).at_or_older(args.bead_time).newest()
                 # Resolve bead to archive
                 archive = resolve(boxes, bead)
             except LookupError:
@@ -179,6 +186,13 @@ class CmdUpdate(Command):
             die('Can not find matching bead')
 
 
+def _newest(beads):
+    '''Newest of beads, the first one of the newest ones in box order.'''
+    if not beads:
+        raise LookupError("No beads found")
+    return max(beads, key=lambda bead: bead.freeze_time)
+
+
 def _update_input(workspace, input, archive):
     if workspace.is_loaded(input.name) and input.content_id == archive.content_id:
         assert input.kind == archive.kind
@@ -207,35 +221,44 @@ class CmdLoad(Command):
         if input_nick is ALL_INPUTS:
             inputs = workspace.inputs
             if inputs:
-                for input in inputs:
-                    _load(env, workspace, input)
+                _load_inputs(env, workspace, inputs)
             else:
                 warning('No inputs defined to load.')
         else:
             if not workspace.has_input(input_nick):
                 die(f'No input with name {input_nick}')
-            _load(env, workspace, workspace.get_input(input_nick))
+            _load_inputs(env, workspace, [workspace.get_input(input_nick)])
 
 
-def _load(env, workspace, input):
-    assert input is not None
-    if not workspace.is_loaded(input.name):
-        content_id = input.content_id
-        archive = None
-        for box in env.get_boxes():
-            # Only try to find by exact content_id match
-            try:
-                bead = box.search().by_content_id(content_id).first()
-                archive = box.resolve(bead)
-                break
-            except LookupError:
-                continue
-        if archive is None:
-            warning(f'Could not find bead for input "{input.name}" - not loaded!')
-            return
-        _check_load_with_feedback(workspace, input.name, archive)
-    else:
-        print(f'"{input.name}" is already loaded - skipping')
+def _load_inputs(env, workspace, inputs):
+    '''
+    Load inputs, that are not loaded yet.
+
+    Beads are looked up for all inputs at once, by exact content_id match.
+    '''
+    boxes = env.get_boxes()
+    inputs_to_load = [input for input in inputs if not workspace.is_loaded(input.name)]
+    candidates = lookup(boxes, [BeadLookup.by_content_id(input.content_id) for input in inputs_to_load], warn_slow_box)
+    candidates_by_name = {input.name: beads for input, beads in zip(inputs_to_load, candidates)}
+    for input in inputs:
+        if input.name in candidates_by_name:
+            _load(boxes, workspace, input, candidates_by_name[input.name])
+        else:
+            print(f'"{input.name}" is already loaded - skipping')
+
+
+def _load(boxes, workspace, input, beads):
+    archive = None
+    for bead in beads:
+        try:
+            archive = resolve(boxes, bead)
+            break
+        except LookupError:
+            continue
+    if archive is None:
+        warning(f'Could not find bead for input "{input.name}" - not loaded!')
+        return
+    _check_load_with_feedback(workspace, input.name, archive)
 
 
 def _check_load_with_feedback(workspace: Workspace, input_nick, archive):
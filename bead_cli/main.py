@@ -85,6 +85,10 @@ def make_argument_parser(defaults):
         ('forget', box.CmdForget, 'Forget a known box.'),
         ('index', box.CmdIndex, 'Create or update box index for faster searches.'),
         ('reindex', box.CmdReindex, 'Rebuild box index from scratch.'),
+        ('verify', box.CmdVerify, 'Verify content of archives indexed without verification.'),
+        ('watch', box.CmdWatch, 'Keep box index up to date while archives change.'),
+        ('stats', box.CmdStats, 'Show storage use and index health of boxes.'),
+        ('query', box.CmdQuery, 'Search beads in boxes, optionally explaining how the boxes answered.'),
     )
 
     parser.autocomplete()
@@ -0,0 +1,130 @@
+from contextlib import closing
+import sqlite3
+
+from bead import box_index
+from bead.box_index import BoxIndex
+
+
+def test_index_creates_index(robot, box, bead_with_history):
+    robot.cli('box', 'index', '--jobs', '2')
+
+    assert '5/5 archives' in robot.stdout
+    assert '✓ Done' in robot.stdout
+    assert (box.directory / '.index.sqlite').exists()
+    with robot.environment as env:
+        box = env.get_box('box')
+        assert isinstance(box.resolver, BoxIndex)
+        assert 5 == len(box.search().by_name(bead_with_history).all())
+
+
+def test_index_reports_locked_index(robot, box, bead_a, monkeypatch):
+    robot.cli('box', 'index')
+    monkeypatch.setattr(box_index, 'BUSY_TIMEOUT_SECONDS', 0.01)
+    monkeypatch.setattr(box_index, 'BUSY_RETRY_DELAY_SECONDS', 0.001)
+    with closing(sqlite3.connect(box.directory / '.index.sqlite', isolation_level=None)) as conn:
+        conn.execute('BEGIN EXCLUSIVE')
+        robot.cli('box', 'index', '--full')
+
+    assert '✗ Failed' in robot.stdout
+    assert '✓ Done' not in robot.stdout
+
+
+def test_index_of_indexed_box_reads_only_new_archives(robot, box, bead_with_history, bead_a):
+    robot.cli('box', 'index', '--box', 'box', '-j', '1')
+    assert '6/6 archives' in robot.stdout
+
+    robot.cli('box', 'index', '--box', 'box')
+    assert 'archives' not in robot.stdout
+    assert '✓ Done' in robot.stdout
+
+
+def test_reindex_parallel(robot, box, bead_with_history, bead_with_inputs):
+    robot.cli('box', 'reindex', '--all', '--jobs', '4')
+
+    assert '8/8 archives' in robot.stdout
+    assert 'Completed: 1/1 boxes rebuilt successfully' in robot.stdout
+    with robot.environment as env:
+        beads = env.get_box('box').all_beads()
+    assert 8 == len(beads)
+    assert {'input_a', 'input_b'} == {input.name for bead in beads for input in bead.inputs}
+
+
+def test_index_without_verification_then_verify(robot, box, bead_with_history):
+    robot.cli('box', 'index', '--no-verify')
+    with robot.environment as env:
+        assert [] == env.get_box('box').search().verified().all()
+
+    robot.cli('box', 'verify', '--box', 'box', '--jobs', '2')
+    assert '5/5 archives' in robot.stdout
+    assert 'DAMAGED' not in robot.stdout
+    with robot.environment as env:
+        assert 5 == len(env.get_box('box').search().verified().all())
+
+    robot.cli('box', 'verify')
+    assert 'archives' not in robot.stdout
+    assert '✓ Done' in robot.stdout
+
+
+def test_verify_unindexed_box_fails(robot, box, bead_a):
+    robot.cli('box', 'verify')
+    assert 'not indexed' in robot.stdout
+
+
+def test_full_index(robot, box, bead_with_history):
+    robot.cli('box', 'index')
+    robot.cli('box', 'index', '--full')
+    assert 'archives' not in robot.stdout
+    assert '✓ Done' in robot.stdout
+
+
+def test_watch_unknown_box(robot, box):
+    robot.cli('box', 'watch', '--box', 'unknown')
+    assert 'Unknown box "unknown"' in robot.stdout
+
+
+def test_stats(robot, box, bead_with_history):
+    robot.cli('box', 'index')
+    robot.cli('box', 'stats', '--vacuum', '--analyze')
+    assert 'Beads: 1 names, 5 versions' in robot.stdout
+    assert f'{bead_with_history}: 5 versions' in robot.stdout
+    assert 'Query times:' in robot.stdout
+    assert '✗' not in robot.stdout
+
+
+def test_stats_of_unindexed_box_fails(robot, box, bead_a):
+    robot.cli('box', 'stats')
+    assert 'not indexed' in robot.stdout
+
+
+def test_query(robot, box, bead_with_history):
+    robot.cli('box', 'query', '--name', bead_with_history, '--oldest', '--limit', '2')
+    lines = robot.stdout.splitlines()
+    assert 2 == len(lines)
+    assert lines[0].startswith(f'box: {bead_with_history} ')
+    assert lines == sorted(lines)
+
+
+def test_query_explain_of_indexed_box(robot, box, bead_with_history):
+    robot.cli('box', 'index')
+    robot.cli('box', 'query', '--name', bead_with_history, '--newest', '--explain')
+
+    assert 5 == len(robot.stdout.splitlines())
+    assert 'EXPLAIN box "box" (BoxIndex)' in robot.stderr
+    assert '5 rows, 0 archives opened' in robot.stderr
+    assert 'SQL: SELECT' in robot.stderr
+    assert 'PLAN: ' in robot.stderr
+
+
+def test_explain_from_environment(robot, box, bead_with_history, monkeypatch):
+    monkeypatch.setenv('BEAD_EXPLAIN', '1')
+    robot.cli('box', 'query', '--kind', 'unknown')
+
+    assert '' == robot.stdout
+    assert 'EXPLAIN box "box" (RawFilesystemResolver)' in robot.stderr
+    assert '0 rows' in robot.stderr
+    assert 'SQL:' not in robot.stderr
+
+
+def test_query_unknown_box(robot, box):
+    robot.cli('box', 'query', '--box', 'unknown')
+    assert 'Unknown box "unknown"' in robot.stdout
@@ -2,10 +2,17 @@ import re
 
 import pytest
 
+from bead.box import Box
+from bead.box_index import BoxIndex
 from bead.tech.fs import read_file
 from bead.tech.fs import rmtree
 from bead.tech.fs import write_file
+from bead_cli.web.commands import load_all_dummies
+from bead_cli.web.io import read_beads
 from bead_cli.web.sketch import Sketch
+from tests.boxes import TS1
+from tests.boxes import TS2
+from tests.boxes import store_bead
 from tests.sketcher import Sketcher
 from tests.web.test_graphviz import needs_dot
 
@@ -127,3 +134,31 @@ def test_filter_filtered_out_sink(robot, indirect_links_sketch):
 
     sketch = Sketch.from_file(robot.cwd / 'filtered.web')
     assert sketch.cluster_by_name.keys() == set('bc')
+
+
+def test_indexed_box_is_exported_from_index(robot, bead_with_inputs, box):
+    robot.cli('web save raw.web')
+    robot.cli('box index')
+    with robot.environment as env:
+        assert isinstance(env.get_box(box.name).resolver, BoxIndex)
+
+    robot.cli('web save indexed.web')
+
+    def beads(file_name):
+        return sorted(
+            (bead.box_name, bead.name, bead.content_id, bead.freeze_time_str, tuple(sorted(bead.inputs)))
+            for bead in read_beads(robot.cwd / file_name))
+    assert beads('raw.web') == beads('indexed.web')
+
+
+def test_dummies_are_loaded_in_box_order(tmp_path_factory):
+    raw_box = Box('raw', tmp_path_factory.mktemp('raw'))
+    indexed_box = Box('indexed', tmp_path_factory.mktemp('indexed'))
+    store_bead(raw_box, tmp_path_factory, 'raw_bead', TS1)
+    store_bead(indexed_box, tmp_path_factory, 'indexed_bead', TS2)
+    BoxIndex(indexed_box.directory).rebuild()
+    indexed_box = Box('indexed', indexed_box.directory)
+    assert isinstance(indexed_box.resolver, BoxIndex)
+
+    dummies = load_all_dummies([raw_box, indexed_box])
+    assert ['raw', 'indexed'] == [dummy.box_name for dummy in dummies]
@@ -8,10 +8,12 @@ import webbrowser
 
 from bead import tech
 from bead.box import search
+from bead.box_index import BoxIndex
 
 from . import sketch as web_sketch
 from ..cmdparse import Command
 from ..common import die
+from ..common import warn_slow_box
 from .dummy import Dummy
 from .io import read_beads
 from .io import write_beads
@@ -148,9 +150,9 @@ class LoadAll(SketchProcessor):
         self.boxes = boxes
 
     def __call__(self, _sketch):
-        beads = load_all_beads(self.boxes)
+        beads = load_all_dummies(self.boxes)
         print(f"Loaded {len(beads)} beads")
-        return self.sketch_from_beads(beads)
+        return Sketch.from_beads(beads)
 
 
 class Load(ProcessorWithFileName):
@@ -249,10 +251,50 @@ SUBCOMMANDS = {
 }
 
 
+def load_all_dummies(boxes):
+    '''
+    Load all beads in boxes as Dummy-s.
+
+    Indexed boxes are exported in bulk from their index,
+    other boxes are searched bead by bead.
+    The dummies are returned in the order of boxes.
+    '''
+    indexed_boxes = [box for box in boxes if isinstance(box.resolver, BoxIndex)]
+    other_boxes = [box for box in boxes if not isinstance(box.resolver, BoxIndex)]
+    dummies_by_box = {box.name: [] for box in boxes}
+    for box in indexed_boxes:
+        dummies_by_box[box.name].extend(export_dummies(box))
+    for bead in load_all_beads(other_boxes):
+        dummies_by_box[bead.box_name].append(Dummy.from_bead(bead))
+    return [dummy for box_dummies in dummies_by_box.values() for dummy in box_dummies]
+
+
+def export_dummies(box):
+    '''
+    Dummy-s of all beads in an indexed box, with two sequential index scans.
+    '''
+    dummies = {
+        (name, content_id): Dummy(
+            name=name,
+            content_id=content_id,
+            kind=kind,
+            freeze_time_str=freeze_time_str,
+            box_name=box.name)
+        for name, content_id, kind, freeze_time_str in box.resolver.iter_bead_rows()}
+    for bead_name, bead_content_id, input_spec in box.resolver.iter_input_rows():
+        dummy = dummies.get((bead_name, bead_content_id))
+        # the bead might have been added after the beads were scanned
+        if dummy is not None:
+            dummy.inputs.append(input_spec)
+    return list(dummies.values())
+
+
 def load_all_beads(boxes):
+    if not boxes:
+        return []
     columns = int(os.environ.get('COLUMNS', 80))
     all_beads = []
-    for n, bead in enumerate(search(boxes).all()):
+    for n, bead in enumerate(search(boxes, warn_slow_box).iter()):
         msg = f"\rLoaded bead {n + 1} ({bead.box_name} : {bead.name} @ {bead.freeze_time_str})"[:columns]
         msg = msg + ' ' * (columns - len(msg))
         print(msg, end="", flush=True)
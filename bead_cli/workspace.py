@@ -3,6 +3,8 @@ from typing import TYPE_CHECKING
 
 from bead import layouts
 from bead import tech
+from bead.box import lookup
+from bead.box_query import BeadLookup
 from bead.exceptions import BoxError
 from bead.exceptions import InvalidArchive
 from bead.workspace import Workspace
@@ -19,6 +21,7 @@ from .common import die
 from .common import info
 from .common import resolve_bead
 from .common import verify_with_feedback
+from .common import warn_slow_box
 from .common import warning
 
 if TYPE_CHECKING:
@@ -176,10 +179,17 @@ def print_inputs(env, workspace, verbose):
     if inputs:
         boxes = env.get_boxes()
 
+        # the bead of each input, and the best candidate of its kind in each box
+        lookups = []
+        for input in inputs:
+            lookups.append(BeadLookup.by_content_id(input.content_id))
+            lookups.append(BeadLookup.newest_of_kind(input.kind, input.freeze_time))
+        answers = lookup(boxes, lookups, warn_slow_box)
+
         print('Inputs:')
         has_not_loaded = False
         is_not_first_input = True
-        for input in inputs:
+        for input, same_beads, best_beads in zip(inputs, answers[0::2], answers[1::2]):
             if is_not_first_input:
                 print('')
             is_not_loaded = not workspace.is_loaded(input.name)
@@ -188,14 +198,7 @@ def print_inputs(env, workspace, verbose):
             print(f'\tStatus:      {"**NOT LOADED**" if is_not_loaded else "loaded"}')
 
             # Find bead name by content_id
-            bead_name = None
-            for box in boxes:
-                try:
-                    bead = box.search().by_content_id(input.content_id).first()
-                    bead_name = bead.name
-                    break
-                except LookupError:
-                    continue
+            bead_name = same_beads[0].name if same_beads else None
 
             if bead_name:
                 print(f'\tBead:        {bead_name} # {input.freeze_time_str}')
@@ -206,20 +209,13 @@ def print_inputs(env, workspace, verbose):
                 print(f'\tKind:        {input.kind}')
                 print(f'\tContent id:  {input.content_id}')
             print('\tBox[es]:')
-            has_box = False
-            # find by kind, then check for exact match
-            for box in boxes:
-                try:
-                    # First search by kind and freeze time to find best match
-                    best_bead = box.search().by_kind(input.kind).at_or_older(input.freeze_time).newest()
-                    has_box = True
-                    # Check if the best match is also an exact content_id match
-                    if best_bead.content_id == input.content_id:
-                        print(f'\t * -r {box.name} # {best_bead.freeze_time_str}')
-                    else:
-                        print(f'\t ~ -r {box.name} # {best_bead.freeze_time_str} (kind match)')
-                except LookupError:
-                    pass
+            has_box = bool(best_beads)
+            # best match by kind and freeze time in each box, then check for exact match
+            for best_bead in best_beads:
+                if best_bead.content_id == input.content_id:
+                    print(f'\t * -r {best_bead.box_name} # {best_bead.freeze_time_str}')
+                else:
+                    print(f'\t ~ -r {best_bead.box_name} # {best_bead.freeze_time_str} (kind match)')
             if not has_box:
                 print('\t - no candidates :(')
                 print('\t   Maybe it has been renamed? or is it in an unreachable box?')
@@ -0,0 +1,14 @@
+import appdirs
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def user_cache_dir(tmp_path_factory, monkeypatch):
+    """Keep user-local box caches (shadow indexes, archive metadata) out of the real user cache."""
+    cache_dir = tmp_path_factory.mktemp('user-cache')
+
+    def user_cache_dir(appname=None, *args, **kwargs):
+        return str(cache_dir / appname) if appname else str(cache_dir)
+
+    monkeypatch.setattr(appdirs, 'user_cache_dir', user_cache_dir)
+    return cache_dir
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+'''
+Stress test for concurrent saves into one indexed box.
+
+Starts N processes, each saving beads into the same box, like CI workers running "bead save".
+Reports sustained saves per second, and how many archives are missing from the index:
+right after the saves (before and after counting the pending-ingest queue), and after a sync.
+
+Run from the repository root:
+
+    dev/stress-index.py --savers 8 --saves 50
+'''
+
+import argparse
+from contextlib import closing
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bead.box import Box
+from bead.box_index import BoxIndex
+from bead.box_index import read_pending_archive_names
+from bead.tech.timestamp import timestamp
+from bead.workspace import Workspace
+
+
+def save_beads(box_directory, workspaces_directory, saver, saves):
+    box = Box('stress', box_directory)
+    workspace = Workspace(Path(workspaces_directory) / f'saver-{saver}')
+    workspace.create(f'kind-{saver}')
+    for _ in range(saves):
+        box.store(workspace, timestamp())
+    return saves
+
+
+def indexed_file_paths(box_directory):
+    with closing(sqlite3.connect(box_directory / '.index.sqlite')) as conn:
+        return {file_path for file_path, in conn.execute('SELECT file_path FROM beads')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--savers', type=int, default=os.cpu_count() or 1, help='Number of concurrent savers')
+    parser.add_argument('--saves', type=int, default=50, help='Number of saves per saver')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        box_directory = Path(temp) / 'box'
+        box_directory.mkdir()
+        BoxIndex(box_directory).rebuild()
+
+        start = time.perf_counter()
+        with Pool(args.savers) as pool:
+            saved = sum(pool.starmap(
+                save_beads,
+                [(box_directory, temp, saver, args.saves) for saver in range(args.savers)]))
+        elapsed = time.perf_counter() - start
+
+        archives = {path.name for path in box_directory.glob('*.zip')}
+        missing = archives - indexed_file_paths(box_directory)
+        pending = set(read_pending_archive_names(BoxIndex(box_directory).pending_path))
+        BoxIndex(box_directory).sync(verify=False)
+        missing_after_sync = archives - indexed_file_paths(box_directory)
+
+        print(f'{args.savers} savers, {saved} saves in {elapsed:.2f}s: {saved / elapsed:.1f} saves/s')
+        print(f'archives: {len(archives)}')
+        print(f'not indexed after saves: {len(missing)} ({len(missing - pending)} not queued either)')
+        print(f'not indexed after sync: {len(missing_after_sync)}')
+        return 1 if missing - pending or missing_after_sync else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
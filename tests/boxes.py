@@ -0,0 +1,42 @@
+'''
+Beads stored into boxes, for the tests of boxes and their resolvers.
+
+Most box tests search a small dependency chain: root (TS1) <- middle (TS2) <- leaf (TS3).
+'''
+
+from bead.bead import Bead
+from bead.workspace import Workspace
+
+TS1 = '20160704T000000000000+0200'
+TS2 = '20160704T162800000000+0200'
+TS3 = '20160704T162800000001+0200'
+
+
+def store_bead(box, tmp_path_factory, name, freeze_time, inputs=(), kind=None, data=None) -> Bead:
+    '''
+    Store a new bead into box, return it as found in the box.
+
+    inputs are (input nick, Bead) pairs, kind defaults to `kind-{name}`,
+    data (bytes) is stored as the output file `data`.
+    '''
+    ws = Workspace(tmp_path_factory.mktemp('workspaces') / name)
+    ws.create(kind or f'kind-{name}')
+    for input_nick, input_bead in inputs:
+        ws.add_input(input_nick, input_bead.kind, input_bead.content_id, input_bead.freeze_time_str)
+    if data is not None:
+        (ws.directory / 'output' / 'data').write_bytes(data)
+    box.store(ws, freeze_time)
+    return box.search().by_name(name).newest()
+
+
+def store_dependency_chain(box, tmp_path_factory, leaf_inputs=('middle',)) -> dict[str, Bead]:
+    '''
+    Store root, middle (input: root) and leaf (inputs: leaf_inputs of root and middle) into box.
+
+    Returns the stored beads by name.
+    '''
+    beads = {}
+    beads['root'] = store_bead(box, tmp_path_factory, 'root', TS1)
+    beads['middle'] = store_bead(box, tmp_path_factory, 'middle', TS2, [('root', beads['root'])])
+    beads['leaf'] = store_bead(box, tmp_path_factory, 'leaf', TS3, [(nick, beads[nick]) for nick in leaf_inputs])
+    return beads